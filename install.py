@@ -8,33 +8,121 @@ and record what happened. Designed to be small, readable, and predictable.
 from __future__ import annotations
 
 import argparse
+import ast
+import asyncio
+import atexit
+import contextvars
+import errno
+import gzip
+import hashlib
+import io
+import itertools
 import json
 import os
+import platform
+import runpy
+import select
+import shlex
 import shutil
+import signal
+import struct
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
-
-try:
-    import jsonschema
-except ImportError:  # pragma: no cover
-    jsonschema = None
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 DEFAULT_INSTALL_DIR = "~/.claude"
 SETTINGS_FILE = "settings.json"
 WRAPPER_REQUIRED_MODULES = {"do", "omo", "codeagent", "research-pro"}
+COPY_STRATEGIES = ("copy", "reflink", "hardlink", "symlink")
+LOG_FORMATS = ("text", "json")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 5
+LOG_SPOOL_KEEP = 20
+COMMAND_TAIL_BYTES = 4 * 1024
+COMMAND_READ_CHUNK = 64 * 1024
+LINK_STRATEGIES = {"hardlink", "symlink"}
+CONFIG_CACHE_FILE = ".config_validated.json"
+CONFIG_CACHE_KEEP = 16
+STATUS_INDEX_FILE = ".status_index.json"
+WRAPPER_CACHE_FILE = ".codeagent-wrapper.cache.json"
+# Seconds a cached wrapper from the unpinned "latest" release is trusted
+WRAPPER_LATEST_TTL = 24 * 3600
+BUNDLE_FORMAT = 1
+BUNDLE_MANIFEST = "bundle.json"
+BUNDLE_PREFIX = "files/"
+BUNDLE_COMMON_FILES = ("templates/models.json.example", "templates/hook-dispatch.py", "memorys/CLAUDE.md")
+BUNDLE_WRAPPER_FILES = ("install.sh", "install.bat")
+WATCH_POLL_INTERVAL = 0.5
+WATCH_DEBOUNCE = 0.05
+INSTALL_LOCK_FILE = ".install.lock"
+JOURNAL_FILE = ".install-journal.jsonl"
+JOURNAL_FORMAT = 1
+SHELL_BUILTINS = {".", ":", "[", "cd", "command", "eval", "exec", "export", "set", "source", "test", "true"}
+LOCK_TIMEOUT = 120.0
+LOCK_POLL_INTERVAL = 0.1
+TRASH_DIR = ".trash"
+TRASH_MANIFEST = "trash.json"
+TRASH_FORMAT = 1
+TRASH_RETENTION_DAYS = 7.0
+TRASH_MAX_ENTRIES = 10
+HOOK_DISPATCHER = ".hook-dispatch.py"
+HOOK_DISPATCHER_SOURCE = "templates/hook-dispatch.py"
+HOOK_DEFAULT_TIMEOUT = 60
+VERIFY_REPORT_KEYS = (
+    "missing", "modified", "extra", "hooks_missing", "agents_missing", "agents_changed", "errors",
+)
+
+# Shared-resource guards for parallel module installs. Module file operations
+# run on a worker pool; anything that read-modify-writes a shared file, or the
+# wrapper build, is serialized here.
+_STATE_LOCK = threading.RLock()
+_WRAPPER_LOCK = threading.Lock()
+_PROCESS_T0 = time.perf_counter()
+
+
+def _default_jobs() -> int:
+    return min(8, (os.cpu_count() or 1) + 4)
 
 
 def _remove_readonly(func, path, _exc_info):
     """Handle read-only files on Windows during shutil.rmtree."""
     import stat
 
-    os.chmod(path, stat.S_IWRITE)
+    # chmod follows symlinks; never touch the link's source
+    if not os.path.islink(path):
+        os.chmod(path, stat.S_IWRITE)
     func(path)
 
 
+def _no_follow(path: Path) -> Path:
+    """Absolute path with its parents resolved but the last component kept.
+
+    Installed files may be symlinks into the source checkout; resolving them
+    fully would point removals and overwrites at the source instead.
+    """
+    path = Path(path).expanduser()
+    return path.parent.resolve() / path.name
+
+
+class _ContextPool(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run in a copy of the submitter's context.
+
+    Context variables such as the per-target output buffer of run_targets()
+    then follow a task into nested pools.
+    """
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
 def _ensure_list(ctx: Dict[str, Any], key: str) -> List[Any]:
     ctx.setdefault(key, [])
     return ctx[key]
@@ -54,6 +142,16 @@ def parse_args(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
         default=DEFAULT_INSTALL_DIR,
         help="Installation directory (defaults to ~/.claude)",
     )
+    parser.add_argument(
+        "--install-dirs",
+        nargs="+",
+        metavar="DIR",
+        help=(
+            "Install into several directories in one run (requires --module, "
+            "--update, --verify, --status or --list-modules); sources are "
+            "hashed and the wrapper built once, then targets run in parallel"
+        ),
+    )
     parser.add_argument(
         "--module",
         help="Comma-separated modules to install/uninstall, or 'all'",
@@ -83,6 +181,93 @@ def parse_args(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
         action="store_true",
         help="Update already installed modules",
     )
+    parser.add_argument(
+        "--undo-last",
+        action="store_true",
+        help="Restore the modules removed by the most recent uninstall from the trash",
+    )
+    parser.add_argument(
+        "--trash-retention",
+        type=float,
+        default=TRASH_RETENTION_DAYS,
+        metavar="DAYS",
+        help=(
+            "How long uninstalled files stay in <install-dir>/.trash for --undo-last "
+            f"before a background purge deletes them (default: {TRASH_RETENTION_DAYS:g}; "
+            f"at most {TRASH_MAX_ENTRIES} uninstalls are kept)"
+        ),
+    )
+    parser.add_argument("--purge-trash", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--compact-hooks",
+        dest="compact_hooks",
+        action="store_const",
+        const=True,
+        default=None,
+        help=(
+            "Merge each module's hooks that share an event and matcher into one "
+            "entry run by a single dispatcher, and drop no-op hooks; stays on for "
+            "later runs. Without --module, rewrites settings.json in place"
+        ),
+    )
+    parser.add_argument(
+        "--no-compact-hooks",
+        dest="compact_hooks",
+        action="store_const",
+        const=False,
+        help="Restore the original hook entries replaced by --compact-hooks",
+    )
+    parser.add_argument(
+        "--refresh-wrapper",
+        action="store_true",
+        help=(
+            "Ignore the cached codeagent-wrapper and run install.sh, which checks "
+            "for a newer release (a cached \"latest\" wrapper is otherwise trusted "
+            f"for {WRAPPER_LATEST_TTL // 3600} hours)"
+        ),
+    )
+    parser.add_argument(
+        "--verify",
+        nargs="?",
+        const="",
+        metavar="REPORT_JSON",
+        help=(
+            "Compare installed modules (or those in --module) with their sources "
+            "and exit 1 on drift; with a path, also write a JSON report ('-' for stdout)"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Update installed modules (or those in --module), then keep mirroring "
+            "source edits into the install dir until Ctrl-C"
+        ),
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help=(
+            "Check every operation of the modules to install or update and print "
+            "the plan with size estimates, without writing anything"
+        ),
+    )
+    parser.add_argument(
+        "--keep-partial",
+        action="store_true",
+        help=(
+            "If a --module install fails, keep the operations it completed "
+            "instead of rolling back, so --resume can continue it"
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Continue a failed --keep-partial install: skip operations the previous "
+            "run completed whose sources and installed files are unchanged"
+        ),
+    )
     parser.add_argument(
         "--force",
         action="store_true",
@@ -93,6 +278,61 @@ def parse_args(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
         action="store_true",
         help="Enable verbose output to terminal",
     )
+    parser.add_argument(
+        "--copy-strategy",
+        choices=COPY_STRATEGIES,
+        default="copy",
+        help=(
+            "How copy operations place files: copy (default), reflink "
+            "(copy-on-write clone, falls back to copy), hardlink or symlink "
+            "(share content with the source checkout; for developer installs)"
+        ),
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=LOG_FORMATS,
+        default="text",
+        help="install.log format: text (default) or json (one JSON object per line)",
+    )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=None,
+        help="Max modules installed in parallel (defaults to min(8, cpu+4); 1 = sequential)",
+    )
+    parser.add_argument(
+        "--lock-timeout",
+        type=float,
+        default=LOCK_TIMEOUT,
+        metavar="SECONDS",
+        help=(
+            "How long to wait for another install into the same dir (or "
+            f"models.json edit) to finish (default: {LOCK_TIMEOUT:g})"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        metavar="TRACE_JSON",
+        help=(
+            "Print per-module/per-operation timings at the end; with a path, "
+            "also write a Chrome trace (chrome://tracing, Perfetto)"
+        ),
+    )
+    parser.add_argument(
+        "--pack",
+        metavar="BUNDLE",
+        help=(
+            "Write the selected modules (default: all) and a manifest to BUNDLE "
+            "(.tar, .tar.gz, .tgz, .tar.xz, .tar.bz2 or .zip) and exit"
+        ),
+    )
+    parser.add_argument(
+        "--from-bundle",
+        metavar="BUNDLE",
+        help="Install from a bundle made by --pack instead of the source checkout",
+    )
     return parser.parse_args(argv)
 
 
@@ -107,11 +347,106 @@ def _load_json(path: Path) -> Any:
 
 
 def _save_json(path: Path, data: Any) -> None:
-    """Save data to JSON file with proper formatting."""
+    """Save data to JSON file with proper formatting (atomically)."""
+    _write_text_atomic(path, _dump_json(data))
+
+
+def _dump_json(data: Any) -> str:
+    return json.dumps(data, indent=2, ensure_ascii=False) + "\n"
+
+
+def _write_text_atomic(path: Path, text: str) -> None:
+    """Write via a temp file in the same dir + fsync + rename.
+
+    Readers (e.g. a running Claude session) never observe a truncated file.
+    """
+    path = Path(path)
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as fh:
-        json.dump(data, fh, indent=2, ensure_ascii=False)
-        fh.write("\n")
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with tmp.open("w", encoding="utf-8") as fh:
+            fh.write(text)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if path.exists():
+            # Keep permissions the user set on e.g. settings.json
+            shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+class FileLock:
+    """Advisory exclusive lock held on a lock file (flock, or msvcrt on Windows).
+
+    Cooperating installer processes serialize on it; nothing else is blocked.
+    acquire() waits up to timeout seconds, then raises TimeoutError naming
+    the pid recorded by the holder.
+    """
+
+    def __init__(self, path: Path, timeout: float = LOCK_TIMEOUT):
+        self.path = Path(path)
+        self.timeout = timeout
+        self._fh: Optional[Any] = None
+
+    def _try_lock(self, fh: Any) -> bool:
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _holder(self) -> str:
+        try:
+            pid = self.path.read_text(encoding="utf-8").strip()
+        except OSError:
+            return "another process"
+        return f"pid {pid}" if pid.isdigit() else "another process"
+
+    def acquire(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fh = open(self.path, "a+", encoding="utf-8")
+        deadline = time.monotonic() + self.timeout
+        while not self._try_lock(fh):
+            if time.monotonic() >= deadline:
+                fh.close()
+                raise TimeoutError(
+                    f"{self.path} is held by {self._holder()}; gave up after "
+                    f"{self.timeout:g}s (another install running? see --lock-timeout)"
+                )
+            time.sleep(LOCK_POLL_INTERVAL)
+        fh.seek(0)
+        fh.truncate()
+        fh.write(f"{os.getpid()}\n")
+        fh.flush()
+        self._fh = fh
+
+    def release(self) -> None:
+        fh, self._fh = self._fh, None
+        if fh is None:
+            return
+        try:
+            fh.seek(0)
+            fh.truncate()
+        except OSError:
+            pass
+        # Closing the handle drops the lock
+        fh.close()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
 
 
 # =============================================================================
@@ -132,7 +467,468 @@ def load_settings(ctx: Dict[str, Any]) -> Dict[str, Any]:
 def save_settings(ctx: Dict[str, Any], settings: Dict[str, Any]) -> None:
     """Save settings.json to install directory."""
     settings_path = ctx["install_dir"] / SETTINGS_FILE
-    _save_json(settings_path, settings)
+    _write_text_atomic(settings_path, _dump_json(settings))
+
+
+class JsonSession:
+    """A shared JSON file loaded once; edits apply in memory until commit().
+
+    commit() writes atomically and only when the serialized content differs
+    from what was loaded, so a run touching the file for many modules parses
+    and rewrites it at most once and leaves its mtime alone on no-ops.
+    """
+
+    def __init__(
+        self, path: Path, default: Optional[Dict[str, Any]] = None, strict: bool = False
+    ):
+        self.path = Path(path)
+        self.data: Dict[str, Any] = {}
+        # None: the file must be written even if data stays unchanged
+        self._baseline: Optional[str] = None
+        self._loaded_sig = _stat_signature(self.path)
+        if self.path.exists():
+            try:
+                loaded = _load_json(self.path)
+                if isinstance(loaded, dict):
+                    self.data = loaded
+            except (ValueError, FileNotFoundError):
+                # strict: never replace a file we could not parse
+                if strict:
+                    raise
+            self._baseline = _dump_json(self.data)
+        elif default is None:
+            self._baseline = _dump_json(self.data)
+        else:
+            self.data = default
+
+    @property
+    def dirty(self) -> bool:
+        return _dump_json(self.data) != self._baseline
+
+    def commit(self) -> bool:
+        """Write the file if its content changed. Returns True if written."""
+        text = _dump_json(self.data)
+        if text == self._baseline:
+            return False
+        _write_text_atomic(self.path, text)
+        self._baseline = text
+        self._loaded_sig = _stat_signature(self.path)
+        return True
+
+
+def _hook_key(entry: Dict[str, Any]) -> str:
+    """Canonical content hash of a hook entry, ignoring the __module__ marker."""
+    body = {k: v for k, v in entry.items() if k != "__module__"}
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SettingsSession(JsonSession):
+    """settings.json with module hook edits (see JsonSession).
+
+    Module-tagged hook entries are indexed by (module, content hash) per hook
+    type, so duplicate checks are O(1) and unmerge/orphan cleanup only visit
+    the hook types a module actually has entries in. The index is built on
+    first use; call invalidate_hook_index() after replacing data wholesale.
+
+    Compacted entries (see compact_module_hooks) keep the entries they
+    replaced under __dispatch__ and are indexed under those too.
+    """
+
+    DISPATCH_KEY = "__dispatch__"
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._hook_index: Optional[Dict[str, set]] = None
+        self._module_hook_types: Dict[str, set] = {}
+
+    @property
+    def hooks(self) -> Dict[str, Any]:
+        hooks = self.data.get("hooks")
+        if not isinstance(hooks, dict):
+            hooks = self.data["hooks"] = {}
+        return hooks
+
+    def invalidate_hook_index(self) -> None:
+        self._hook_index = None
+        self._module_hook_types = {}
+
+    def _index(self) -> Dict[str, set]:
+        if self._hook_index is not None:
+            return self._hook_index
+        index: Dict[str, set] = {}
+        module_types: Dict[str, set] = {}
+        hooks = self.data.get("hooks")
+        if isinstance(hooks, dict):
+            for hook_type, entries in hooks.items():
+                if not isinstance(entries, list):
+                    continue
+                keys = index.setdefault(hook_type, set())
+                for entry in entries:
+                    if not isinstance(entry, dict):
+                        continue
+                    module = entry.get("__module__")
+                    keys.add((module, _hook_key(entry)))
+                    # A compacted entry stands in for its originals
+                    dispatch = entry.get(self.DISPATCH_KEY)
+                    if isinstance(dispatch, dict):
+                        for original in dispatch.get("entries") or []:
+                            if isinstance(original, dict):
+                                keys.add((module, _hook_key(original)))
+                    if module is not None:
+                        module_types.setdefault(module, set()).add(hook_type)
+        self._hook_index = index
+        self._module_hook_types = module_types
+        return index
+
+    def hook_modules(self) -> set:
+        """Names of all modules that currently own at least one hook entry."""
+        self._index()
+        return set(self._module_hook_types)
+
+    def add_module_hook(self, hook_type: str, entry: Dict[str, Any]) -> bool:
+        """Append a tagged entry unless its module already has identical content.
+
+        Returns True if the entry was added.
+        """
+        module = entry.get("__module__")
+        key = (module, _hook_key(entry))
+        keys = self._index().setdefault(hook_type, set())
+        if key in keys:
+            return False
+
+        entries = self.hooks.get(hook_type)
+        if not isinstance(entries, list):
+            entries = self.hooks[hook_type] = []
+        entries.append(entry)
+        keys.add(key)
+        if module is not None:
+            self._module_hook_types.setdefault(module, set()).add(hook_type)
+        return True
+
+    def module_hooks(self, module_name: str) -> Dict[str, List[Dict[str, Any]]]:
+        """Copies of the hook entries tagged with module_name, by hook type."""
+        self._index()
+        hooks = self.data.get("hooks")
+        found: Dict[str, List[Dict[str, Any]]] = {}
+        if not isinstance(hooks, dict):
+            return found
+        for hook_type in self._module_hook_types.get(module_name, ()):
+            entries = [
+                dict(entry) for entry in hooks.get(hook_type) or []
+                if isinstance(entry, dict) and entry.get("__module__") == module_name
+            ]
+            if entries:
+                found[hook_type] = entries
+        return found
+
+    def expand_module_hooks(self, module_name: str) -> int:
+        """Put back the entries replaced by module_name's compacted ones. Returns how many expanded."""
+        hooks = self.data.get("hooks")
+        if not isinstance(hooks, dict):
+            return 0
+        expanded = 0
+        for hook_type, entries in hooks.items():
+            if not isinstance(entries, list):
+                continue
+            restored = []
+            for entry in entries:
+                dispatch = entry.get(self.DISPATCH_KEY) if isinstance(entry, dict) else None
+                if isinstance(dispatch, dict) and entry.get("__module__") == module_name:
+                    restored.extend(dict(e) for e in dispatch.get("entries") or [] if isinstance(e, dict))
+                    expanded += 1
+                else:
+                    restored.append(entry)
+            hooks[hook_type] = restored
+        if expanded:
+            self.invalidate_hook_index()
+        return expanded
+
+    def compact_module_hooks(
+        self,
+        module_name: str,
+        dispatch_command: Callable[[str], str],
+        is_noop: Callable[[Dict[str, Any]], bool],
+    ) -> Tuple[int, int, int]:
+        """Merge module_name's entries that share an event and matcher into one.
+
+        Command hooks for which is_noop() holds are dropped. When two or more
+        commands remain they run through one dispatch_command(group_id)
+        command, which reads them back from the entry's __dispatch__ record.
+        That record also keeps the replaced entries, so expand_module_hooks()
+        (or removing the module) reverses the compaction.
+        Returns (entries replaced, entries written, hooks dropped).
+        """
+        self.expand_module_hooks(module_name)
+        hooks = self.data.get("hooks")
+        if not isinstance(hooks, dict):
+            return 0, 0, 0
+
+        replaced = written = dropped = 0
+        for hook_type, entries in hooks.items():
+            if not isinstance(entries, list):
+                continue
+            groups: Dict[str, List[Dict[str, Any]]] = {}
+            for entry in entries:
+                if isinstance(entry, dict) and entry.get("__module__") == module_name:
+                    groups.setdefault(json.dumps(entry.get("matcher")), []).append(entry)
+
+            compacted: Dict[str, Optional[Dict[str, Any]]] = {}
+            for n, (key, group) in enumerate(groups.items()):
+                members = [h for e in group for h in e.get("hooks") or [] if isinstance(h, dict)]
+                run = [h for h in members if h.get("type") == "command" and not is_noop(h)]
+                others = [h for h in members if h.get("type") != "command"]
+                drop = len(members) - len(run) - len(others)
+                if len(group) == 1 and not drop and len(run) < 2:
+                    continue
+
+                group_id = f"{module_name}:{hook_type}:{n}"
+                merged = {k: v for k, v in group[0].items() if k != "hooks"}
+                if len(run) > 1:
+                    dispatcher: Dict[str, Any] = {"type": "command", "command": dispatch_command(group_id)}
+                    if any("timeout" in h for h in run):
+                        dispatcher["timeout"] = sum(h.get("timeout", HOOK_DEFAULT_TIMEOUT) for h in run)
+                    merged["hooks"] = others + [dispatcher]
+                else:
+                    merged["hooks"] = others + run
+                    run = []
+                merged[self.DISPATCH_KEY] = {"id": group_id, "run": run, "entries": [dict(e) for e in group]}
+                compacted[key] = merged
+                replaced += len(group)
+                written += 1
+                dropped += drop
+
+            if not compacted:
+                continue
+            kept = []
+            for entry in entries:
+                if isinstance(entry, dict) and entry.get("__module__") == module_name:
+                    key = json.dumps(entry.get("matcher"))
+                    if key in compacted:
+                        # The compacted entry takes the place of the group's first one
+                        if compacted[key] is not None:
+                            kept.append(compacted[key])
+                            compacted[key] = None
+                        continue
+                kept.append(entry)
+            hooks[hook_type] = kept
+
+        self.invalidate_hook_index()
+        return replaced, written, dropped
+
+    def remove_module_hooks(self, module_name: str) -> bool:
+        """Drop every hook entry tagged with module_name. Returns True if any."""
+        index = self._index()
+        hook_types = self._module_hook_types.pop(module_name, set())
+        hooks = self.data.get("hooks")
+        if not hook_types or not isinstance(hooks, dict):
+            return False
+
+        removed = False
+        for hook_type in hook_types:
+            entries = hooks.get(hook_type)
+            if not isinstance(entries, list):
+                continue
+            kept = [
+                entry for entry in entries
+                if not (isinstance(entry, dict) and entry.get("__module__") == module_name)
+            ]
+            removed = removed or len(kept) < len(entries)
+            index[hook_type] = {key for key in index.get(hook_type, ()) if key[0] != module_name}
+            if kept:
+                hooks[hook_type] = kept
+            else:
+                del hooks[hook_type]
+                index.pop(hook_type, None)
+
+        if not hooks:
+            self.data.pop("hooks", None)
+        return removed
+
+
+class ModelsSession(JsonSession):
+    """~/.codeagent/models.json with module agent edits (see JsonSession).
+
+    Agents installed by a module carry ``__module__``; prompt_file values
+    backfilled into user-owned agents carry the two prompt markers so they
+    can be rolled back.
+
+    models.json lives under HOME and is shared by installs into different
+    dirs, so commit() holds a lock next to it and, if another process
+    rewrote the file since it was loaded, replays this session's edits onto
+    the new content instead of overwriting it.
+    """
+
+    PROMPT_MARKER_MODULE = "__prompt_file_module__"
+    PROMPT_MARKER_VALUE = "__prompt_file_module_value__"
+
+    def __init__(self, path: Path, template: Optional[Path] = None):
+        default: Dict[str, Any] = {
+            "default_backend": "codex",
+            "default_model": "gpt-4.1",
+            "backends": {},
+            "agents": {},
+        }
+        if template is not None and template.exists() and not Path(path).exists():
+            default = _load_json(template)
+            # Clear template agents so modules populate with __module__ tags
+            default["agents"] = {}
+        super().__init__(path, default, strict=True)
+        self.lock_timeout = LOCK_TIMEOUT
+        self._edits: List[Tuple[str, tuple]] = []
+
+    def commit(self) -> bool:
+        with FileLock(self.path.with_name(f".{self.path.name}.lock"), self.lock_timeout):
+            if self._edits and _stat_signature(self.path) != self._loaded_sig and self.path.exists():
+                edits, self._edits = self._edits, []
+                loaded = _load_json(self.path)
+                self.data = loaded if isinstance(loaded, dict) else {}
+                self._baseline = _dump_json(self.data)
+                for method, edit_args in edits:
+                    getattr(self, method)(*edit_args)
+            return super().commit()
+
+    @property
+    def agents(self) -> Dict[str, Any]:
+        agents = self.data.get("agents")
+        if not isinstance(agents, dict):
+            agents = self.data["agents"] = {}
+        return agents
+
+    def add_module_agents(self, module_name: str, agents: Dict[str, Any]) -> int:
+        """Merge a module's agents. Returns the number of prompt_file backfills."""
+        self._edits.append(("add_module_agents", (module_name, agents)))
+        models_agents = self.agents
+        prompt_files_backfilled = 0
+        for agent_name, agent_cfg in agents.items():
+            entry = dict(agent_cfg)
+            entry["__module__"] = module_name
+
+            # On Windows, expand ~ and normalize path separators for prompt_file
+            if sys.platform == "win32" and "prompt_file" in entry and entry["prompt_file"]:
+                entry["prompt_file"] = str(Path(entry["prompt_file"]).expanduser())
+
+            existing = models_agents.get(agent_name, {})
+            if not existing or (isinstance(existing, dict) and existing.get("__module__")):
+                models_agents[agent_name] = entry
+                continue
+
+            # Do not overwrite user-owned agent configs (no __module__). However, we can
+            # safely backfill missing prompt_file so skills ship self-contained prompts.
+            if not isinstance(existing, dict):
+                models_agents[agent_name] = entry
+                continue
+
+            desired_prompt = str(entry.get("prompt_file", "")).strip()
+            existing_prompt = str(existing.get("prompt_file", "")).strip()
+            if desired_prompt and not existing_prompt:
+                updated = dict(existing)
+                updated["prompt_file"] = desired_prompt
+                updated[self.PROMPT_MARKER_MODULE] = module_name
+                updated[self.PROMPT_MARKER_VALUE] = desired_prompt
+                models_agents[agent_name] = updated
+                prompt_files_backfilled += 1
+        return prompt_files_backfilled
+
+    def module_agents(self, module_name: str) -> Dict[str, Any]:
+        """Copies of the agents module_name installed, without the __module__ tag."""
+        agents = self.data.get("agents")
+        if not isinstance(agents, dict):
+            return {}
+        return {
+            name: {k: v for k, v in cfg.items() if k != "__module__"}
+            for name, cfg in agents.items()
+            if isinstance(cfg, dict) and cfg.get("__module__") == module_name
+        }
+
+    def remove_module_agents(
+        self, module_name: str, fallbacks: Iterable[Tuple[str, Dict[str, Any]]] = ()
+    ) -> Tuple[int, int]:
+        """Remove a module's agents and roll back its prompt_file backfills.
+
+        fallbacks lists (module, agents) still installed, in priority order; a
+        removed agent also declared there is restored from the first match so
+        shared agents (e.g. 'develop') are not lost.
+        Returns (agents removed, prompt_file backfills rolled back).
+        """
+        fallbacks = list(fallbacks)
+        self._edits.append(("remove_module_agents", (module_name, fallbacks)))
+        agents = self.data.get("agents")
+        if not isinstance(agents, dict):
+            return 0, 0
+
+        to_remove = [
+            name
+            for name, cfg in agents.items()
+            if isinstance(cfg, dict) and cfg.get("__module__") == module_name
+        ]
+        for name in to_remove:
+            del agents[name]
+            for other_mod, other_agents in fallbacks:
+                other_cfg = other_agents.get(name) if isinstance(other_agents, dict) else None
+                if isinstance(other_cfg, dict):
+                    restored = dict(other_cfg)
+                    restored["__module__"] = other_mod
+                    agents[name] = restored
+                    break
+
+        prompt_files_rolled_back = 0
+        for cfg in agents.values():
+            if not isinstance(cfg, dict):
+                continue
+            if cfg.get(self.PROMPT_MARKER_MODULE) != module_name:
+                continue
+            expected = str(cfg.get(self.PROMPT_MARKER_VALUE, "")).strip()
+            actual = str(cfg.get("prompt_file", "")).strip()
+            if expected and actual == expected:
+                cfg.pop("prompt_file", None)
+                prompt_files_rolled_back += 1
+            cfg.pop(self.PROMPT_MARKER_MODULE, None)
+            cfg.pop(self.PROMPT_MARKER_VALUE, None)
+
+        return len(to_remove), prompt_files_rolled_back
+
+
+def settings_session(ctx: Dict[str, Any]) -> SettingsSession:
+    """The run's shared settings.json session (created on first use)."""
+    with _STATE_LOCK:
+        session = ctx.get("_settings_session")
+        if session is None:
+            session = SettingsSession(ctx["install_dir"] / SETTINGS_FILE)
+            ctx["_settings_session"] = session
+        return session
+
+
+def models_path() -> Path:
+    return Path.home() / ".codeagent" / "models.json"
+
+
+def models_session(ctx: Dict[str, Any]) -> ModelsSession:
+    """The run's shared models.json session (created on first use)."""
+    with _STATE_LOCK:
+        session = ctx.get("_models_session")
+        if session is None:
+            template = ctx["config_dir"] / "templates" / "models.json.example"
+            session = ModelsSession(models_path(), template)
+            session.lock_timeout = ctx["lock_timeout"]
+            # models.json lives under HOME: targets of one run share a session
+            for peer in ctx.get("_peers") or [ctx]:
+                peer.setdefault("_models_session", session)
+        return session
+
+
+def flush_shared_files(ctx: Dict[str, Any]) -> List[str]:
+    """Commit pending settings.json and models.json edits; returns files written."""
+    written = []
+    with _STATE_LOCK:
+        compaction = apply_hook_compaction(ctx)
+        if compaction is not None:
+            ctx["_hook_compaction"] = compaction
+        for key in ("_settings_session", "_models_session"):
+            session = ctx.get(key)
+            if session is not None and session.commit():
+                written.append(str(session.path))
+    return written
 
 
 def find_module_hooks(module_name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> List[tuple]:
@@ -211,9 +1007,8 @@ def merge_hooks_to_settings(
     ctx: Dict[str, Any],
     plugin_root: str = "",
 ) -> bool:
-    """Merge module hooks into settings.json."""
-    settings = load_settings(ctx)
-    settings.setdefault("hooks", {})
+    """Merge module hooks into the settings session (see flush_shared_files)."""
+    session = settings_session(ctx)
 
     module_hooks = hooks_config.get("hooks", {})
     marker = _create_hook_marker(module_name)
@@ -224,82 +1019,34 @@ def merge_hooks_to_settings(
 
     modified = False
     for hook_type, hook_entries in module_hooks.items():
-        settings["hooks"].setdefault(hook_type, [])
-
         for entry in hook_entries:
             # Add marker to identify this hook's source module
             entry_copy = dict(entry)
             entry_copy["__module__"] = module_name
-
-            # Check if already exists (avoid duplicates)
-            exists = False
-            for existing in settings["hooks"][hook_type]:
-                if existing.get("__module__") == module_name:
-                    # Same module, check if same hook
-                    if _hooks_equal(existing, entry_copy):
-                        exists = True
-                        break
-
-            if not exists:
-                settings["hooks"][hook_type].append(entry_copy)
+            if session.add_module_hook(hook_type, entry_copy):
                 modified = True
 
     if modified:
-        save_settings(ctx, settings)
         write_log({"level": "INFO", "message": f"Merged hooks for module: {module_name}"}, ctx)
 
     return modified
 
 
 def unmerge_hooks_from_settings(module_name: str, ctx: Dict[str, Any]) -> None:
-    """Remove module hooks from settings.json."""
-    settings = load_settings(ctx)
-
-    if "hooks" not in settings:
-        return
-
-    modified = False
-    for hook_type in list(settings["hooks"].keys()):
-        original_len = len(settings["hooks"][hook_type])
-        settings["hooks"][hook_type] = [
-            entry for entry in settings["hooks"][hook_type]
-            if entry.get("__module__") != module_name
-        ]
-        if len(settings["hooks"][hook_type]) < original_len:
-            modified = True
-
-        # Remove empty hook type arrays
-        if not settings["hooks"][hook_type]:
-            del settings["hooks"][hook_type]
-
-    if modified:
-        save_settings(ctx, settings)
+    """Remove module hooks from the settings session (see flush_shared_files)."""
+    if settings_session(ctx).remove_module_hooks(module_name):
         write_log({"level": "INFO", "message": f"Removed hooks for module: {module_name}"}, ctx)
 
 
 def cleanup_orphaned_hooks(config: Dict[str, Any], ctx: Dict[str, Any]) -> List[str]:
     """Remove hooks from modules no longer in config. Returns sorted list of orphaned module names removed."""
-    settings = load_settings(ctx)
-    if "hooks" not in settings:
-        return []
-
+    session = settings_session(ctx)
     known_modules = set(config.get("modules", {}).keys())
-    orphaned: set = set()
-
-    for hook_type in list(settings["hooks"].keys()):
-        kept = []
-        for entry in settings["hooks"][hook_type]:
-            mod = entry.get("__module__")
-            if mod is not None and mod not in known_modules:
-                orphaned.add(mod)
-            else:
-                kept.append(entry)
-        settings["hooks"][hook_type] = kept
-        if not kept:
-            del settings["hooks"][hook_type]
+    orphaned = session.hook_modules() - known_modules
+    for mod in orphaned:
+        session.remove_module_hooks(mod)
 
     if orphaned:
-        save_settings(ctx, settings)
         write_log(
             {"level": "INFO", "message": f"Removed orphaned hooks for: {', '.join(sorted(orphaned))}"},
             ctx,
@@ -308,65 +1055,106 @@ def cleanup_orphaned_hooks(config: Dict[str, Any], ctx: Dict[str, Any]) -> List[
     return sorted(orphaned)
 
 
-def merge_agents_to_models(module_name: str, agents: Dict[str, Any], ctx: Dict[str, Any]) -> None:
-    """Merge module agent configs into ~/.codeagent/models.json."""
-    prompt_marker_module = "__prompt_file_module__"
-    prompt_marker_value = "__prompt_file_module_value__"
+# Globals of templates/hook-dispatch.py, loaded once for its python_argv()
+_HOOK_DISPATCH: Dict[str, Any] = {}
 
-    models_path = Path.home() / ".codeagent" / "models.json"
-    models_path.parent.mkdir(parents=True, exist_ok=True)
 
-    if models_path.exists():
-        with models_path.open("r", encoding="utf-8") as fh:
-            models = json.load(fh)
-    else:
-        template = ctx["config_dir"] / "templates" / "models.json.example"
-        if template.exists():
-            with template.open("r", encoding="utf-8") as fh:
-                models = json.load(fh)
-            # Clear template agents so modules populate with __module__ tags
-            models["agents"] = {}
-        else:
-            models = {
-                "default_backend": "codex",
-                "default_model": "gpt-4.1",
-                "backends": {},
-                "agents": {},
-            }
+def _hook_script_argv(command: str) -> Optional[List[str]]:
+    """[script, args...] for a hook the dispatcher runs in-process, else None.
 
-    models.setdefault("agents", {})
-    prompt_files_backfilled = 0
-    for agent_name, agent_cfg in agents.items():
-        entry = dict(agent_cfg)
-        entry["__module__"] = module_name
+    Delegates to python_argv() in the dispatcher template, so compaction and
+    the dispatcher agree on which hooks are plain Python scripts.
+    """
+    if "python_argv" not in _HOOK_DISPATCH:
+        source = Path(__file__).resolve().parent / HOOK_DISPATCHER_SOURCE
+        try:
+            _HOOK_DISPATCH.update(runpy.run_path(str(source), run_name="hook_dispatch"))
+        except (OSError, SyntaxError):
+            _HOOK_DISPATCH["python_argv"] = lambda command, expand=True: None
+    return _HOOK_DISPATCH["python_argv"](command, expand=False)
 
-        # On Windows, expand ~ and normalize path separators for prompt_file
-        if sys.platform == "win32" and "prompt_file" in entry and entry["prompt_file"]:
-            entry["prompt_file"] = str(Path(entry["prompt_file"]).expanduser())
 
-        existing = models["agents"].get(agent_name, {})
-        if not existing or (isinstance(existing, dict) and existing.get("__module__")):
-            models["agents"][agent_name] = entry
-            continue
+def _is_noop_script(path: Path) -> bool:
+    """True for a script that only has docstrings, imports sys/os and exits 0."""
+    try:
+        tree = ast.parse(path.read_text(encoding="utf-8"))
+    except (OSError, SyntaxError, ValueError):
+        return False
+
+    def exits_zero(node: ast.AST) -> bool:
+        if not isinstance(node, ast.Call) or node.keywords:
+            return False
+        func = node.func
+        is_exit = (isinstance(func, ast.Name) and func.id == "exit") or (
+            isinstance(func, ast.Attribute) and func.attr == "exit"
+            and isinstance(func.value, ast.Name) and func.value.id == "sys"
+        )
+        zero = not node.args or (
+            len(node.args) == 1 and isinstance(node.args[0], ast.Constant) and node.args[0].value in (0, None)
+        )
+        return is_exit and zero
 
-        # Do not overwrite user-owned agent configs (no __module__). However, we can
-        # safely backfill missing prompt_file so skills ship self-contained prompts.
-        if not isinstance(existing, dict):
-            models["agents"][agent_name] = entry
+    for node in tree.body:
+        if isinstance(node, ast.Import) and all(alias.name in ("sys", "os") for alias in node.names):
+            continue
+        if isinstance(node, ast.Pass):
             continue
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            continue
+        if isinstance(node, ast.Expr) and exits_zero(node.value):
+            continue
+        return False
+    return True
+
+
+def _is_noop_hook(hook: Dict[str, Any]) -> bool:
+    """A command hook that runs a Python script doing nothing but exit 0 (e.g. inject-spec.py)."""
+    argv = _hook_script_argv(str(hook.get("command", "")))
+    return argv is not None and _is_noop_script(Path(argv[0]))
+
+
+def apply_hook_compaction(ctx: Dict[str, Any]) -> Optional[Tuple[int, int, int]]:
+    """Compact or expand module hooks in the settings session per ctx["compact_hooks"].
+
+    None keeps the install dir's current mode: compaction stays on while the
+    dispatcher is installed. Returns (entries replaced, entries written, hooks
+    dropped) after compacting, else None.
+    """
+    session = ctx.get("_settings_session")
+    if session is None:
+        return None
+    dispatcher = Path(ctx["install_dir"]) / HOOK_DISPATCHER
+    compact = ctx.get("compact_hooks")
+    if compact is None and not dispatcher.exists():
+        return None
+    if compact is False:
+        for module in session.hook_modules():
+            session.expand_module_hooks(module)
+        dispatcher.unlink(missing_ok=True)
+        return None
+
+    source = Path(ctx["config_dir"]) / HOOK_DISPATCHER_SOURCE
+    if source.is_file():
+        text = source.read_text(encoding="utf-8")
+        if not dispatcher.exists() or dispatcher.read_text(encoding="utf-8") != text:
+            _write_text_atomic(dispatcher, text)
+    elif not dispatcher.exists():
+        write_log({"level": "WARNING", "message": f"Hook dispatcher not found: {source}; hooks left as is"}, ctx)
+        return None
+
+    def command(group_id: str) -> str:
+        return f'python "{dispatcher.as_posix()}" {group_id}'
+
+    totals = [0, 0, 0]
+    for module in sorted(session.hook_modules()):
+        for i, count in enumerate(session.compact_module_hooks(module, command, _is_noop_hook)):
+            totals[i] += count
+    return totals[0], totals[1], totals[2]
 
-        desired_prompt = str(entry.get("prompt_file", "")).strip()
-        existing_prompt = str(existing.get("prompt_file", "")).strip()
-        if desired_prompt and not existing_prompt:
-            updated = dict(existing)
-            updated["prompt_file"] = desired_prompt
-            updated[prompt_marker_module] = module_name
-            updated[prompt_marker_value] = desired_prompt
-            models["agents"][agent_name] = updated
-            prompt_files_backfilled += 1
 
-    with models_path.open("w", encoding="utf-8") as fh:
-        json.dump(models, fh, indent=2, ensure_ascii=False)
+def merge_agents_to_models(module_name: str, agents: Dict[str, Any], ctx: Dict[str, Any]) -> None:
+    """Merge module agent configs into the models.json session (see flush_shared_files)."""
+    prompt_files_backfilled = models_session(ctx).add_module_agents(module_name, agents)
 
     write_log(
         {
@@ -392,75 +1180,34 @@ def merge_agents_to_models(module_name: str, agents: Dict[str, Any], ctx: Dict[s
 
 
 def unmerge_agents_from_models(module_name: str, ctx: Dict[str, Any]) -> None:
-    """Remove module's agent configs from ~/.codeagent/models.json.
+    """Remove module's agent configs from the models.json session.
 
     If another installed module also declares a removed agent, restore that
     module's version so shared agents (e.g. 'develop') are not lost.
     """
-    prompt_marker_module = "__prompt_file_module__"
-    prompt_marker_value = "__prompt_file_module_value__"
-
-    models_path = Path.home() / ".codeagent" / "models.json"
-    if not models_path.exists():
-        return
-
-    with models_path.open("r", encoding="utf-8") as fh:
-        models = json.load(fh)
-
-    agents = models.get("agents", {})
-    if not isinstance(agents, dict):
+    if not models_path().exists() and ctx.get("_models_session") is None:
         return
 
-    to_remove = [
-        name
-        for name, cfg in agents.items()
-        if isinstance(cfg, dict) and cfg.get("__module__") == module_name
+    config = ctx.get("config")
+    if config is None:
+        config_path = ctx["config_dir"] / "config.json"
+        config = _load_json(config_path) if config_path.exists() else {}
+    installed = cached_installed_status(ctx).get("modules", {})
+    fallbacks = [
+        (other_mod, config.get("modules", {}).get(other_mod, {}).get("agents", {}))
+        for other_mod, other_status in installed.items()
+        if other_mod != module_name and other_status.get("status") == "success"
     ]
 
-    # Load config to find other modules that declare the same agents
-    config_path = ctx["config_dir"] / "config.json"
-    config = _load_json(config_path) if config_path.exists() else {}
-    installed = load_installed_status(ctx).get("modules", {})
-
-    for name in to_remove:
-        del agents[name]
-        # Check if another installed module also declares this agent
-        for other_mod, other_status in installed.items():
-            if other_mod == module_name:
-                continue
-            if other_status.get("status") != "success":
-                continue
-            other_cfg = config.get("modules", {}).get(other_mod, {})
-            other_agents = other_cfg.get("agents", {})
-            if name in other_agents:
-                restored = dict(other_agents[name])
-                restored["__module__"] = other_mod
-                agents[name] = restored
-                break
-
-    # Also rollback prompt_file backfills applied to user-owned agents.
-    prompt_files_rolled_back = 0
-    for agent_name, cfg in list(agents.items()):
-        if not isinstance(cfg, dict):
-            continue
-        if cfg.get(prompt_marker_module) != module_name:
-            continue
-        expected = str(cfg.get(prompt_marker_value, "")).strip()
-        actual = str(cfg.get("prompt_file", "")).strip()
-        if expected and actual == expected:
-            cfg.pop("prompt_file", None)
-            prompt_files_rolled_back += 1
-        cfg.pop(prompt_marker_module, None)
-        cfg.pop(prompt_marker_value, None)
-
-    with models_path.open("w", encoding="utf-8") as fh:
-        json.dump(models, fh, indent=2, ensure_ascii=False)
+    removed, prompt_files_rolled_back = models_session(ctx).remove_module_agents(
+        module_name, fallbacks
+    )
 
     write_log(
         {
             "level": "INFO",
             "message": (
-                f"Removed {len(to_remove)} agent(s) from {module_name} "
+                f"Removed {removed} agent(s) from {module_name} "
                 "in models.json"
             ),
         },
@@ -479,22 +1226,102 @@ def unmerge_agents_from_models(module_name: str, ctx: Dict[str, Any]) -> None:
         )
 
 
-def _hooks_equal(hook1: Dict[str, Any], hook2: Dict[str, Any]) -> bool:
-    """Compare two hooks ignoring the __module__ marker."""
-    h1 = {k: v for k, v in hook1.items() if k != "__module__"}
-    h2 = {k: v for k, v in hook2.items() if k != "__module__"}
-    return h1 == h2
+def _import_jsonschema():
+    """Import jsonschema on first use; returns None when it is not installed."""
+    try:
+        import jsonschema
+    except ImportError:  # pragma: no cover
+        return None
+    return jsonschema
+
+
+# Compiled validators keyed by schema sha256
+_VALIDATORS: Dict[str, Any] = {}
+
+
+def _schema_validator(jsonschema: Any, schema: Dict[str, Any], schema_hash: str) -> Any:
+    validator = _VALIDATORS.get(schema_hash)
+    if validator is None:
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        validator = _VALIDATORS[schema_hash] = cls(schema)
+    return validator
+
+
+def _config_cache_key(config_raw: bytes, schema_raw: bytes) -> str:
+    config_hash = hashlib.sha256(config_raw).hexdigest()
+    schema_hash = hashlib.sha256(schema_raw).hexdigest()
+    return f"{config_hash}:{schema_hash}"
+
+
+def _load_config_cache(cache_path: Path) -> Dict[str, Any]:
+    try:
+        cache = _load_json(cache_path)
+    except (OSError, ValueError):
+        return {}
+    validated = cache.get("validated") if isinstance(cache, dict) else None
+    return validated if isinstance(validated, dict) else {}
+
+
+def _store_config_cache(cache_path: Path, validated: Dict[str, Any], key: str) -> None:
+    """Remember key as validated; never creates the install dir just for this."""
+    if not cache_path.parent.is_dir():
+        return
+    validated = {k: v for k, v in validated.items() if k != key}
+    validated[key] = datetime.now().isoformat()
+    keep = sorted(validated.items(), key=lambda item: str(item[1]))[-CONFIG_CACHE_KEEP:]
+    try:
+        _write_text_atomic(cache_path, _dump_json({"validated": dict(keep)}))
+    except OSError:
+        pass
+
+
+def _install_dir_for(config: Dict[str, Any], install_dir_arg: Optional[str] = None) -> Path:
+    """Install dir from the CLI override, else the config, else the default."""
+    if install_dir_arg and install_dir_arg != DEFAULT_INSTALL_DIR:
+        install_dir_raw = install_dir_arg
+    elif config.get("install_dir"):
+        install_dir_raw = config.get("install_dir")
+    else:
+        install_dir_raw = DEFAULT_INSTALL_DIR
+    return Path(install_dir_raw).expanduser().resolve()
 
 
-def load_config(path: str) -> Dict[str, Any]:
+def load_config(path: str, install_dir: Optional[str] = None) -> Dict[str, Any]:
     """Load config and validate against JSON Schema.
 
     Schema is searched in the config directory first, then alongside this file.
+    A (config sha256, schema sha256) pair that validated once is remembered in
+    CONFIG_CACHE_FILE under the install dir, so later runs skip validation and
+    never import jsonschema.
     """
 
     config_path = Path(path).expanduser().resolve()
-    config = _load_json(config_path)
+    try:
+        config_raw = config_path.read_bytes()
+    except FileNotFoundError as exc:
+        raise FileNotFoundError(f"File not found: {config_path}") from exc
+    try:
+        config = json.loads(config_raw.decode("utf-8"))
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"Invalid JSON in {config_path}: {exc}") from exc
 
+    schema_candidates = [
+        config_path.parent / "config.schema.json",
+        Path(__file__).resolve().with_name("config.schema.json"),
+    ]
+    schema_path = next((p for p in schema_candidates if p.exists()), None)
+
+    cache_path = None
+    if schema_path is not None and isinstance(config, dict):
+        schema_raw = schema_path.read_bytes()
+        cache_key = _config_cache_key(config_raw, schema_raw)
+        cache_path = _install_dir_for(config, install_dir) / CONFIG_CACHE_FILE
+        validated = _load_config_cache(cache_path)
+        if cache_key in validated:
+            return config
+
+    jsonschema = _import_jsonschema()
     if jsonschema is None:
         print(
             "WARNING: python package 'jsonschema' is not installed; "
@@ -521,20 +1348,18 @@ def load_config(path: str) -> Dict[str, Any]:
 
         return config
 
-    schema_candidates = [
-        config_path.parent / "config.schema.json",
-        Path(__file__).resolve().with_name("config.schema.json"),
-    ]
-    schema_path = next((p for p in schema_candidates if p.exists()), None)
     if schema_path is None:
         raise FileNotFoundError("config.schema.json not found")
 
-    schema = _load_json(schema_path)
-    try:
-        jsonschema.validate(config, schema)
-    except jsonschema.ValidationError as exc:
-        raise ValueError(f"Config validation failed: {exc.message}") from exc
+    schema_raw = schema_path.read_bytes()
+    schema = json.loads(schema_raw.decode("utf-8"))
+    validator = _schema_validator(jsonschema, schema, hashlib.sha256(schema_raw).hexdigest())
+    error = jsonschema.exceptions.best_match(validator.iter_errors(config))
+    if error is not None:
+        raise ValueError(f"Config validation failed: {error.message}")
 
+    if cache_path is not None:
+        _store_config_cache(cache_path, validated, cache_key)
     return config
 
 
@@ -543,14 +1368,7 @@ def resolve_paths(config: Dict[str, Any], args: argparse.Namespace) -> Dict[str,
 
     config_dir = Path(args.config).expanduser().resolve().parent
 
-    if args.install_dir and args.install_dir != DEFAULT_INSTALL_DIR:
-        install_dir_raw = args.install_dir
-    elif config.get("install_dir"):
-        install_dir_raw = config.get("install_dir")
-    else:
-        install_dir_raw = DEFAULT_INSTALL_DIR
-
-    install_dir = Path(install_dir_raw).expanduser().resolve()
+    install_dir = _install_dir_for(config, args.install_dir)
 
     log_file_raw = config.get("log_file", "install.log")
     log_file = Path(log_file_raw).expanduser()
@@ -558,12 +1376,21 @@ def resolve_paths(config: Dict[str, Any], args: argparse.Namespace) -> Dict[str,
         log_file = install_dir / log_file
 
     return {
+        "config": config,
         "install_dir": install_dir,
         "log_file": log_file,
         "status_file": install_dir / "installed_modules.json",
         "config_dir": config_dir,
         "force": bool(getattr(args, "force", False)),
         "verbose": bool(getattr(args, "verbose", False)),
+        "jobs": max(1, getattr(args, "jobs", None) or _default_jobs()),
+        "copy_strategy": getattr(args, "copy_strategy", None) or "copy",
+        "log_format": getattr(args, "log_format", None) or "text",
+        "profile": getattr(args, "profile", None) is not None,
+        "lock_timeout": getattr(args, "lock_timeout", None) or LOCK_TIMEOUT,
+        "trash_retention": max(0.0, getattr(args, "trash_retention", TRASH_RETENTION_DAYS)),
+        "compact_hooks": getattr(args, "compact_hooks", None),
+        "refresh_wrapper": bool(getattr(args, "refresh_wrapper", False)),
         "applied_paths": [],
         "status_backup": None,
     }
@@ -591,6 +1418,33 @@ def load_installed_status(ctx: Dict[str, Any]) -> Dict[str, Any]:
     return {"modules": {}}
 
 
+def save_installed_status(status: Dict[str, Any], ctx: Dict[str, Any]) -> None:
+    """Write installed_modules.json atomically."""
+    _save_json(Path(ctx["status_file"]), status)
+
+
+def _stat_signature(path: Path) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino, st.st_nlink]
+
+
+def cached_installed_status(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Read-only view of installed_modules.json, re-parsed only when it changes.
+
+    Callers that modify and write the status must use load_installed_status().
+    """
+    status_path = Path(ctx["status_file"])
+    with _STATE_LOCK:
+        sig = _stat_signature(status_path)
+        cached = ctx.get("_status_cache")
+        if cached is None or cached[0] != sig:
+            cached = ctx["_status_cache"] = (sig, load_installed_status(ctx))
+        return cached[1]
+
+
 def check_module_installed(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> bool:
     """Check if a module is installed by verifying its files exist."""
     install_dir = ctx["install_dir"]
@@ -622,6 +1476,127 @@ def check_module_installed(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any])
     return False
 
 
+def _module_watch_dirs(cfg: Dict[str, Any], ctx: Dict[str, Any]) -> List[Path]:
+    """Directories whose mtime changes whenever check_module_installed's answer can."""
+    install_dir = Path(ctx["install_dir"])
+    dirs: List[Path] = []
+    for op in cfg.get("operations", []):
+        op_type = op.get("type")
+        if op_type == "copy_file":
+            dirs.append((install_dir / op["target"]).parent)
+        elif op_type == "copy_dir":
+            target = install_dir / op["target"]
+            dirs.extend((target.parent, target))
+        elif op_type == "merge_dir":
+            src = (ctx["config_dir"] / op["source"]).expanduser()
+            dirs.append(src)
+            try:
+                with os.scandir(src) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            dirs.extend((Path(entry.path), install_dir / entry.name))
+            except OSError:
+                pass
+    return dirs
+
+
+class StatusIndex:
+    """Per-module install state, cached in STATUS_INDEX_FILE under the install dir.
+
+    Holds a compact summary of installed_modules.json (status and
+    installed_at per module) keyed by the status file's stat signature, and,
+    for filesystem detection, each module's answer with a fingerprint of the
+    mtime/ino/nlink of the directories that decide it. Revalidating costs a
+    few stats instead of parsing the status file and listing target trees.
+
+    The file is only written while this run holds the install lock; read-only
+    runs keep changes in memory and save them at exit if no install is running.
+    """
+
+    def __init__(self, ctx: Dict[str, Any]):
+        self.ctx = ctx
+        self.path = Path(ctx["install_dir"]) / STATUS_INDEX_FILE
+        self.data: Dict[str, Any] = {}
+        try:
+            loaded = _load_json(self.path)
+            if isinstance(loaded, dict):
+                self.data = loaded
+        except (OSError, ValueError):
+            pass
+        self._saved = _dump_json(self.data)
+
+    @property
+    def records(self) -> Dict[str, Dict[str, Any]]:
+        """Module name -> {"status", "installed_at"} from installed_modules.json."""
+        self.refresh()
+        return self.data.get("records", {})
+
+    def refresh(self) -> None:
+        sig = _stat_signature(Path(self.ctx["status_file"]))
+        if self.data.get("status_sig") == sig and "records" in self.data:
+            return
+        modules = cached_installed_status(self.ctx).get("modules", {})
+        records = {}
+        if isinstance(modules, dict):
+            for name, entry in modules.items():
+                entry = entry if isinstance(entry, dict) else {}
+                records[name] = {
+                    "status": entry.get("status"),
+                    "installed_at": entry.get("installed_at", ""),
+                }
+        self.data["status_sig"] = sig
+        self.data["records"] = records
+        self._save()
+
+    def detected(self, name: str, cfg: Dict[str, Any]) -> bool:
+        """check_module_installed(), skipped while the module's fingerprint holds."""
+        fingerprint = [
+            [str(path), _stat_signature(path)] for path in _module_watch_dirs(cfg, self.ctx)
+        ]
+        cached = self.data.setdefault("detected", {}).get(name)
+        if isinstance(cached, dict) and cached.get("fingerprint") == fingerprint:
+            return bool(cached.get("installed"))
+        installed = check_module_installed(name, cfg, self.ctx)
+        self.data["detected"][name] = {"installed": installed, "fingerprint": fingerprint}
+        self._save()
+        return installed
+
+    def _save(self) -> None:
+        if self.ctx.get("_install_locked"):
+            self._write()
+
+    def save_if_idle(self) -> None:
+        """Save from a read-only run, unless an install holds the lock."""
+        if _dump_json(self.data) == self._saved or not self.path.parent.is_dir():
+            return
+        lock = FileLock(self.path.with_name(INSTALL_LOCK_FILE), timeout=0)
+        try:
+            lock.acquire()
+        except (TimeoutError, OSError):
+            return
+        try:
+            self._write()
+        finally:
+            lock.release()
+
+    def _write(self) -> None:
+        text = _dump_json(self.data)
+        if text == self._saved or not self.path.parent.is_dir():
+            return
+        try:
+            _write_text_atomic(self.path, text)
+            self._saved = text
+        except OSError:
+            pass
+
+
+def status_index(ctx: Dict[str, Any]) -> StatusIndex:
+    index = ctx.get("_status_index")
+    if index is None:
+        index = ctx["_status_index"] = StatusIndex(ctx)
+    return index
+
+
 def get_installed_modules(config: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[str, bool]:
     """Get installation status of all modules by checking files on disk.
 
@@ -630,19 +1605,19 @@ def get_installed_modules(config: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[s
     """
     result = {}
     modules = config.get("modules", {})
-    status_modules = load_installed_status(ctx).get("modules", {})
-    has_status_records = bool(status_modules)
+    index = status_index(ctx)
+    records = index.records
+    has_status_records = bool(records)
 
     for name, cfg in modules.items():
-        module_status = status_modules.get(name, {})
-        if isinstance(module_status, dict) and module_status.get("status") == "success":
+        if records.get(name, {}).get("status") == "success":
             result[name] = True
             continue
 
         if has_status_records:
             result[name] = False
         else:
-            result[name] = check_module_installed(name, cfg, ctx)
+            result[name] = index.detected(name, cfg)
 
     return result
 
@@ -655,53 +1630,125 @@ def get_modules_to_uninstall(config: Dict[str, Any], ctx: Dict[str, Any]) -> Dic
     """
     result = {}
     modules = config.get("modules", {})
-
-    status = load_installed_status(ctx)
-    status_modules = status.get("modules", {})
-    has_status_records = bool(status_modules)
+    index = status_index(ctx)
+    records = index.records
+    has_status_records = bool(records)
 
     for name, cfg in modules.items():
-        in_status = name in status_modules
-        if in_status:
+        if name in records:
             result[name] = True
             continue
 
         if has_status_records:
             result[name] = False
         else:
-            result[name] = check_module_installed(name, cfg, ctx)
+            result[name] = index.detected(name, cfg)
 
     return result
 
 
-def add_required_modules_for_install(
-    selected: Dict[str, Any], config: Dict[str, Any]
-) -> tuple[Dict[str, Any], List[str]]:
-    """Add dependency modules required by selected modules."""
+# Resolved dependency plans keyed by config hash; the config is immutable for a
+# run, so menu actions and repeated calls reuse the same walk.
+_DEPENDENCY_PLANS: Dict[str, Dict[str, List[str]]] = {}
+_CONFIG_HASHES: Dict[int, Tuple[Dict[str, Any], str]] = {}
+
+
+def config_hash(config: Dict[str, Any]) -> str:
+    """Stable content hash of a loaded config (memoized per config object)."""
+    cached = _CONFIG_HASHES.get(id(config))
+    if cached is not None and cached[0] is config:
+        return cached[1]
+    payload = json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    digest = hashlib.sha256(payload).hexdigest()
+    _CONFIG_HASHES[id(config)] = (config, digest)
+    return digest
+
+
+def resolve_dependency_plan(config: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Map each module to its transitive dependencies in install order.
+
+    Dependencies come before the modules that need them. Unknown dependency
+    names are ignored. Raises ValueError with the offending path on cycles.
+    """
+    key = config_hash(config)
+    cached = _DEPENDENCY_PLANS.get(key)
+    if cached is not None:
+        return cached
+
     all_modules = config.get("modules", {})
-    auto_added: List[str] = []
+    plan: Dict[str, List[str]] = {}
+    visiting: List[str] = []
+
+    def visit(name: str) -> List[str]:
+        if name in plan:
+            return plan[name]
+        if name in visiting:
+            cycle = visiting[visiting.index(name):] + [name]
+            raise ValueError(f"Dependency cycle detected: {' -> '.join(cycle)}")
+
+        visiting.append(name)
+        closure: List[str] = []
+        for dep in all_modules[name].get("dependencies", []):
+            if dep not in all_modules:
+                continue
+            for item in visit(dep) + [dep]:
+                if item not in closure:
+                    closure.append(item)
+        visiting.pop()
+        plan[name] = closure
+        return closure
+
+    for name in all_modules:
+        visit(name)
+
+    _DEPENDENCY_PLANS[key] = plan
+    return plan
+
+
+def sort_modules_by_dependencies(
+    selected: Dict[str, Any], config: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Reorder selected modules so dependencies come first; adds nothing."""
+    plan = resolve_dependency_plan(config)
+    ordered: Dict[str, Any] = {}
+    for name in selected:
+        for dep in plan.get(name, []):
+            if dep in selected and dep not in ordered:
+                ordered[dep] = selected[dep]
+        ordered.setdefault(name, selected[name])
+    return ordered
 
-    for cfg in selected.values():
-        for dep in cfg.get("dependencies", []):
-            if dep not in selected and dep in all_modules:
-                auto_added.append(dep)
 
-    if not auto_added:
-        return dict(selected), []
+def add_required_modules_for_install(
+    selected: Dict[str, Any], config: Dict[str, Any]
+) -> tuple[Dict[str, Any], List[str]]:
+    """Add transitive dependency modules required by selected modules.
+
+    Returns modules in topological order (dependencies first) and the names
+    that were added automatically.
+    """
+    all_modules = config.get("modules", {})
+    plan = resolve_dependency_plan(config)
+    auto_added: List[str] = []
 
-    # Dependencies first, then selected modules
     result: Dict[str, Any] = {}
-    for dep in auto_added:
-        result[dep] = all_modules[dep]
-    result.update(selected)
+    for name, cfg in selected.items():
+        for dep in plan.get(name, []):
+            if dep in result:
+                continue
+            if dep in selected:
+                result[dep] = selected[dep]
+            else:
+                result[dep] = all_modules[dep]
+                auto_added.append(dep)
+        result.setdefault(name, cfg)
     return result, auto_added
 
 
 def list_modules_with_status(config: Dict[str, Any], ctx: Dict[str, Any]) -> None:
     """List modules with installation status."""
     installed_status = get_installed_modules(config, ctx)
-    status_data = load_installed_status(ctx)
-    status_modules = status_data.get("modules", {})
+    records = status_index(ctx).records
 
     print("\n" + "=" * 70)
     print("Module Status")
@@ -713,7 +1760,7 @@ def list_modules_with_status(config: Dict[str, Any], ctx: Dict[str, Any]) -> Non
         desc = cfg.get("description", "")[:25]
         if installed_status.get(name, False):
             status = "[OK] Installed"
-            installed_at = status_modules.get(name, {}).get("installed_at", "")[:16]
+            installed_at = str(records.get(name, {}).get("installed_at") or "")[:16]
         else:
             status = "[ ] Not installed"
             installed_at = ""
@@ -814,18 +1861,492 @@ def interactive_select_modules(config: Dict[str, Any]) -> Dict[str, Any]:
             continue
 
 
-def uninstall_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[str, Any]:
-    """Uninstall a module by removing its files and hooks."""
-    result: Dict[str, Any] = {
-        "module": name,
-        "status": "success",
-        "uninstalled_at": datetime.now().isoformat(),
+UNINSTALL_BATCH_WORKERS = 4
+
+
+def _manifest_paths(record: Any) -> Optional[List[str]]:
+    """Install-relative files a status record owns, or None without a manifest."""
+    if not isinstance(record, dict) or not isinstance(record.get("files"), dict):
+        return None
+    paths = list(record["files"])
+    merged = record.get("merge_dir_files")
+    if isinstance(merged, list):
+        paths.extend(str(rel) for rel in merged)
+    return paths
+
+
+class ManifestRefs:
+    """Reference counts of install-relative paths across installed modules.
+
+    Built once from the recorded manifests; release() drops one module and
+    splits its files into those no other module owns any more and those
+    still shared, so a batch of uninstalls never rebuilds file sets.
+    """
+
+    def __init__(self, modules_status: Dict[str, Any]):
+        self.owned: Dict[str, set] = {}
+        self.counts: Dict[str, int] = {}
+        for name, record in modules_status.items():
+            paths = _manifest_paths(record)
+            if paths is None:
+                continue
+            self.owned[name] = set(paths)
+            for rel in self.owned[name]:
+                self.counts[rel] = self.counts.get(rel, 0) + 1
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.owned
+
+    def release(self, name: str) -> Tuple[List[str], List[str]]:
+        """Return (removable, shared) paths for name and drop its references."""
+        removable: List[str] = []
+        shared: List[str] = []
+        for rel in sorted(self.owned.pop(name, ())):
+            self.counts[rel] -= 1
+            (shared if self.counts[rel] > 0 else removable).append(rel)
+        return removable, shared
+
+
+def _group_by_dir(install_dir: Path, rels: Iterable[str]) -> Tuple[Dict[Path, set], List[str]]:
+    """Group install-relative files by parent directory, dropping unsafe paths."""
+    root = install_dir.resolve()
+    batches: Dict[Path, set] = {}
+    errors: List[str] = []
+    for rel in rels:
+        rel_path = Path(str(rel).replace("\\", "/"))
+        if not rel_path.parts or rel_path.is_absolute() or ".." in rel_path.parts:
+            errors.append(f"Skip unsafe path: {rel}")
+            continue
+        batches.setdefault(install_dir / rel_path.parent, set()).add(rel_path.name)
+
+    # A directory that resolves elsewhere (a symlink) is never entered
+    for directory in list(batches):
+        resolved = directory.resolve()
+        if resolved != root and root not in resolved.parents:
+            errors.append(f"Skip out-of-tree directory: {directory}")
+            del batches[directory]
+    return batches, errors
+
+
+def _scan_dir(directory: Path) -> Optional[Tuple[set, List[str]]]:
+    """(non-directory entry names, subdirectory names) from one scandir."""
+    files: set = set()
+    subdirs: List[str] = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    files.add(entry.name)
+    except OSError:
+        return None
+    return files, subdirs
+
+
+def prune_empty_dirs(root: Path, dirs: Iterable[Path]) -> List[Path]:
+    """Remove empty dirs and their emptied ancestors below root, deepest first.
+
+    One pass over the candidates: a directory that is not empty marks all of
+    its ancestors as kept, so they are never tried.
+    """
+    root = Path(root)
+    candidates: set = set()
+    for directory in dirs:
+        directory = Path(directory)
+        while directory != root and root in directory.parents and directory not in candidates:
+            candidates.add(directory)
+            directory = directory.parent
+
+    pruned: List[Path] = []
+    kept: set = set()
+    for directory in sorted(candidates, key=lambda d: len(d.parts), reverse=True):
+        if directory in kept:
+            continue
+        try:
+            os.rmdir(directory)
+        except FileNotFoundError:
+            continue
+        except OSError:
+            parent = directory.parent
+            while parent != root and parent not in kept:
+                kept.add(parent)
+                parent = parent.parent
+            continue
+        pruned.append(directory)
+    return pruned
+
+
+class UninstallTrash:
+    """One uninstall batch, moved aside to <install_dir>/.trash/<timestamp>/.
+
+    Files are renamed rather than deleted, so removing a module costs the
+    same whatever its size and can be put back with --undo-last until the
+    retention policy purges the entry (see schedule_trash_purge).
+    trash.json records what was moved plus each module's status record,
+    hooks and agents.
+    """
+
+    def __init__(self, install_dir: Path):
+        self.install_dir = Path(install_dir)
+        self.path: Optional[Path] = None
+        self.moved: List[Dict[str, Any]] = []
+        self.modules: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self) -> Path:
+        with self._lock:
+            if self.path is None:
+                base = self.install_dir / TRASH_DIR
+                base.mkdir(parents=True, exist_ok=True)
+                stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+                for n in itertools.count():
+                    path = base / (stamp if n == 0 else f"{stamp}-{n}")
+                    try:
+                        path.mkdir()
+                    except FileExistsError:
+                        continue
+                    self.path = path
+                    break
+            return self.path
+
+    def move_path(self, path: Path) -> bool:
+        """Rename one file or directory into the trash. False if it is gone."""
+        path = Path(path)
+        rel = path.relative_to(self.install_dir)
+        is_dir = path.is_dir() and not path.is_symlink()
+        dest = self._entry() / "files" / rel
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(path, dest)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self.moved.append({"path": rel.as_posix(), "dir": is_dir})
+        return True
+
+    def move_files(
+        self, rels: Iterable[str], jobs: int = UNINSTALL_BATCH_WORKERS
+    ) -> Tuple[List[str], List[str]]:
+        """Move install-relative files into the trash. Returns (moved, errors).
+
+        Each directory holding a listed file, and each of its ancestors, is
+        scanned once on a small worker pool. A directory whose whole content
+        is listed moves with a single rename; other files move one by one.
+        Directories left empty are then pruned in one bottom-up pass.
+        """
+        batches, errors = _group_by_dir(self.install_dir, rels)
+        if not batches:
+            return [], errors
+
+        candidates: List[Path] = []
+        seen: set = set()
+        for directory in batches:
+            while directory != self.install_dir and directory not in seen:
+                seen.add(directory)
+                candidates.append(directory)
+                directory = directory.parent
+
+        moved: List[str] = []
+        workers = max(1, min(jobs, UNINSTALL_BATCH_WORKERS, len(candidates)))
+        with _ContextPool(max_workers=workers) as pool:
+            scans = dict(zip(candidates, pool.map(_scan_dir, candidates)))
+            # Files directly in the install dir move one by one, never the dir
+            if self.install_dir in batches:
+                scans[self.install_dir] = _scan_dir(self.install_dir)
+
+            # Deepest first, so subdirectories are decided before their parent
+            whole: Dict[Path, bool] = {}
+            for directory in sorted(candidates, key=lambda d: len(d.parts), reverse=True):
+                scan = scans[directory]
+                whole[directory] = scan is not None and bool(scan[0] or scan[1]) and (
+                    scan[0] <= batches.get(directory, set())
+                    and all(whole.get(directory / name, False) for name in scan[1])
+                )
+            chosen = {d for d in candidates if whole[d] and not any(whole.get(p) for p in d.parents)}
+
+            # Path to rename -> the listed files it carries
+            carried: Dict[Path, List[str]] = {directory: [] for directory in chosen}
+            for directory, names in batches.items():
+                scan = scans.get(directory)
+                if scan is None:
+                    continue
+                owner = next((d for d in (directory, *directory.parents) if d in chosen), None)
+                for name in sorted(names & scan[0]):
+                    rel = (directory / name).relative_to(self.install_dir).as_posix()
+                    carried.setdefault(owner or directory / name, []).append(rel)
+
+            def move(item: Tuple[Path, List[str]]) -> Tuple[List[str], Optional[str]]:
+                path, files = item
+                try:
+                    return (files if self.move_path(path) else []), None
+                except OSError as exc:
+                    return [], f"{path}: {exc}"
+
+            for files, error in pool.map(move, carried.items()):
+                moved.extend(files)
+                if error:
+                    errors.append(error)
+        prune_empty_dirs(self.install_dir, batches)
+        return sorted(moved), errors
+
+    def record_module(
+        self, name: str, status: Any, hooks: Dict[str, Any], agents: Dict[str, Any]
+    ) -> None:
+        with self._lock:
+            self.modules[name] = {"status": status, "hooks": hooks, "agents": agents}
+
+    def commit(self) -> Optional[Path]:
+        """Write trash.json. Returns the entry dir, or None if nothing was trashed."""
+        if self.path is None and not self.modules:
+            return None
+        entry = self._entry()
+        _save_json(
+            entry / TRASH_MANIFEST,
+            {
+                "format": TRASH_FORMAT,
+                "created": time.time(),
+                "created_at": datetime.now().isoformat(),
+                "moved": self.moved,
+                "modules": self.modules,
+            },
+        )
+        return entry
+
+
+def trash_entries(install_dir: Path) -> List[Tuple[Path, Dict[str, Any]]]:
+    """Trash entries of install_dir, oldest first, with their trash.json.
+
+    An entry without a readable trash.json (an interrupted uninstall) is
+    listed as incomplete: it ages out normally but cannot be undone.
+    """
+    base = Path(install_dir) / TRASH_DIR
+    try:
+        with os.scandir(base) as it:
+            dirs = [
+                Path(entry.path) for entry in it
+                if entry.is_dir(follow_symlinks=False) and not entry.name.startswith(".")
+            ]
+    except OSError:
+        return []
+
+    entries = []
+    for path in sorted(dirs, key=lambda p: p.name):
+        try:
+            meta = _load_json(path / TRASH_MANIFEST)
+        except (ValueError, FileNotFoundError):
+            meta = None
+        if not isinstance(meta, dict) or meta.get("format") != TRASH_FORMAT:
+            try:
+                created = path.stat().st_mtime
+            except OSError:
+                continue
+            meta = {"created": created, "moved": [], "modules": {}, "incomplete": True}
+        entries.append((path, meta))
+    return entries
+
+
+def expired_trash(install_dir: Path, retention_days: float) -> List[Path]:
+    """Entries older than retention_days, or beyond the newest TRASH_MAX_ENTRIES."""
+    entries = trash_entries(install_dir)
+    cutoff = time.time() - retention_days * 86400
+    keep_from = len(entries) - TRASH_MAX_ENTRIES
+    return [
+        path for index, (path, meta) in enumerate(entries)
+        if index < keep_from or float(meta.get("created") or 0) <= cutoff
+    ]
+
+
+def purge_trash(install_dir: Path, retention_days: float, lock_timeout: float = LOCK_TIMEOUT) -> int:
+    """Delete expired trash entries. Returns how many were deleted.
+
+    Entries are claimed (renamed to .purge-<name>) under the install lock,
+    so --undo-last never sees a half-deleted entry; the slow delete runs
+    unlocked. Claims left by an interrupted purge are finished too.
+    """
+    install_dir = Path(install_dir)
+    base = install_dir / TRASH_DIR
+    with FileLock(install_dir / INSTALL_LOCK_FILE, lock_timeout):
+        for path in expired_trash(install_dir, retention_days):
+            try:
+                os.rename(path, base / f".purge-{path.name}")
+            except OSError:
+                continue
+
+    purged = 0
+    for claimed in sorted(base.glob(".purge-*")):
+        try:
+            shutil.rmtree(claimed, onerror=_remove_readonly)
+        except OSError:
+            continue
+        purged += 1
+    try:
+        base.rmdir()
+    except OSError:
+        pass
+    return purged
+
+
+def schedule_trash_purge(install_dir: Path, retention_days: float, lock_timeout: float = LOCK_TIMEOUT) -> bool:
+    """Start a detached `install.py --purge-trash` if the retention policy drops anything.
+
+    Runs after every uninstall and every locking installer run, so expired
+    entries go away without anyone waiting on the delete. Returns True if
+    a purge was started.
+    """
+    base = Path(install_dir) / TRASH_DIR
+    try:
+        claimed = any(name.startswith(".purge-") for name in os.listdir(base))
+    except OSError:
+        return False
+    if not claimed and not expired_trash(install_dir, retention_days):
+        return False
+
+    cmd = [
+        sys.executable, str(Path(__file__).resolve()), "--purge-trash",
+        "--install-dir", str(install_dir),
+        "--trash-retention", str(retention_days),
+        "--lock-timeout", str(lock_timeout),
+    ]
+    kwargs: Dict[str, Any] = {
+        "stdin": subprocess.DEVNULL,
+        "stdout": subprocess.DEVNULL,
+        "stderr": subprocess.DEVNULL,
+        "close_fds": True,
+    }
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        subprocess.Popen(cmd, **kwargs)
+    except OSError:
+        return False
+    return True
+
+
+def undo_last_uninstall(install_dir: Path, lock_timeout: float = LOCK_TIMEOUT) -> Optional[Dict[str, Any]]:
+    """Rename the newest trash entry back into place. The caller holds the install lock.
+
+    Restores the files, then the status records, hooks and agents of the
+    modules that are not installed again meanwhile. Paths that exist again
+    stay in the trash and are reported as conflicts; the entry is deleted
+    once nothing is left in it. Returns None if there is nothing to undo.
+    """
+    install_dir = Path(install_dir)
+    entries = [(path, meta) for path, meta in trash_entries(install_dir) if not meta.get("incomplete")]
+    if not entries:
+        return None
+    entry, meta = entries[-1]
+
+    restored = 0
+    conflicts: List[Dict[str, Any]] = []
+    for item in meta.get("moved", []):
+        rel_path = Path(str(item.get("path", "")))
+        if not rel_path.parts or rel_path.is_absolute() or ".." in rel_path.parts:
+            continue
+        src = entry / "files" / rel_path
+        dst = install_dir / rel_path
+        if not os.path.lexists(src):
+            continue
+        if os.path.lexists(dst):
+            conflicts.append(item)
+            continue
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        os.rename(src, dst)
+        restored += 1
+
+    status = JsonSession(install_dir / "installed_modules.json")
+    installed = status.data.get("modules")
+    if not isinstance(installed, dict):
+        installed = status.data["modules"] = {}
+    modules = {
+        name: saved for name, saved in meta.get("modules", {}).items()
+        if name not in installed and isinstance(saved, dict)
+    }
+    for name, saved in modules.items():
+        if isinstance(saved.get("status"), dict):
+            installed[name] = saved["status"]
+    if modules:
+        status.data["updated_at"] = datetime.now().isoformat()
+        status.commit()
+
+        settings = SettingsSession(install_dir / SETTINGS_FILE)
+        for name, saved in modules.items():
+            for hook_type, hook_entries in (saved.get("hooks") or {}).items():
+                for hook_entry in hook_entries:
+                    settings.add_module_hook(hook_type, hook_entry)
+            # Compacted hooks need the dispatcher, which a full uninstall removed
+            if not (install_dir / HOOK_DISPATCHER).exists():
+                settings.expand_module_hooks(name)
+        settings.commit()
+
+        if any(saved.get("agents") for saved in modules.values()):
+            models = ModelsSession(models_path())
+            models.lock_timeout = lock_timeout
+            for name, saved in modules.items():
+                if saved.get("agents"):
+                    models.add_module_agents(name, saved["agents"])
+            models.commit()
+
+    if conflicts:
+        _save_json(entry / TRASH_MANIFEST, {**meta, "moved": conflicts, "modules": {}})
+    else:
+        shutil.rmtree(entry, onerror=_remove_readonly)
+        try:
+            entry.parent.rmdir()
+        except OSError:
+            pass
+    return {
+        "entry": str(entry),
+        "modules": sorted(modules),
+        "restored": restored,
+        "conflicts": [item["path"] for item in conflicts],
     }
 
+
+def _manifest_refs(ctx: Dict[str, Any]) -> ManifestRefs:
+    """Reference counts for the current uninstall batch, built on first use."""
+    with _STATE_LOCK:
+        refs = ctx.get("_manifest_refs")
+        if refs is None:
+            refs = ctx["_manifest_refs"] = ManifestRefs(cached_installed_status(ctx).get("modules", {}))
+        return refs
+
+
+def uninstall_trash(ctx: Dict[str, Any]) -> UninstallTrash:
+    """The trash entry of the current uninstall batch (sealed by update_status_after_uninstall)."""
+    with _STATE_LOCK:
+        trash = ctx.get("_trash")
+        if trash is None:
+            trash = ctx["_trash"] = UninstallTrash(ctx["install_dir"])
+        return trash
+
+
+def _module_integrations(name: str, ctx: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Copies of a module's hooks and agents, kept in the trash for --undo-last."""
+    hooks: Dict[str, Any] = {}
+    agents: Dict[str, Any] = {}
+    try:
+        hooks = settings_session(ctx).module_hooks(name)
+    except Exception as exc:  # noqa: BLE001
+        write_log({"level": "WARNING", "message": f"Cannot save hooks of {name} for undo: {exc}"}, ctx)
+    if models_path().exists() or ctx.get("_models_session") is not None:
+        try:
+            agents = models_session(ctx).module_agents(name)
+        except Exception as exc:  # noqa: BLE001
+            write_log({"level": "WARNING", "message": f"Cannot save agents of {name} for undo: {exc}"}, ctx)
+    return hooks, agents
+
+
+def _remove_op_targets(
+    name: str, cfg: Dict[str, Any], ctx: Dict[str, Any], result: Dict[str, Any]
+) -> List[str]:
+    """Move a module's operation targets to the trash; used when no manifest was recorded."""
     install_dir = ctx["install_dir"]
+    trash = uninstall_trash(ctx)
     removed_paths = []
-    status = load_installed_status(ctx)
-    module_status = status.get("modules", {}).get(name, {})
+    module_status = cached_installed_status(ctx).get("modules", {}).get(name, {})
     merge_dir_files = module_status.get("merge_dir_files", [])
     if not isinstance(merge_dir_files, list):
         merge_dir_files = []
@@ -834,12 +2355,8 @@ def uninstall_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dic
         op_type = op.get("type")
         try:
             if op_type in ("copy_dir", "copy_file"):
-                target = (install_dir / op["target"]).expanduser().resolve()
-                if target.exists():
-                    if target.is_dir():
-                        shutil.rmtree(target, onerror=_remove_readonly)
-                    else:
-                        target.unlink()
+                target = _no_follow(install_dir / op["target"])
+                if trash.move_path(target):
                     removed_paths.append(str(target))
                     write_log({"level": "INFO", "message": f"Removed: {target}"}, ctx)
                     # Clean up empty parent directories up to install_dir
@@ -873,7 +2390,7 @@ def uninstall_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dic
                         )
                         continue
 
-                    target = (install_dir / rel_path).resolve()
+                    target = _no_follow(install_dir / rel_path)
                     if target == install_dir or install_dir not in target.parents:
                         write_log(
                             {
@@ -884,11 +2401,7 @@ def uninstall_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dic
                         )
                         continue
 
-                    if target.exists():
-                        if target.is_dir():
-                            shutil.rmtree(target, onerror=_remove_readonly)
-                        else:
-                            target.unlink()
+                    if trash.move_path(target):
                         removed_paths.append(str(target))
                         write_log({"level": "INFO", "message": f"Removed: {target}"}, ctx)
 
@@ -905,6 +2418,54 @@ def uninstall_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dic
             )
             write_log({"level": "WARNING", "message": f"Failed to remove {op.get('target', 'unknown')}: {exc}"}, ctx)
 
+    return removed_paths
+
+
+def uninstall_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Uninstall a module by moving its files to the trash and removing its hooks.
+
+    Files come from the manifest recorded at install time; paths another
+    installed module still owns are kept. Modules installed before
+    manifests existed fall back to moving their operation targets.
+    """
+    result: Dict[str, Any] = {
+        "module": name,
+        "status": "success",
+        "uninstalled_at": datetime.now().isoformat(),
+    }
+
+    trash = uninstall_trash(ctx)
+    hooks, agents = _module_integrations(name, ctx)
+    record = cached_installed_status(ctx).get("modules", {}).get(name)
+    trash.record_module(name, record, hooks, agents)
+
+    refs = _manifest_refs(ctx)
+    if name in refs:
+        removable, shared = refs.release(name)
+        removed, errors = trash.move_files(removable, ctx["jobs"])
+        removed_paths = [str(ctx["install_dir"] / rel) for rel in removed]
+        write_log(
+            {
+                "level": "INFO",
+                "message": f"Removed {len(removed)} file(s) for {name}"
+                + (f"; kept {len(shared)} shared with other modules" if shared else ""),
+            },
+            ctx,
+        )
+        for error in errors:
+            result.setdefault("warnings", []).append(f"Failed to remove {error}")
+            write_log({"level": "WARNING", "message": f"Failed to remove {error}"}, ctx)
+        if shared:
+            result["kept_shared"] = shared
+    else:
+        removed_paths = _remove_op_targets(name, cfg, ctx, result)
+
+    # A partial install puts back the targets it replaced
+    restored = restore_module_snapshots(record, ctx["install_dir"])
+    if restored:
+        result["restored"] = restored
+        write_log({"level": "INFO", "message": f"Restored {len(restored)} path(s) replaced by {name}"}, ctx)
+
     # Remove module hooks from settings.json
     try:
         unmerge_hooks_from_settings(name, ctx)
@@ -924,7 +2485,12 @@ def uninstall_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dic
 
 
 def update_status_after_uninstall(uninstalled_modules: List[str], ctx: Dict[str, Any]) -> None:
-    """Remove uninstalled modules from status file."""
+    """Remove uninstalled modules from status file, sealing the batch's trash entry first."""
+    ctx.pop("_manifest_refs", None)
+    trash = ctx.pop("_trash", None)
+    entry = trash.commit() if trash is not None else None
+    if entry is not None:
+        write_log({"level": "INFO", "message": f"Moved uninstalled files to {entry}"}, ctx)
     status = load_installed_status(ctx)
     modules = status.get("modules", {})
 
@@ -934,10 +2500,7 @@ def update_status_after_uninstall(uninstalled_modules: List[str], ctx: Dict[str,
 
     status["modules"] = modules
     status["updated_at"] = datetime.now().isoformat()
-
-    status_path = Path(ctx["status_file"])
-    with status_path.open("w", encoding="utf-8") as fh:
-        json.dump(status, fh, indent=2, ensure_ascii=False)
+    save_installed_status(status, ctx)
 
 
 def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
@@ -984,6 +2547,8 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
 
         if not user_input:
             continue
+        # Each command may retry a wrapper install that failed before
+        ctx.pop("_wrapper_error", None)
 
         if user_input.lower() == "q":
             print("Goodbye!")
@@ -997,7 +2562,11 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
             # Install
             selected = _parse_module_selection(args, modules, module_names)
             if selected:
-                selected, auto_added = add_required_modules_for_install(selected, config)
+                try:
+                    selected, auto_added = add_required_modules_for_install(selected, config)
+                except ValueError as exc:
+                    print(f"Error: {exc}")
+                    continue
                 if auto_added:
                     print(f"Auto-added dependencies: {', '.join(auto_added)}")
                 # Filter out already installed
@@ -1008,11 +2577,14 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
                 print(f"\nInstalling: {', '.join(to_install.keys())}")
                 ctx["selected_modules"] = set(to_install.keys())
                 results = []
-                for name, cfg in to_install.items():
-                    try:
-                        results.append(execute_module(name, cfg, ctx))
+                scheduled = schedule_modules(
+                    to_install, ctx, stop_on_error=False, on_start=_progress(len(to_install), "Installing")
+                )
+                for name, result, exc in scheduled:
+                    if exc is None:
+                        results.append(result)
                         print(f"  [+] {name} installed")
-                    except Exception as exc:
+                    else:
                         print(f"  [X] {name} failed: {exc}")
                 # Update status
                 current_status = load_installed_status(ctx)
@@ -1020,9 +2592,9 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
                     if r.get("status") == "success":
                         current_status.setdefault("modules", {})[r["module"]] = r
                         ctx["_did_install"] = True
+                flush_shared_files(ctx)
                 current_status["updated_at"] = datetime.now().isoformat()
-                with Path(ctx["status_file"]).open("w", encoding="utf-8") as fh:
-                    json.dump(current_status, fh, indent=2, ensure_ascii=False)
+                save_installed_status(current_status, ctx)
 
         elif cmd == "u":
             # Uninstall
@@ -1044,6 +2616,7 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
                         print(f"  [+] {name} uninstalled")
                     except Exception as exc:
                         print(f"  [X] {name} failed: {exc}")
+                flush_shared_files(ctx)
                 update_status_after_uninstall(list(to_uninstall.keys()), ctx)
 
         elif cmd == "ia":
@@ -1053,7 +2626,11 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
                 print("All modules already installed.")
                 continue
 
-            to_install, auto_added = add_required_modules_for_install(to_install, config)
+            try:
+                to_install, auto_added = add_required_modules_for_install(to_install, config)
+            except ValueError as exc:
+                print(f"Error: {exc}")
+                continue
             if auto_added:
                 print(f"Auto-added dependencies: {', '.join(auto_added)}")
 
@@ -1072,12 +2649,14 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
             ctx["selected_modules"] = set(to_install.keys())
             total = len(to_install)
             results = []
-            for idx, (name, cfg) in enumerate(to_install.items(), 1):
-                print(f"[{idx}/{total}] Installing module: {name}...")
-                try:
-                    results.append(execute_module(name, cfg, ctx))
+            scheduled = schedule_modules(
+                to_install, ctx, stop_on_error=False, on_start=_progress(total, "Installing")
+            )
+            for name, result, exc in scheduled:
+                if exc is None:
+                    results.append(result)
                     print(f"  [+] {name} installed")
-                except Exception as exc:
+                else:
                     print(f"  [X] {name} failed: {exc}")
 
             current_status = load_installed_status(ctx)
@@ -1085,9 +2664,9 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
                 if r.get("status") == "success":
                     current_status.setdefault("modules", {})[r["module"]] = r
                     ctx["_did_install"] = True
+            flush_shared_files(ctx)
             current_status["updated_at"] = datetime.now().isoformat()
-            with Path(ctx["status_file"]).open("w", encoding="utf-8") as fh:
-                json.dump(current_status, fh, indent=2, ensure_ascii=False)
+            save_installed_status(current_status, ctx)
 
         elif cmd == "ua":
             # Uninstall all installed modules
@@ -1108,6 +2687,7 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
                     print(f"  [+] {name} uninstalled")
                 except Exception as exc:
                     print(f"  [X] {name} failed: {exc}")
+            flush_shared_files(ctx)
             update_status_after_uninstall(list(to_uninstall.keys()), ctx)
 
         elif cmd == "ri":
@@ -1116,6 +2696,11 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
             if not to_reinstall:
                 print("No installed modules to reinstall.")
                 continue
+            try:
+                to_reinstall = sort_modules_by_dependencies(to_reinstall, config)
+            except ValueError as exc:
+                print(f"Error: {exc}")
+                continue
 
             print(f"\nReinstalling all installed modules: {', '.join(to_reinstall.keys())}")
             confirm = input("Confirm? (y/N): ").strip().lower()
@@ -1135,12 +2720,14 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
 
                 total = len(to_reinstall)
                 results = []
-                for idx, (name, cfg) in enumerate(to_reinstall.items(), 1):
-                    print(f"[{idx}/{total}] Reinstalling module: {name}...")
-                    try:
-                        results.append(execute_module(name, cfg, ctx))
+                scheduled = schedule_modules(
+                    to_reinstall, ctx, stop_on_error=False, on_start=_progress(total, "Reinstalling")
+                )
+                for name, result, exc in scheduled:
+                    if exc is None:
+                        results.append(result)
                         print(f"  [+] {name} reinstalled")
-                    except Exception as exc:
+                    else:
                         print(f"  [X] {name} failed: {exc}")
 
                 current_status = load_installed_status(ctx)
@@ -1148,9 +2735,9 @@ def interactive_manage(config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
                     if r.get("status") == "success":
                         current_status.setdefault("modules", {})[r["module"]] = r
                         ctx["_did_install"] = True
+                flush_shared_files(ctx)
                 current_status["updated_at"] = datetime.now().isoformat()
-                with Path(ctx["status_file"]).open("w", encoding="utf-8") as fh:
-                    json.dump(current_status, fh, indent=2, ensure_ascii=False)
+                save_installed_status(current_status, ctx)
             finally:
                 ctx["force"] = old_force
 
@@ -1199,7 +2786,105 @@ def ensure_install_dir(path: Path) -> None:
         raise PermissionError(f"No write permission for install dir: {path}")
 
 
+# =============================================================================
+# Profiling
+# =============================================================================
+
+class OpTimer:
+    """Times one step of a module install.
+
+    stop() stamps duration_ms (plus files/bytes when given) onto the step's
+    operations record and, with --profile, adds a Chrome-trace event.
+    """
+
+    def __init__(self, ctx: Dict[str, Any], module: str, step: str, start: Optional[float] = None):
+        self.ctx = ctx
+        self.module = module
+        self.step = step
+        self.start = time.perf_counter() if start is None else start
+
+    def stop(
+        self,
+        record: Optional[Dict[str, Any]] = None,
+        files: Optional[int] = None,
+        nbytes: Optional[int] = None,
+        end: Optional[float] = None,
+    ) -> Optional[Dict[str, Any]]:
+        end = time.perf_counter() if end is None else end
+        duration_ms = round((end - self.start) * 1000, 3)
+        counters = {"files": files, "bytes": nbytes}
+        if record is not None:
+            record["duration_ms"] = duration_ms
+            record.update({k: v for k, v in counters.items() if v is not None})
+        if self.ctx.get("profile"):
+            t0 = self.ctx.setdefault("_trace_t0", _PROCESS_T0)
+            event = {
+                "name": f"{self.module}:{self.step}",
+                "cat": self.step,
+                "ph": "X",
+                "ts": round((self.start - t0) * 1e6),
+                "dur": round((end - self.start) * 1e6),
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": {
+                    "module": self.module,
+                    "status": (record or {}).get("status", "success"),
+                    **{k: v for k, v in counters.items() if v is not None},
+                },
+            }
+            with _STATE_LOCK:
+                _ensure_list(self.ctx, "_trace").append(event)
+        return record
+
+
+def print_profile(ctx: Dict[str, Any], trace_path: Optional[str] = None) -> None:
+    """Print the --profile breakdown and optionally write a Chrome trace."""
+    events = ctx.get("_trace", [])
+    if trace_path:
+        trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        _write_text_atomic(Path(trace_path).expanduser(), _dump_json(trace))
+    if not events:
+        print("\nProfile: no module operations ran")
+        return
+
+    steps = [e for e in events if e["cat"] != "module"]
+    print("\n" + "=" * 70)
+    print("Profile (slowest first)")
+    print("=" * 70)
+    print(f"{'Module':<18} {'Step':<16} {'ms':>10} {'Files':>8} {'Bytes':>12} Status")
+    print("-" * 70)
+    for e in sorted(steps, key=lambda e: e["dur"], reverse=True):
+        args = e["args"]
+        print(
+            f"{args['module']:<18} {e['cat']:<16} {e['dur'] / 1000:>10.1f}"
+            f" {args.get('files', ''):>8} {args.get('bytes', ''):>12} {args['status']}"
+        )
+
+    totals: Dict[str, float] = {}
+    for e in events:
+        if e["cat"] == "module":
+            totals[e["args"]["module"]] = totals.get(e["args"]["module"], 0) + e["dur"]
+    if totals:
+        print("-" * 70)
+        for module, dur in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+            print(f"{module:<18} {'(file ops)':<16} {dur / 1000:>10.1f}")
+    if trace_path:
+        print(f"\nChrome trace written to {trace_path} (open in chrome://tracing or Perfetto)")
+
+
 def execute_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Install one module: wrapper, file operations, then hooks and agents."""
+    result = install_module_files(name, cfg, ctx)
+    merge_module_integrations(name, cfg, ctx, result)
+    return result
+
+
+def install_module_files(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the wrapper check and the module's file operations.
+
+    Safe to call from worker threads: each module writes its own targets, and
+    the wrapper build is serialized by ensure_wrapper_installed.
+    """
     result: Dict[str, Any] = {
         "module": name,
         "status": "success",
@@ -1207,14 +2892,16 @@ def execute_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[
         "installed_at": datetime.now().isoformat(),
     }
 
+    module_timer = OpTimer(ctx, name, "module")
     if name in WRAPPER_REQUIRED_MODULES:
+        timer = OpTimer(ctx, name, "ensure_wrapper")
         try:
             ensure_wrapper_installed(ctx)
-            result["operations"].append({"type": "ensure_wrapper", "status": "success"})
+            result["operations"].append(timer.stop({"type": "ensure_wrapper", "status": "success"}))
         except Exception as exc:  # noqa: BLE001
             result["status"] = "failed"
             result["operations"].append(
-                {"type": "ensure_wrapper", "status": "failed", "error": str(exc)}
+                timer.stop({"type": "ensure_wrapper", "status": "failed", "error": str(exc)})
             )
             write_log(
                 {
@@ -1223,31 +2910,72 @@ def execute_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[
                 },
                 ctx,
             )
+            _remember_result(result, ctx)
             raise
 
-    for op in cfg.get("operations", []):
-        op_type = op.get("type")
-        try:
-            if op_type == "copy_dir":
-                op_copy_dir(op, ctx)
-            elif op_type == "copy_file":
-                op_copy_file(op, ctx)
-            elif op_type == "merge_dir":
-                merged = op_merge_dir(op, ctx)
-                if merged:
-                    result.setdefault("merge_dir_files", []).extend(merged)
-            elif op_type == "merge_json":
-                op_merge_json(op, ctx)
-            elif op_type == "run_command":
-                op_run_command(op, ctx)
-            else:
-                raise ValueError(f"Unknown operation type: {op_type}")
+    previous = cached_installed_status(ctx).get("modules", {}).get(name, {})
+    manifest = FileManifest(ctx, previous.get("files") if isinstance(previous, dict) else None, name)
+
+    ops = cfg.get("operations", [])
+    journal: Optional[InstallJournal] = ctx.get("_journal")
+    for indices in _operation_groups(ops):
+        if journal is not None:
+            pending = []
+            for idx in indices:
+                entry = journal.completed(name, idx, ops[idx])
+                if entry is None:
+                    pending.append(idx)
+                    continue
+                manifest.files.update(entry.get("files", {}))
+                if entry.get("merged"):
+                    result.setdefault("merge_dir_files", []).extend(entry["merged"])
+                result["operations"].append({"type": ops[idx].get("type"), "status": "success", "resumed": True})
+            indices = pending
+            if not indices:
+                continue
+        group = [ops[idx] for idx in indices]
+        files_before, bytes_before = manifest.files_copied, manifest.bytes_copied
+        keys_before = set(manifest.files)
+        merged_before = len(result.get("merge_dir_files", []))
+        if len(group) > 1:
+            spans: List[Tuple[float, float]] = []
+            errors = run_commands(group, ctx, spans)
+            timers = [OpTimer(ctx, name, str(op.get("type")), start) for op, (start, _end) in zip(group, spans)]
+            ends: List[Optional[float]] = [end for _start, end in spans]
+            counters: Dict[str, Optional[int]] = {"files": None, "nbytes": None}
+        else:
+            timers = [OpTimer(ctx, name, str(group[0].get("type")))]
+            errors = [None]
+            try:
+                _run_operation(group[0], ctx, manifest, result)
+            except Exception as exc:  # noqa: BLE001
+                errors = [exc]
+            ends = [time.perf_counter()]
+            counters = {}
+            if group[0].get("type") in ("copy_dir", "copy_file", "merge_dir"):
+                counters = {
+                    "files": manifest.files_copied - files_before,
+                    "nbytes": manifest.bytes_copied - bytes_before,
+                }
 
-            result["operations"].append({"type": op_type, "status": "success"})
-        except Exception as exc:  # noqa: BLE001
+        for idx, op, exc, timer, end in zip(indices, group, errors, timers, ends):
+            op_type = op.get("type")
+            if exc is None:
+                result["operations"].append(
+                    timer.stop({"type": op_type, "status": "success"}, end=end, **counters)
+                )
+                if journal is not None:
+                    journal.record(
+                        name,
+                        idx,
+                        op,
+                        {rel: e for rel, e in manifest.files.items() if rel not in keys_before},
+                        result.get("merge_dir_files", [])[merged_before:],
+                    )
+                continue
             result["status"] = "failed"
             result["operations"].append(
-                {"type": op_type, "status": "failed", "error": str(exc)}
+                timer.stop({"type": op_type, "status": "failed", "error": str(exc)}, end=end, **counters)
             )
             write_log(
                 {
@@ -1256,8 +2984,67 @@ def execute_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[
                 },
                 ctx,
             )
-            raise
+        failure = next((exc for exc in errors if exc is not None), None)
+        if failure is not None:
+            result["files"] = manifest.files
+            _remember_result(result, ctx)
+            raise failure
+
+    result["files"] = manifest.files
+    module_timer.stop(files=manifest.files_copied, nbytes=manifest.bytes_copied)
+    _remember_result(result, ctx)
+    return result
+
+
+def _remember_result(result: Dict[str, Any], ctx: Dict[str, Any]) -> None:
+    """Keep a module's outcome, including ones a failed run never yields."""
+    with _STATE_LOCK:
+        ctx.setdefault("_module_results", {})[result["module"]] = result
+
+
+def _operation_groups(ops: List[Dict[str, Any]]) -> Iterator[List[int]]:
+    """Yield op indices in order; consecutive run_command ops marked parallel form one group."""
+    batch: List[int] = []
+    for idx, op in enumerate(ops):
+        if op.get("type") == "run_command" and op.get("parallel"):
+            batch.append(idx)
+            continue
+        if batch:
+            yield batch
+            batch = []
+        yield [idx]
+    if batch:
+        yield batch
+
+
+def _run_operation(
+    op: Dict[str, Any], ctx: Dict[str, Any], manifest: FileManifest, result: Dict[str, Any]
+) -> None:
+    op_type = op.get("type")
+    if op_type == "copy_dir":
+        op_copy_dir(op, ctx, manifest)
+    elif op_type == "copy_file":
+        op_copy_file(op, ctx, manifest)
+    elif op_type == "merge_dir":
+        merged = op_merge_dir(op, ctx, manifest)
+        if merged:
+            result.setdefault("merge_dir_files", []).extend(merged)
+    elif op_type == "merge_json":
+        op_merge_json(op, ctx)
+    elif op_type == "run_command":
+        op_run_command(op, ctx)
+    else:
+        raise ValueError(f"Unknown operation type: {op_type}")
+
 
+def merge_module_integrations(
+    name: str, cfg: Dict[str, Any], ctx: Dict[str, Any], result: Dict[str, Any]
+) -> None:
+    """Merge module hooks into settings.json and agents into models.json.
+
+    Both targets are shared across modules, so callers must run this serially
+    and in plan order to keep the merged files deterministic.
+    """
     # On force-reinstall, remove stale module hooks first so path normalization
     # in _replace_hook_variables is applied cleanly without stale duplicates.
     if ctx.get("force"):
@@ -1268,73 +3055,1018 @@ def execute_module(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[
     if hooks_results:
         has_hook_entries = False
         for hooks_config, plugin_root in hooks_results:
+            timer = OpTimer(ctx, name, "merge_hooks")
             try:
                 changed = merge_hooks_to_settings(name, hooks_config, ctx, plugin_root)
                 if changed:
-                    result["operations"].append({"type": "merge_hooks", "status": "success"})
+                    result["operations"].append(timer.stop({"type": "merge_hooks", "status": "success"}))
                     has_hook_entries = True
+                else:
+                    timer.stop()
             except Exception as exc:
                 write_log({"level": "WARNING", "message": f"Failed to merge hooks for {name}: {exc}"}, ctx)
-                result["operations"].append({"type": "merge_hooks", "status": "failed", "error": str(exc)})
+                result["operations"].append(
+                    timer.stop({"type": "merge_hooks", "status": "failed", "error": str(exc)})
+                )
         if has_hook_entries:
             result["has_hooks"] = True
 
     # Handle agents: merge module agent configs into ~/.codeagent/models.json
     module_agents = cfg.get("agents", {})
     if module_agents:
+        timer = OpTimer(ctx, name, "merge_agents")
         try:
             merge_agents_to_models(name, module_agents, ctx)
-            result["operations"].append({"type": "merge_agents", "status": "success"})
+            result["operations"].append(timer.stop({"type": "merge_agents", "status": "success"}))
             result["has_agents"] = True
         except Exception as exc:
             write_log({"level": "WARNING", "message": f"Failed to merge agents for {name}: {exc}"}, ctx)
-            result["operations"].append({"type": "merge_agents", "status": "failed", "error": str(exc)})
+            result["operations"].append(
+                timer.stop({"type": "merge_agents", "status": "failed", "error": str(exc)})
+            )
 
-    return result
 
+# =============================================================================
+# Resume Journal
+# =============================================================================
 
-def _source_path(op: Dict[str, Any], ctx: Dict[str, Any]) -> Path:
-    return (ctx["config_dir"] / Path(str(op["source"]).replace("\\", "/"))).expanduser().resolve()
+def _op_key(op: Dict[str, Any], ctx: Dict[str, Any]) -> str:
+    """Hash of an operation and the stat fingerprint of its sources.
 
+    Sources are fingerprinted by relative path, size and mtime rather than
+    content, so checking a journal entry costs a walk of stats.
+    """
+    digest = hashlib.sha256(json.dumps(op, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    digest.update(str(ctx["install_dir"]).encode("utf-8") + b"\0")
+    if op.get("type") in ("copy_dir", "copy_file", "merge_dir", "merge_json"):
+        src = _source_path(op, ctx)
+        paths = [src]
+        if src.is_dir():
+            paths = sorted(Path(root) / name for root, _dirs, files in os.walk(src, followlinks=True) for name in files)
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rel = os.path.relpath(path, src)
+            digest.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\0".encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
 
-def _target_path(op: Dict[str, Any], ctx: Dict[str, Any]) -> Path:
-    return (ctx["install_dir"] / Path(str(op["target"]).replace("\\", "/"))).expanduser().resolve()
 
+class InstallJournal:
+    """Append-only record of the operations a --module install completed.
 
-def _record_created(path: Path, ctx: Dict[str, Any]) -> None:
-    install_dir = Path(ctx["install_dir"]).resolve()
-    resolved = Path(path).resolve()
-    if resolved == install_dir or install_dir not in resolved.parents:
-        return
-    applied = _ensure_list(ctx, "applied_paths")
-    if resolved not in applied:
-        applied.append(resolved)
+    One JSON object per line in JOURNAL_FILE: a header, then one entry per
+    finished operation keyed by module, op index and _op_key, with the
+    manifest entries the operation wrote. A failed --keep-partial install
+    keeps its completed operations and the journal; --resume skips every
+    journaled operation whose key still matches and whose files are still in
+    place. The journal is removed once an install succeeds.
+    """
 
+    def __init__(self, ctx: Dict[str, Any]):
+        self.ctx = ctx
+        self.path = Path(ctx["install_dir"]) / JOURNAL_FILE
+        self.entries: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._fh: Optional[Any] = None
+
+    def open(self, modules: Iterable[str], resume: bool) -> int:
+        """Start journaling; with resume, load the previous run's entries.
+
+        Returns the number of entries carried over.
+        """
+        if resume and self.path.exists():
+            with self.path.open("r", encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash
+                        continue
+                    if isinstance(entry, dict) and "module" in entry:
+                        self.entries[(entry["module"], entry.get("op", -1))] = entry
+            self._fh = self.path.open("a", encoding="utf-8")
+        else:
+            self._fh = self.path.open("w", encoding="utf-8")
+        self._append(
+            {"journal": JOURNAL_FORMAT, "started_at": datetime.now().isoformat(), "modules": list(modules)}
+        )
+        return len(self.entries)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            if self._fh is not None:
+                self._fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self._fh.flush()
+
+    def completed(self, module: str, idx: int, op: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The journal entry for this op if it is done and its targets are intact."""
+        entry = self.entries.get((module, idx))
+        if entry is None or entry.get("key") != _op_key(op, self.ctx):
+            return None
+        install_dir = Path(self.ctx["install_dir"])
+        for rel, record in entry.get("files", {}).items():
+            try:
+                st = os.stat(install_dir / rel)
+            except OSError:
+                return None
+            if st.st_size != record.get("size") or st.st_mtime_ns != record.get("mtime_ns"):
+                return None
+        return entry
+
+    def record(
+        self,
+        module: str,
+        idx: int,
+        op: Dict[str, Any],
+        files: Dict[str, Any],
+        merged: Optional[List[str]] = None,
+    ) -> None:
+        entry: Dict[str, Any] = {"module": module, "op": idx, "type": op.get("type"), "key": _op_key(op, self.ctx)}
+        if files:
+            entry["files"] = files
+        if merged:
+            entry["merged"] = merged
+        self._append(entry)
+
+    def close(self, remove: bool = False) -> None:
+        with self._lock:
+            fh, self._fh = self._fh, None
+        if fh is not None:
+            fh.close()
+        if remove:
+            self.path.unlink(missing_ok=True)
 
-def op_copy_dir(op: Dict[str, Any], ctx: Dict[str, Any]) -> None:
-    src = _source_path(op, ctx)
-    dst = _target_path(op, ctx)
 
-    existed_before = dst.exists()
-    if existed_before and not ctx.get("force", False):
-        # Only skip if directory exists AND is non-empty (consistent with check_module_installed)
-        if dst.is_dir() and any(dst.iterdir()):
-            write_log({"level": "INFO", "message": f"Skip existing dir: {dst}"}, ctx)
-            return
-        write_log({"level": "INFO", "message": f"Re-populating empty dir: {dst}"}, ctx)
+# =============================================================================
+# Pre-flight Planning
+# =============================================================================
 
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    shutil.copytree(src, dst, dirs_exist_ok=True)
-    if not existed_before:
-        _record_created(dst, ctx)
-    write_log({"level": "INFO", "message": f"Copied dir {src} -> {dst}"}, ctx)
+def _format_size(nbytes: int) -> str:
+    size = float(nbytes)
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
 
 
-def op_merge_dir(op: Dict[str, Any], ctx: Dict[str, Any]) -> List[str]:
-    """Merge source dir's subdirs (commands/, agents/, etc.) into install_dir."""
+def _unwritable(path: Path) -> Optional[str]:
+    """Why path could not be created or written, or None if it can."""
+    probe = path
+    while not os.path.lexists(probe) and probe.parent != probe:
+        probe = probe.parent
+    if not probe.is_dir():
+        return f"{probe} is not a directory"
+    if not os.access(probe, os.W_OK | os.X_OK):
+        return f"{probe} is not writable"
+    return None
+
+
+def _check_hooks(src: Path, problems: List[str], warnings: List[str]) -> None:
+    """Parse hooks.json under a copy_dir source and check the scripts it references.
+
+    Only an unparseable hooks.json is a problem; a hooks/ dir without one or a
+    hook script missing from the source installs as before and is a warning.
+    """
+    candidates = [src / rel for rel in ("hooks/hooks.json", "hooks.json")]
+    if (src / "hooks").is_dir() and not any(path.is_file() for path in candidates):
+        warnings.append(f"{src / 'hooks'} has no hooks.json")
+    for path in candidates:
+        if not path.is_file():
+            continue
+        try:
+            hooks = _load_json(path).get("hooks", {})
+        except (ValueError, AttributeError) as exc:
+            problems.append(f"bad hooks file {path}: {exc}")
+            continue
+        for entry in (e for entries in hooks.values() for e in entries):
+            for hook in entry.get("hooks", []) if isinstance(entry, dict) else []:
+                command = str(hook.get("command", "")) if isinstance(hook, dict) else ""
+                if not command.startswith("${CLAUDE_PLUGIN_ROOT}/"):
+                    continue
+                script = command[len("${CLAUDE_PLUGIN_ROOT}/"):].split()[0]
+                if not (src / script).exists():
+                    warnings.append(f"{path} references missing {script}")
+
+
+def _plan_op(name: str, idx: int, op: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Check one operation without writing anything and estimate what it writes."""
+    op_type = op.get("type")
+    plan: Dict[str, Any] = {
+        "module": name, "op": idx, "type": op_type, "target": "",
+        "files": 0, "bytes": 0, "write_files": 0, "write_bytes": 0, "problems": [], "warnings": [],
+    }
+    problems: List[str] = plan["problems"]
+    force = ctx.get("force", False)
+    try:
+        if op_type in ("copy_dir", "copy_file", "merge_dir"):
+            src = _source_path(op, ctx)
+            dst = Path(ctx["install_dir"]) if op_type == "merge_dir" else _target_path(op, ctx)
+            plan["target"] = str(dst)
+            if not (src.is_file() if op_type == "copy_file" else src.is_dir()):
+                problems.append(f"source not found: {src}")
+                return plan
+            skip_all = not force and (
+                (op_type == "copy_dir" and dst.is_dir() and any(dst.iterdir()))
+                or (op_type == "copy_file" and os.path.lexists(dst))
+            )
+            for src_file, dst_file in _expected_files((name, op_type, src, dst, "copy")):
+                try:
+                    src_st = os.stat(src_file)
+                except OSError as exc:
+                    problems.append(f"cannot stat {src_file}: {exc.strerror}")
+                    continue
+                if not os.access(src_file, os.R_OK):
+                    problems.append(f"unreadable: {src_file}")
+                plan["files"] += 1
+                plan["bytes"] += src_st.st_size
+                if skip_all or (op_type == "merge_dir" and not force and dst_file.exists()):
+                    continue
+                try:
+                    dst_st = os.stat(dst_file)
+                    if (dst_st.st_size, dst_st.st_mtime_ns) == (src_st.st_size, src_st.st_mtime_ns):
+                        continue
+                except OSError:
+                    pass
+                plan["write_files"] += 1
+                plan["write_bytes"] += src_st.st_size
+            reason = _unwritable(dst if op_type == "merge_dir" else dst.parent)
+            if reason:
+                problems.append(reason)
+            if op_type == "copy_dir":
+                _check_hooks(src, problems, plan["warnings"])
+        elif op_type == "merge_json":
+            src = _source_path(op, ctx)
+            dst = _target_path(op, ctx)
+            plan["target"] = str(dst)
+            for path in (src, dst) if dst.exists() else (src,):
+                try:
+                    _load_json(path)
+                except (ValueError, FileNotFoundError, OSError) as exc:
+                    problems.append(str(exc))
+            plan["write_files"] = plan["files"] = 1
+            reason = _unwritable(dst.parent)
+            if reason:
+                problems.append(reason)
+        elif op_type == "run_command":
+            command = str(op.get("command", ""))
+            plan["target"] = command
+            try:
+                program = shlex.split(command)[0]
+            except (ValueError, IndexError) as exc:
+                problems.append(f"cannot parse command {command!r}: {exc}")
+            else:
+                if (
+                    "=" not in program
+                    and program not in SHELL_BUILTINS
+                    and not shutil.which(program)
+                    and not (ctx["config_dir"] / program).exists()
+                ):
+                    problems.append(f"command not found: {program}")
+        else:
+            problems.append(f"unknown operation type: {op_type}")
+    except OSError as exc:
+        problems.append(str(exc))
+    return plan
+
+
+def plan_modules(modules: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Check every operation of modules in parallel before anything is written.
+
+    Resolves and stats each source and target, parses every JSON input
+    (merge_json sources and targets, hooks.json) and estimates the files and
+    bytes to be written. Returns the per-op plans, totals, all problems and
+    the warnings that do not stop an install.
+    """
+    items = [
+        (name, idx, op)
+        for name, cfg in modules.items()
+        for idx, op in enumerate(cfg.get("operations", []))
+    ]
+    with _ContextPool(max_workers=ctx["jobs"]) as pool:
+        ops = list(pool.map(lambda item: _plan_op(*item, ctx), items))
+
+    problems = [
+        f"{plan['module']}: op {plan['op'] + 1} ({plan['type']}): {problem}"
+        for plan in ops
+        for problem in plan["problems"]
+    ]
+    warnings = [
+        f"{plan['module']}: op {plan['op'] + 1} ({plan['type']}): {warning}"
+        for plan in ops
+        for warning in plan["warnings"]
+    ]
+    if set(modules) & WRAPPER_REQUIRED_MODULES:
+        config_dir = Path(ctx["config_dir"])
+        binary = Path(ctx["install_dir"]) / "bin" / "codeagent-wrapper"
+        if not (config_dir / "install.sh").is_file() and not binary.is_file():
+            problems.append(f"codeagent-wrapper: {config_dir / 'install.sh'} not found")
+    return {
+        "ops": ops,
+        "problems": problems,
+        "warnings": warnings,
+        **{key: sum(plan[key] for plan in ops) for key in ("files", "bytes", "write_files", "write_bytes")},
+    }
+
+
+def preflight(modules: Dict[str, Any], ctx: Dict[str, Any], show_plan: bool = False) -> bool:
+    """Plan modules and print the result. Returns False if any problem was found."""
+    plan = plan_modules(modules, ctx)
+    if show_plan:
+        print(f"{'Module':<15} {'Operation':<12} {'Files':>6} {'Write':>10}  Target")
+        print("-" * 70)
+        for op in plan["ops"]:
+            write = _format_size(op["write_bytes"]) if op["write_files"] else "-"
+            print(f"{op['module']:<15} {op['type']:<12} {op['files']:>6} {write:>10}  {op['target']}")
+        print("-" * 70)
+    print(
+        f"Plan: {len(plan['ops'])} operation(s), {plan['files']} file(s) ({_format_size(plan['bytes'])}); "
+        f"{plan['write_files']} to write ({_format_size(plan['write_bytes'])})"
+    )
+    if plan["warnings"]:
+        print(f"[!] Pre-flight found {len(plan['warnings'])} warning(s):", file=sys.stderr)
+        for warning in plan["warnings"]:
+            print(f"  - {warning}", file=sys.stderr)
+    if plan["problems"]:
+        print(f"\n[X] Pre-flight found {len(plan['problems'])} problem(s); nothing was written:", file=sys.stderr)
+        for problem in plan["problems"]:
+            print(f"  - {problem}", file=sys.stderr)
+        return False
+    return True
+
+
+# =============================================================================
+# Module Scheduling
+# =============================================================================
+
+def schedule_modules(
+    modules: Dict[str, Any],
+    ctx: Dict[str, Any],
+    stop_on_error: bool = True,
+    on_start: Optional[Callable[[str], None]] = None,
+) -> Iterator[Tuple[str, Optional[Dict[str, Any]], Optional[Exception]]]:
+    """Install modules on a worker pool, ordered by their dependency DAG.
+
+    A module starts once every dependency that is part of this run has
+    finished its file operations. Results are yielded as (name, result, error)
+    in the order of ``modules``; hook and agent merges happen on the caller's
+    thread as each result is yielded, so shared files are written serially
+    and deterministically.
+
+    With stop_on_error, no new module is started after a failure. Breaking
+    out of the loop cancels pending modules and waits for running ones, so a
+    following rollback() sees every applied path. on_start is called on the
+    caller's thread with each module's name as it is started.
+    """
+    order = list(modules.keys())
+    pending_deps = {
+        name: {dep for dep in cfg.get("dependencies", []) if dep in modules and dep != name}
+        for name, cfg in modules.items()
+    }
+    jobs = max(1, int(ctx.get("jobs") or 1))
+
+    futures: Dict[Future, str] = {}
+    finished: Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Exception]]] = {}
+    started: set = set()
+    failed = False
+    next_idx = 0
+
+    executor = _ContextPool(max_workers=min(jobs, max(1, len(order))))
+    try:
+        while next_idx < len(order):
+            if not (failed and stop_on_error):
+                for name in order:
+                    if name not in started and not pending_deps[name]:
+                        started.add(name)
+                        if on_start is not None:
+                            on_start(name)
+                        future = executor.submit(install_module_files, name, modules[name], ctx)
+                        futures[future] = name
+
+            if not futures and order[next_idx] not in finished:
+                if failed and stop_on_error:
+                    # Dependents of the failure never started; report the failure itself
+                    for name in order[next_idx:]:
+                        if name in finished and finished[name][1] is not None:
+                            yield name, None, finished[name][1]
+                            break
+                    return
+                waiting = [name for name in order if name not in started]
+                raise ValueError(f"Dependency cycle among modules: {', '.join(waiting)}")
+
+            if futures and order[next_idx] not in finished:
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures.pop(future)
+                    exc = future.exception()
+                    finished[name] = (None, exc) if exc else (future.result(), None)
+                    failed = failed or exc is not None
+                    for deps in pending_deps.values():
+                        deps.discard(name)
+
+            # Commit finished modules in plan order
+            while next_idx < len(order) and order[next_idx] in finished:
+                name = order[next_idx]
+                result, exc = finished[name]
+                next_idx += 1
+                if result is not None:
+                    merge_module_integrations(name, modules[name], ctx, result)
+                yield name, result, exc
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _progress(total: int, verb: str) -> Callable[[str], None]:
+    """on_start callback for schedule_modules printing "[n/total] <verb> module: <name>..."."""
+    counter = itertools.count(1)
+    return lambda name: print(f"[{next(counter)}/{total}] {verb} module: {name}...")
+
+
+def _source_path(op: Dict[str, Any], ctx: Dict[str, Any]) -> Path:
+    return (ctx["config_dir"] / Path(str(op["source"]).replace("\\", "/"))).expanduser().resolve()
+
+
+def _target_path(op: Dict[str, Any], ctx: Dict[str, Any]) -> Path:
+    return _no_follow(ctx["install_dir"] / Path(str(op["target"]).replace("\\", "/")))
+
+
+def _copy_strategy(op: Dict[str, Any], ctx: Dict[str, Any]) -> str:
+    strategy = str(op.get("strategy") or ctx.get("copy_strategy") or "copy")
+    # Bundle sources live in a temp dir removed after the run
+    if strategy == "symlink" and ctx.get("from_bundle"):
+        return "copy"
+    return strategy
+
+
+def _record_created(path: Path, ctx: Dict[str, Any]) -> None:
+    install_dir = Path(ctx["install_dir"]).resolve()
+    resolved = _no_follow(path)
+    if resolved == install_dir or install_dir not in resolved.parents:
+        return
+    with _STATE_LOCK:
+        applied = _ensure_list(ctx, "applied_paths")
+        if resolved not in applied:
+            applied.append(resolved)
+
+
+# =============================================================================
+# File Manifest
+# =============================================================================
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Source file hashes keyed by (path, size, mtime_ns, ino), shared by every
+# install target in the run so each source is hashed at most once.
+_SOURCE_HASHES: Dict[Tuple[str, int, int, int], str] = {}
+
+
+def _source_key(path: Path) -> Optional[Tuple[str, int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (str(path), st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def _source_sha256(path: Path) -> str:
+    """_file_sha256 for source files, memoized for the process."""
+    key = _source_key(path)
+    cached = _SOURCE_HASHES.get(key) if key else None
+    if cached is None:
+        cached = _file_sha256(path)
+        if key is not None:
+            _SOURCE_HASHES[key] = cached
+    return cached
+
+
+def _copy_file_hashed(src: Path, dst: Path) -> str:
+    """Copy src to dst like shutil.copy2, hashing the content in the same pass."""
+    digest = hashlib.sha256()
+    with src.open("rb") as fin, dst.open("wb") as fout:
+        for chunk in iter(lambda: fin.read(1024 * 1024), b""):
+            digest.update(chunk)
+            fout.write(chunk)
+    shutil.copystat(src, dst)
+    return digest.hexdigest()
+
+
+# (strategy, src_dev, dst_dev) combinations where a strategy failed; later
+# files on the same filesystems go straight to the fallback.
+_UNSUPPORTED_STRATEGIES: set = set()
+_FICLONE = 0x40049409
+
+
+def _fs_key(strategy: str, src: Path, dst_dir: Path) -> Optional[Tuple[str, int, int]]:
+    try:
+        return (strategy, os.stat(src).st_dev, os.stat(dst_dir).st_dev)
+    except OSError:
+        return None
+
+
+def _strategy_supported(strategy: str, src: Path, dst_dir: Path) -> bool:
+    """Whether strategy is usable between src's and dst_dir's filesystems."""
+    if strategy == "copy":
+        return True
+    key = _fs_key(strategy, src, dst_dir)
+    if key is None:
+        return False
+    if strategy == "hardlink" and key[1] != key[2]:
+        return False
+    return key not in _UNSUPPORTED_STRATEGIES
+
+
+def _reflink_file(src: Path, dst: Path) -> None:
+    """Clone src into dst with FICLONE, falling back to copy_file_range."""
+    with src.open("rb") as fin, dst.open("wb") as fout:
+        ficlone_key = _fs_key("ficlone", src, dst.parent)
+        try:
+            if ficlone_key in _UNSUPPORTED_STRATEGIES:
+                raise OSError(errno.EOPNOTSUPP, "FICLONE not supported")
+            import fcntl
+
+            fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+        except (ImportError, OSError):
+            if ficlone_key is not None:
+                _UNSUPPORTED_STRATEGIES.add(ficlone_key)
+            if not hasattr(os, "copy_file_range"):
+                raise OSError(errno.EOPNOTSUPP, "reflink not supported on this platform")
+            remaining = os.fstat(fin.fileno()).st_size
+            while remaining > 0:
+                written = os.copy_file_range(fin.fileno(), fout.fileno(), remaining)
+                if written == 0:
+                    break
+                remaining -= written
+    shutil.copystat(src, dst)
+
+
+def _place_file(src: Path, dst: Path, strategy: str) -> Tuple[Optional[str], Optional[str]]:
+    """Materialize src at dst, falling back to a plain copy where unsupported.
+
+    Returns (link kind or None, sha256 if it was computed while copying).
+    """
+    # Replace rather than write through: dst may be a link into the source
+    if dst.is_symlink() or dst.is_file():
+        dst.unlink()
+
+    if strategy != "copy" and _strategy_supported(strategy, src, dst.parent):
+        try:
+            if strategy == "hardlink":
+                os.link(src, dst)
+                return "hardlink", None
+            if strategy == "symlink":
+                os.symlink(src, dst)
+                return "symlink", None
+            _reflink_file(src, dst)
+            return None, None
+        except OSError:
+            key = _fs_key(strategy, src, dst.parent)
+            if key is not None:
+                _UNSUPPORTED_STRATEGIES.add(key)
+            if os.path.lexists(dst):
+                dst.unlink()
+
+    key = _source_key(src)
+    known = _SOURCE_HASHES.get(key) if key else None
+    if known is not None:
+        # Already hashed for another target: let the kernel copy the data
+        shutil.copy2(src, dst)
+        return None, known
+    sha256 = _copy_file_hashed(src, dst)
+    if key is not None:
+        _SOURCE_HASHES[key] = sha256
+    return None, sha256
+
+
+class FileManifest:
+    """Files installed by one module, keyed by install-relative posix path.
+
+    Each entry records the config-relative source plus the target's size,
+    mtime (ns) and sha256. With the manifest from the previous install, a
+    target whose stat still matches its entry is only re-copied when the
+    source content changed, and targets whose source vanished are removed.
+    """
+
+    def __init__(
+        self,
+        ctx: Dict[str, Any],
+        previous: Optional[Dict[str, Any]] = None,
+        module: Optional[str] = None,
+    ):
+        self.install_dir = Path(ctx["install_dir"])
+        self.module = module
+        self.config_dir = Path(ctx["config_dir"])
+        self.previous: Dict[str, Any] = previous if isinstance(previous, dict) else {}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # Written by this run, for per-op profiling; linked files add no bytes
+        self.files_copied = 0
+        self.bytes_copied = 0
+
+    @staticmethod
+    def _rel(path: Path, root: Path) -> str:
+        return Path(os.path.relpath(path, root)).as_posix()
+
+    def _current_entry(
+        self, src: Path, dst: Path, entry: Any, strategy: str = "copy"
+    ) -> Optional[Dict[str, Any]]:
+        """Return the (possibly refreshed) entry if dst already holds src's content."""
+        if not isinstance(entry, dict):
+            return None
+        expected_link = None
+        if strategy in LINK_STRATEGIES and _strategy_supported(strategy, src, dst.parent):
+            expected_link = strategy
+        if entry.get("link") != expected_link:
+            return None
+        try:
+            if expected_link == "symlink":
+                return entry if os.readlink(dst) == str(src) else None
+            if expected_link == "hardlink":
+                return entry if os.path.samefile(src, dst) else None
+        except OSError:
+            return None
+
+        try:
+            src_st = src.stat()
+            dst_st = dst.stat()
+        except OSError:
+            return None
+        # Target replaced or edited since install
+        if dst_st.st_size != entry.get("size") or dst_st.st_mtime_ns != entry.get("mtime_ns"):
+            return None
+        if src_st.st_size != dst_st.st_size:
+            return None
+        if src_st.st_mtime_ns == dst_st.st_mtime_ns:
+            return entry
+        if _source_sha256(src) != entry.get("sha256"):
+            return None
+        # Same content, new source mtime (e.g. fresh checkout): align the target
+        # so the stat short-circuit hits next time.
+        os.utime(dst, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+        return {**entry, "mtime_ns": src_st.st_mtime_ns}
+
+    def _lookup(
+        self, src: Path, dst: Path, strategy: str, key: Optional[Path]
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        rel = self._rel(key or dst, self.install_dir)
+        entry = self.previous.get(rel)
+        if isinstance(entry, dict) and entry.get("src") == self._rel(src, self.config_dir):
+            return rel, self._current_entry(src, dst, entry, strategy)
+        return rel, None
+
+    def reuse(self, src: Path, dst: Path, strategy: str = "copy", key: Optional[Path] = None) -> bool:
+        """Record dst's entry and return True if it already holds src's content.
+
+        key is the final target path when dst is a staged copy of it.
+        """
+        rel, current = self._lookup(src, dst, strategy, key)
+        if current is None:
+            return False
+        self.files[rel] = current
+        return True
+
+    def place(self, src: Path, dst: Path, strategy: str = "copy", key: Optional[Path] = None) -> None:
+        """Write src to dst unconditionally and record the new entry."""
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        link, sha256 = _place_file(src, dst, strategy)
+        st = dst.stat()
+        record: Dict[str, Any] = {
+            "src": self._rel(src, self.config_dir),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": sha256 or _source_sha256(src),
+        }
+        if link:
+            record["link"] = link
+        else:
+            self.bytes_copied += st.st_size
+        self.files_copied += 1
+        self.files[self._rel(key or dst, self.install_dir)] = record
+
+    def sync_file(self, src: Path, dst: Path, strategy: str = "copy", key: Optional[Path] = None) -> bool:
+        """Place src at dst unless dst is already current. Returns True if written."""
+        if self.reuse(src, dst, strategy, key):
+            return False
+        self.place(src, dst, strategy, key)
+        return True
+
+    def tree_current(self, src: Path, dst: Path, strategy: str = "copy") -> bool:
+        """True (and entries recorded) if dst already mirrors src with nothing stale.
+
+        Read-only apart from mtime alignment, so an unchanged tree is never staged.
+        """
+        current: Dict[str, Dict[str, Any]] = {}
+        for root, _dirs, files in os.walk(src, followlinks=True):
+            target_root = dst / os.path.relpath(root, src)
+            for fname in files:
+                rel, entry = self._lookup(Path(root) / fname, target_root / fname, strategy, None)
+                if entry is None:
+                    return False
+                current[rel] = entry
+        prefix = self._rel(dst, self.install_dir) + "/"
+        if any(rel.startswith(prefix) and rel not in current for rel in self.previous):
+            return False
+        self.files.update(current)
+        return True
+
+    def sync_tree(
+        self, src: Path, dst: Path, strategy: str = "copy", key_root: Optional[Path] = None
+    ) -> Tuple[int, int]:
+        """Mirror every file under src into dst. Returns (copied, unchanged).
+
+        key_root is the final target when dst is its staging directory.
+        """
+        copied = unchanged = 0
+        for root, _dirs, files in os.walk(src, followlinks=True):
+            rel_root = os.path.relpath(root, src)
+            target_root = dst / rel_root
+            target_root.mkdir(parents=True, exist_ok=True)
+            for fname in files:
+                key = (key_root / rel_root / fname) if key_root else None
+                if self.sync_file(Path(root) / fname, target_root / fname, strategy, key):
+                    copied += 1
+                else:
+                    unchanged += 1
+        return copied, unchanged
+
+    def carry(self, dst: Path) -> None:
+        """Keep previous entries for a target that was intentionally skipped."""
+        rel = self._rel(dst, self.install_dir)
+        for key, entry in self.previous.items():
+            if key == rel or key.startswith(rel + "/"):
+                self.files.setdefault(key, entry)
+
+    def remove_stale(self, src_root: Path, stop_at: Path, stage: Optional[Path] = None) -> int:
+        """Delete previously installed files whose source under src_root is gone.
+
+        With stage, stop_at is being rebuilt in that staging directory and
+        only the staged copies are removed.
+        """
+        src_prefix = self._rel(src_root, self.config_dir)
+        root = stage or stop_at
+        removed = 0
+        for rel, entry in self.previous.items():
+            if rel in self.files or not isinstance(entry, dict):
+                continue
+            src_rel = str(entry.get("src", ""))
+            if src_rel != src_prefix and not src_rel.startswith(src_prefix + "/"):
+                continue
+            if (self.config_dir / src_rel).exists():
+                continue
+            rel_path = Path(rel)
+            if rel_path.is_absolute() or ".." in rel_path.parts:
+                continue
+            target = self.install_dir / rel_path
+            if stage is not None:
+                if stop_at not in target.parents:
+                    continue
+                target = stage / target.relative_to(stop_at)
+            try:
+                # unlink removes hardlinks/symlinks without touching the source
+                target.unlink()
+            except FileNotFoundError:
+                continue
+            removed += 1
+            parent = target.parent
+            while parent not in (root, self.install_dir) and root in parent.parents:
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+                parent = parent.parent
+        return removed
+
+
+# =============================================================================
+# Staging and Snapshots
+# =============================================================================
+
+_STAGE_IDS = itertools.count()
+
+
+def _sibling(path: Path, kind: str) -> Path:
+    """A hidden, unique path next to path, e.g. .cr.staging-1234-0."""
+    return path.parent / f".{path.name}.{kind}-{os.getpid()}-{next(_STAGE_IDS)}"
+
+
+def _snapshot_copy(src: str, dst: str) -> None:
+    """copytree copy_function that shares data with src instead of duplicating it."""
+    src_path, dst_path = Path(src), Path(dst)
+    for strategy in ("hardlink", "reflink"):
+        if not _strategy_supported(strategy, src_path, dst_path.parent):
+            continue
+        try:
+            if strategy == "hardlink":
+                os.link(src_path, dst_path)
+            else:
+                _reflink_file(src_path, dst_path)
+            return
+        except OSError:
+            key = _fs_key(strategy, src_path, dst_path.parent)
+            if key is not None:
+                _UNSUPPORTED_STRATEGIES.add(key)
+            if os.path.lexists(dst_path):
+                dst_path.unlink()
+    shutil.copy2(src_path, dst_path)
+
+
+def _remove_path(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, onerror=_remove_readonly)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def _swap_in(stage: Path, dst: Path, ctx: Dict[str, Any], owner: Optional[str] = None) -> None:
+    """Move a fully built stage into place, keeping the old dst as a snapshot.
+
+    The snapshot is restored by rollback() or deleted by discard_snapshots();
+    owner is the module whose operation replaced dst.
+    """
+    snapshot = None
+    if os.path.lexists(dst):
+        snapshot = _sibling(dst, "snapshot")
+        os.rename(dst, snapshot)
+    try:
+        os.rename(stage, dst)
+    except OSError:
+        if snapshot is not None:
+            os.rename(snapshot, dst)
+        raise
+    if snapshot is not None:
+        with _STATE_LOCK:
+            _ensure_list(ctx, "snapshots").append((dst, snapshot, owner))
+
+
+def _stage_tree(
+    manifest: "FileManifest", src: Path, dst: Path, strategy: str, ctx: Dict[str, Any]
+) -> Tuple[int, int, int]:
+    """Rebuild dst from src in a sibling staging dir and swap it in.
+
+    The stage starts as a hardlink/reflink clone of dst, so unchanged files
+    and files not owned by the module carry over without copying data.
+    Returns (copied, unchanged, removed).
+    """
+    stage = _sibling(dst, "staging")
+    try:
+        if dst.is_dir() and not dst.is_symlink():
+            shutil.copytree(dst, stage, symlinks=True, copy_function=_snapshot_copy)
+        else:
+            stage.mkdir(parents=True)
+        copied, unchanged = manifest.sync_tree(src, stage, strategy, key_root=dst)
+        removed = manifest.remove_stale(src, dst, stage=stage)
+        _swap_in(stage, dst, ctx, manifest.module)
+    except BaseException:
+        if os.path.lexists(stage):
+            _remove_path(stage)
+        raise
+    return copied, unchanged, removed
+
+
+def _stage_file(
+    manifest: "FileManifest", src: Path, dst: Path, strategy: str, ctx: Dict[str, Any]
+) -> bool:
+    """Write src next to dst and swap it in unless dst is current. Returns True if written."""
+    if manifest.reuse(src, dst, strategy):
+        return False
+    stage = _sibling(dst, "staging")
+    try:
+        manifest.place(src, stage, strategy, key=dst)
+        _swap_in(stage, dst, ctx, manifest.module)
+    except BaseException:
+        if os.path.lexists(stage):
+            stage.unlink()
+        raise
+    return True
+
+
+def discard_snapshots(ctx: Dict[str, Any]) -> None:
+    """Delete the snapshots kept for rollback once a run is final."""
+    with _STATE_LOCK:
+        snapshots = ctx.pop("snapshots", [])
+    for _dst, snapshot, _owner in snapshots:
+        try:
+            _remove_path(snapshot)
+        except OSError as exc:
+            write_log({"level": "WARNING", "message": f"Failed to remove snapshot {snapshot}: {exc}"}, ctx)
+
+
+def take_snapshots(module: str, ctx: Dict[str, Any]) -> Dict[str, str]:
+    """Take a module's snapshots out of the run, keyed install-relative.
+
+    A partially installed module keeps them in its status record, so they
+    survive discard_snapshots() and uninstalling it can put them back.
+    """
+    install_dir = Path(ctx["install_dir"]).resolve()
+    with _STATE_LOCK:
+        snapshots = ctx.get("snapshots", [])
+        ctx["snapshots"] = [entry for entry in snapshots if entry[2] != module]
+    return {
+        FileManifest._rel(dst, install_dir): FileManifest._rel(snapshot, install_dir)
+        for dst, snapshot, owner in snapshots
+        if owner == module
+    }
+
+
+def restore_module_snapshots(record: Any, install_dir: Path) -> List[str]:
+    """Rename a partial install's snapshots back over targets that are gone.
+
+    A directory target that is still in place (it held files of other
+    owners) gets back only the snapshot files it is missing; other snapshots
+    whose target is still in place are deleted. Returns the restored
+    install-relative paths.
+    """
+    snapshots = record.get("snapshots") if isinstance(record, dict) else None
+    restored = []
+    for rel, snapshot_rel in (snapshots if isinstance(snapshots, dict) else {}).items():
+        dst, snapshot = Path(install_dir) / rel, Path(install_dir) / snapshot_rel
+        if not os.path.lexists(snapshot):
+            continue
+        try:
+            if os.path.lexists(dst):
+                if dst.is_dir() and not dst.is_symlink() and snapshot.is_dir() and not snapshot.is_symlink():
+                    for root, _dirs, files in os.walk(snapshot):
+                        for fname in files:
+                            src = Path(root) / fname
+                            target = dst / src.relative_to(snapshot)
+                            if not os.path.lexists(target):
+                                target.parent.mkdir(parents=True, exist_ok=True)
+                                os.rename(src, target)
+                    restored.append(rel)
+                _remove_path(snapshot)
+                continue
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(snapshot, dst)
+        except OSError:
+            continue
+        restored.append(rel)
+    return restored
+
+
+def drop_module_snapshots(record: Any, install_dir: Path) -> None:
+    """Delete the snapshots a partial install kept once the module is installed."""
+    snapshots = record.get("snapshots") if isinstance(record, dict) else None
+    for snapshot_rel in (snapshots if isinstance(snapshots, dict) else {}).values():
+        snapshot = Path(install_dir) / snapshot_rel
+        if os.path.lexists(snapshot):
+            try:
+                _remove_path(snapshot)
+            except OSError:
+                pass
+
+
+def op_copy_dir(op: Dict[str, Any], ctx: Dict[str, Any], manifest: Optional[FileManifest] = None) -> None:
+    src = _source_path(op, ctx)
+    dst = _target_path(op, ctx)
+    if manifest is None:
+        manifest = FileManifest(ctx)
+
+    existed_before = dst.exists()
+    if existed_before and not ctx.get("force", False):
+        # Only skip if directory exists AND is non-empty (consistent with check_module_installed)
+        if dst.is_dir() and any(dst.iterdir()):
+            manifest.carry(dst)
+            write_log({"level": "INFO", "message": f"Skip existing dir: {dst}"}, ctx)
+            return
+        write_log({"level": "INFO", "message": f"Re-populating empty dir: {dst}"}, ctx)
+
+    if not src.is_dir():
+        raise FileNotFoundError(f"Source dir not found: {src}")
+
+    strategy = _copy_strategy(op, ctx)
+    if existed_before and manifest.tree_current(src, dst, strategy):
+        write_log({"level": "INFO", "message": f"Unchanged dir: {dst}"}, ctx)
+        return
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    copied, unchanged, removed = _stage_tree(manifest, src, dst, strategy, ctx)
+    if not existed_before:
+        _record_created(dst, ctx)
+    write_log(
+        {
+            "level": "INFO",
+            "message": (
+                f"Copied dir {src} -> {dst} "
+                f"({copied} copied, {unchanged} unchanged, {removed} removed)"
+            ),
+        },
+        ctx,
+    )
+
+
+def op_merge_dir(op: Dict[str, Any], ctx: Dict[str, Any], manifest: Optional[FileManifest] = None) -> List[str]:
+    """Merge source dir's subdirs (commands/, agents/, etc.) into install_dir."""
     src = _source_path(op, ctx)
     install_dir = ctx["install_dir"]
     force = ctx.get("force", False)
+    if manifest is None:
+        manifest = FileManifest(ctx)
     merged = []
 
     for subdir in src.iterdir():
@@ -1346,190 +4078,1205 @@ def op_merge_dir(op: Dict[str, Any], ctx: Dict[str, Any]) -> List[str]:
             if f.is_file():
                 dst = target_subdir / f.name
                 if dst.exists() and not force:
+                    manifest.carry(dst)
                     continue
-                shutil.copy2(f, dst)
+                _stage_file(manifest, f, dst, _copy_strategy(op, ctx), ctx)
                 merged.append(f"{subdir.name}/{f.name}")
 
-    write_log({"level": "INFO", "message": f"Merged {src.name}: {', '.join(merged) or 'no files'}"}, ctx)
-    return merged
+    manifest.remove_stale(src, Path(install_dir))
+    write_log({"level": "INFO", "message": f"Merged {src.name}: {', '.join(merged) or 'no files'}"}, ctx)
+    return merged
+
+
+def op_copy_file(op: Dict[str, Any], ctx: Dict[str, Any], manifest: Optional[FileManifest] = None) -> None:
+    src = _source_path(op, ctx)
+    dst = _target_path(op, ctx)
+    if manifest is None:
+        manifest = FileManifest(ctx)
+
+    existed_before = os.path.lexists(dst)
+    if existed_before and not ctx.get("force", False):
+        manifest.carry(dst)
+        write_log({"level": "INFO", "message": f"Skip existing file: {dst}"}, ctx)
+        return
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if _stage_file(manifest, src, dst, _copy_strategy(op, ctx), ctx):
+        write_log({"level": "INFO", "message": f"Copied file {src} -> {dst}"}, ctx)
+    else:
+        write_log({"level": "INFO", "message": f"Unchanged file: {dst}"}, ctx)
+    if not existed_before:
+        _record_created(dst, ctx)
+
+
+def op_merge_json(op: Dict[str, Any], ctx: Dict[str, Any]) -> None:
+    """Merge JSON from source into target, supporting nested key paths."""
+    src = _source_path(op, ctx)
+    dst = _target_path(op, ctx)
+    merge_key = op.get("merge_key")
+
+    if not src.exists():
+        raise FileNotFoundError(f"Source JSON not found: {src}")
+
+    src_data = _load_json(src)
+
+    # Targets may be shared between modules installed in parallel
+    with _STATE_LOCK:
+        # settings.json is owned by the run's settings session; merge into it
+        # so the final flush does not clobber this change.
+        session = None
+        if dst == _no_follow(ctx["install_dir"] / SETTINGS_FILE):
+            session = settings_session(ctx)
+            dst_data = session.data
+        elif dst.exists():
+            dst_data = _load_json(dst)
+        else:
+            dst_data = {}
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if not dst.exists():
+            _record_created(dst, ctx)
+
+        if merge_key:
+            # Merge into specific key
+            keys = merge_key.split(".")
+            target = dst_data
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+
+            last_key = keys[-1]
+            if isinstance(src_data, dict) and isinstance(target.get(last_key), dict):
+                # Deep merge for dicts
+                target[last_key] = {**target.get(last_key, {}), **src_data}
+            else:
+                target[last_key] = src_data
+        else:
+            # Merge at root level
+            if isinstance(src_data, dict) and isinstance(dst_data, dict):
+                dst_data = {**dst_data, **src_data}
+            else:
+                dst_data = src_data
+
+        if session is not None:
+            session.data = dst_data if isinstance(dst_data, dict) else {}
+            session.invalidate_hook_index()
+            session.commit()
+        else:
+            _save_json(dst, dst_data)
+
+    write_log({"level": "INFO", "message": f"Merged JSON {src} -> {dst} (key: {merge_key or 'root'})"}, ctx)
+
+
+# =============================================================================
+# Command Runner
+# =============================================================================
+
+class _OutputTail:
+    """Echo a stream to the terminal and keep only its last max_bytes."""
+
+    def __init__(self, echo: Any, max_bytes: int = COMMAND_TAIL_BYTES):
+        self.echo = echo
+        self.max_bytes = max_bytes
+        self.total = 0
+        self._tail = bytearray()
+        self._pending = bytearray()
+
+    def feed(self, chunk: bytes) -> None:
+        self.total += len(chunk)
+        self._tail += chunk
+        if len(self._tail) > self.max_bytes:
+            del self._tail[: len(self._tail) - self.max_bytes]
+        # Echo whole lines so concurrent commands do not interleave mid-line
+        self._pending += chunk
+        cut = self._pending.rfind(b"\n")
+        if cut >= 0:
+            self._write(self._pending[: cut + 1])
+            del self._pending[: cut + 1]
+        elif len(self._pending) >= COMMAND_READ_CHUNK:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            self._write(self._pending)
+            self._pending.clear()
+
+    def _write(self, data: bytes) -> None:
+        self.echo.write(data.decode("utf-8", errors="replace"))
+        self.echo.flush()
+
+    def text(self) -> str:
+        tail = self._tail.decode("utf-8", errors="replace")
+        dropped = self.total - len(self._tail)
+        return f"[... {dropped} bytes omitted]\n{tail}" if dropped > 0 else tail
+
+
+async def _pump(reader: Any, tail: _OutputTail, spool: Any) -> None:
+    while True:
+        chunk = await reader.read(COMMAND_READ_CHUNK)
+        if not chunk:
+            return
+        tail.feed(chunk)
+        spool.write(chunk)
+
+
+def _kill_process_tree(process: Any) -> None:
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _run_command_async(
+    command: str, ctx: Dict[str, Any], env: Dict[str, str], timeout: Optional[float]
+) -> Dict[str, Any]:
+    """Run one shell command, streaming output live.
+
+    Memory holds only the last COMMAND_TAIL_BYTES of each stream; the full
+    interleaved output goes to a spool file next to the install log, kept
+    when a stream overflowed its tail.
+    """
+    spool_path = _logger(ctx).spool_path("cmd")
+    process = await asyncio.create_subprocess_shell(
+        command,
+        cwd=ctx["config_dir"],
+        env=env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        # Own process group, so a timeout also kills the shell's children
+        start_new_session=os.name == "posix",
+    )
+    stdout = _OutputTail(sys.stdout)
+    stderr = _OutputTail(sys.stderr)
+    timed_out = False
+    with spool_path.open("wb") as spool:
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    _pump(process.stdout, stdout, spool),
+                    _pump(process.stderr, stderr, spool),
+                    process.wait(),
+                ),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            timed_out = True
+            _kill_process_tree(process)
+            await process.wait()
+    stdout.flush()
+    stderr.flush()
+
+    # The tails already hold everything; keep the spool only when they do not
+    if stdout.total <= stdout.max_bytes and stderr.total <= stderr.max_bytes:
+        spool_path.unlink(missing_ok=True)
+        spool_path = None
+    return {
+        "returncode": process.returncode,
+        "stdout": stdout.text(),
+        "stderr": stderr.text(),
+        "output_file": str(spool_path) if spool_path else None,
+        "timed_out": timed_out,
+    }
+
+
+async def _op_run_command_async(op: Dict[str, Any], ctx: Dict[str, Any]) -> None:
+    env = os.environ.copy()
+    for key, value in op.get("env", {}).items():
+        env[key] = value.replace("${install_dir}", str(ctx["install_dir"]))
+
+    raw_command = str(op.get("command", "")).strip()
+    if raw_command == "bash install.sh" and ctx.get("_wrapper_installed"):
+        write_log({"level": "INFO", "message": "Skip wrapper install; already installed in this run"}, ctx)
+        return
+
+    command = raw_command
+    if sys.platform == "win32" and raw_command == "bash install.sh":
+        command = "cmd /c install.bat"
+
+    timeout = op.get("timeout")
+    outcome = await _run_command_async(command, ctx, env, float(timeout) if timeout else None)
+    write_log(
+        {
+            "level": "INFO",
+            "message": f"Command: {command}",
+            "stdout": outcome["stdout"],
+            "stderr": outcome["stderr"],
+            "output_file": outcome["output_file"],
+            "returncode": outcome["returncode"],
+        },
+        ctx,
+    )
+
+    if outcome["timed_out"]:
+        raise RuntimeError(f"Command timed out after {timeout}s: {command}")
+    if outcome["returncode"] != 0:
+        raise RuntimeError(f"Command failed with code {outcome['returncode']}: {command}")
+
+    if raw_command == "bash install.sh":
+        ctx["_wrapper_installed"] = True
+
+
+def run_commands(
+    ops: List[Dict[str, Any]],
+    ctx: Dict[str, Any],
+    spans: Optional[List[Tuple[float, float]]] = None,
+) -> List[Optional[BaseException]]:
+    """Run run_command ops concurrently. Returns each op's exception or None.
+
+    If spans is given, it receives each op's (start, end) perf_counter pair.
+    """
+    timings: List[Tuple[float, float]] = [(0.0, 0.0)] * len(ops)
+
+    async def timed(idx: int, op: Dict[str, Any]) -> None:
+        start = time.perf_counter()
+        try:
+            await _op_run_command_async(op, ctx)
+        finally:
+            timings[idx] = (start, time.perf_counter())
+
+    async def run_all() -> List[Any]:
+        return await asyncio.gather(*(timed(i, op) for i, op in enumerate(ops)), return_exceptions=True)
+
+    outcomes = asyncio.run(run_all())
+    if spans is not None:
+        spans[:] = timings
+    return [exc if isinstance(exc, BaseException) else None for exc in outcomes]
+
+
+def op_run_command(op: Dict[str, Any], ctx: Dict[str, Any]) -> None:
+    asyncio.run(_op_run_command_async(op, ctx))
+
+
+# =============================================================================
+# Wrapper Cache
+# =============================================================================
+
+def _wrapper_release() -> str:
+    """Release install.sh downloads: CODEAGENT_WRAPPER_VERSION, VERSION, or "latest"."""
+    return os.environ.get("CODEAGENT_WRAPPER_VERSION") or os.environ.get("VERSION") or "latest"
+
+
+def _wrapper_version(binary: Path) -> Optional[str]:
+    try:
+        result = subprocess.run([str(binary), "--version"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+# Per process: cache keys by config dir, and binaries installed by key, so a
+# multi-target run hashes install.sh and runs it once.
+_WRAPPER_KEYS: Dict[str, str] = {}
+_WRAPPER_BUILDS: Dict[str, Path] = {}
+
+
+def wrapper_cache_key(ctx: Dict[str, Any]) -> str:
+    """Key for the wrapper binary this checkout would install.
+
+    install.sh downloads a prebuilt release, so the key covers the platform,
+    the installer script and the release it is asked to fetch.
+    """
+    config_dir = Path(ctx["config_dir"])
+    if str(config_dir) in _WRAPPER_KEYS:
+        return _WRAPPER_KEYS[str(config_dir)]
+    installer = config_dir / "install.sh"
+    parts = [
+        f"{sys.platform}-{platform.machine()}",
+        _file_sha256(installer) if installer.is_file() else "no-installer",
+        _wrapper_release(),
+    ]
+    key = _WRAPPER_KEYS[str(config_dir)] = hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+    return key
+
+
+def _wrapper_cache_hit(binary: Path, record_path: Path, key: str, ctx: Dict[str, Any]) -> bool:
+    """True if the installed binary is exactly what the cache record describes.
+
+    "latest" names a different release over time, so its record expires after
+    WRAPPER_LATEST_TTL; install.sh then compares the installed version with
+    the newest release. --refresh-wrapper never trusts the record.
+    """
+    if ctx.get("refresh_wrapper"):
+        return False
+    try:
+        record = _load_json(record_path)
+    except (OSError, ValueError):
+        return False
+    if not isinstance(record, dict) or record.get("key") != key:
+        return False
+    if _wrapper_release() == "latest":
+        try:
+            age = (datetime.now() - datetime.fromisoformat(str(record.get("cached_at")))).total_seconds()
+        except ValueError:
+            return False
+        if not 0 <= age < WRAPPER_LATEST_TTL:
+            return False
+    if not binary.is_file() or _file_sha256(binary) != record.get("sha256"):
+        return False
+    return _wrapper_version(binary) == record.get("version")
+
+
+def ensure_wrapper_installed(ctx: Dict[str, Any]) -> None:
+    """Install codeagent-wrapper via install.sh unless the cached build still matches.
+
+    A failed install.sh is remembered for the run: every other module that
+    needs the wrapper gets the same error instead of running it again.
+    """
+    with _WRAPPER_LOCK:
+        if ctx.get("_wrapper_installed"):
+            return
+        if ctx.get("_wrapper_error") is not None:
+            raise ctx["_wrapper_error"]
+
+        binary = Path(ctx["install_dir"]) / "bin" / "codeagent-wrapper"
+        record_path = binary.with_name(WRAPPER_CACHE_FILE)
+        key = wrapper_cache_key(ctx)
+        if _wrapper_cache_hit(binary, record_path, key, ctx):
+            ctx["_wrapper_installed"] = True
+            write_log({"level": "INFO", "message": f"Wrapper cache hit ({key[:12]}); skip install.sh"}, ctx)
+            return
+
+        built = _WRAPPER_BUILDS.get(key)
+        if built is not None and built != binary and built.is_file():
+            # Installed for another target in this run: copy instead of rebuilding
+            binary.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(built, binary)
+            built_record = built.with_name(WRAPPER_CACHE_FILE)
+            if built_record.is_file():
+                shutil.copy2(built_record, record_path)
+            ctx["_wrapper_installed"] = True
+            write_log({"level": "INFO", "message": f"Copied wrapper from {built}"}, ctx)
+            return
+
+        try:
+            op_run_command(
+                {
+                    "type": "run_command",
+                    "command": "bash install.sh",
+                    "env": {"INSTALL_DIR": "${install_dir}"},
+                },
+                ctx,
+            )
+        except Exception as exc:
+            ctx["_wrapper_error"] = exc
+            raise
+
+        version = _wrapper_version(binary) if binary.is_file() else None
+        if version is None:
+            record_path.unlink(missing_ok=True)
+            return
+        _WRAPPER_BUILDS[key] = binary
+        record = {
+            "key": key,
+            "sha256": _file_sha256(binary),
+            "version": version,
+            "cached_at": datetime.now().isoformat(),
+        }
+        _write_text_atomic(record_path, _dump_json(record))
+
+
+# =============================================================================
+# Bundles
+# =============================================================================
+
+def _rel_files(root: Path, config_dir: Path, recursive: bool = True) -> List[str]:
+    """Config-relative posix paths of the files an op reads under root."""
+    if root.is_file():
+        return [root.relative_to(config_dir).as_posix()]
+    if not root.is_dir():
+        return []
+    if recursive:
+        paths = (
+            Path(dirpath) / fname
+            for dirpath, _dirs, files in os.walk(root, followlinks=True)
+            for fname in files
+        )
+    else:
+        # merge_dir only reads files directly inside each subdir
+        paths = (f for sub in root.iterdir() if sub.is_dir() for f in sub.iterdir() if f.is_file())
+    return sorted(p.relative_to(config_dir).as_posix() for p in paths)
+
+
+def module_source_files(name: str, cfg: Dict[str, Any], config_dir: Path) -> Dict[str, List[str]]:
+    """Files and directories under config_dir that installing a module reads."""
+    files: List[str] = []
+    dirs: List[str] = []
+    for op in cfg.get("operations", []):
+        op_type = op.get("type")
+        if op_type in ("copy_dir", "merge_dir", "copy_file", "merge_json"):
+            src = config_dir / Path(str(op["source"]).replace("\\", "/"))
+            if src.is_dir():
+                dirs.append(src.relative_to(config_dir).as_posix())
+            files.extend(_rel_files(src, config_dir, recursive=op_type != "merge_dir"))
+        elif op_type == "run_command":
+            # Best effort: ship files the command names, e.g. "python3 scripts/x.py"
+            try:
+                tokens = shlex.split(str(op.get("command", "")))
+            except ValueError:
+                tokens = []
+            for token in tokens:
+                candidate = config_dir / token
+                if token and not Path(token).is_absolute() and candidate.exists():
+                    files.extend(_rel_files(candidate, config_dir))
+    if name in WRAPPER_REQUIRED_MODULES:
+        files.extend(f for f in BUNDLE_WRAPPER_FILES if (config_dir / f).is_file())
+    return {"files": sorted(set(files)), "dirs": sorted(set(dirs))}
+
+
+def _bundle_mode(path: Path, write: bool) -> str:
+    name = path.name.lower()
+    if name.endswith(".zip"):
+        return "zip"
+    for suffix, compression in ((".tar.gz", "gz"), (".tgz", "gz"), (".tar.xz", "xz"), (".tar.bz2", "bz2")):
+        if name.endswith(suffix):
+            return f"{'w' if write else 'r'}|{compression}"
+    return "w|" if write else "r|*"
+
+
+def pack_bundle(config: Dict[str, Any], modules: Dict[str, Any], config_dir: Path, out: Path) -> Dict[str, Any]:
+    """Write modules' source files and a manifest to a tar or zip bundle.
+
+    bundle.json is the first member, so --from-bundle can read it and then
+    extract only what the selected modules need in one sequential pass.
+    """
+    module_files = {name: module_source_files(name, cfg, config_dir) for name, cfg in modules.items()}
+    common = [f for f in BUNDLE_COMMON_FILES if (config_dir / f).is_file()]
+    all_files = sorted({f for entry in module_files.values() for f in entry["files"]} | set(common))
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "created_at": datetime.now().isoformat(),
+        "config": {**config, "modules": dict(modules)},
+        "modules": module_files,
+        "common": common,
+        "files": {
+            rel: {"sha256": _file_sha256(config_dir / rel), "size": (config_dir / rel).stat().st_size}
+            for rel in all_files
+        },
+    }
+    manifest_raw = _dump_json(manifest).encode("utf-8")
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    mode = _bundle_mode(out, write=True)
+    tmp = _sibling(out, "tmp")
+    try:
+        if mode == "zip":
+            with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr(BUNDLE_MANIFEST, manifest_raw)
+                for rel in all_files:
+                    zf.write(config_dir / rel, f"{BUNDLE_PREFIX}{rel}")
+        else:
+            with tarfile.open(str(tmp), mode) as tar:
+                info = tarfile.TarInfo(BUNDLE_MANIFEST)
+                info.size = len(manifest_raw)
+                info.mtime = int(datetime.now().timestamp())
+                tar.addfile(info, io.BytesIO(manifest_raw))
+                for rel in all_files:
+                    info = tar.gettarinfo(config_dir / rel, f"{BUNDLE_PREFIX}{rel}")
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ""
+                    with (config_dir / rel).open("rb") as fh:
+                        tar.addfile(info, fh)
+        os.replace(tmp, out)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return manifest
+
+
+class BundleReader:
+    """A bundle opened for one sequential read.
+
+    The manifest is read on open; extract() then continues through the same
+    stream, writing only requested members and verifying each sha256 as it
+    is written.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.mode = _bundle_mode(self.path, write=False)
+        if self.mode == "zip":
+            self._zip = zipfile.ZipFile(self.path)
+            raw = self._zip.read(BUNDLE_MANIFEST)
+        else:
+            self._tar = tarfile.open(str(self.path), self.mode)
+            first = self._tar.next()
+            if first is None or first.name != BUNDLE_MANIFEST:
+                raise ValueError(f"{self.path} is not an install bundle (no leading {BUNDLE_MANIFEST})")
+            raw = self._tar.extractfile(first).read()  # type: ignore[union-attr]
+        self.manifest = json.loads(raw.decode("utf-8"))
+        if self.manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported bundle format: {self.manifest.get('format')}")
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return self.manifest["config"]
+
+    def wanted(self, module_names: Iterable[str]) -> Tuple[set, set]:
+        module_names = list(module_names)
+        files = set(self.manifest.get("common", [])) if module_names else set()
+        dirs: set = set()
+        for name in module_names:
+            entry = self.manifest.get("modules", {}).get(name, {})
+            files.update(entry.get("files", []))
+            dirs.update(entry.get("dirs", []))
+        return files, dirs
+
+    def _write_member(self, rel: str, fh: Any, dest: Path, mtime: Optional[float]) -> None:
+        rel_path = Path(rel)
+        if rel_path.is_absolute() or ".." in rel_path.parts:
+            raise ValueError(f"Unsafe path in bundle: {rel}")
+        expected = self.manifest["files"].get(rel, {}).get("sha256")
+        target = dest / rel_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        with target.open("wb") as out:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                digest.update(chunk)
+                out.write(chunk)
+        if digest.hexdigest() != expected:
+            raise ValueError(f"Bundle member {rel} failed sha256 verification")
+        if mtime is not None:
+            os.utime(target, (mtime, mtime))
+
+    def extract(self, module_names: Iterable[str], dest: Path) -> int:
+        """Extract the members the modules need into dest. Returns the file count."""
+        files, dirs = self.wanted(module_names)
+        for rel in dirs:
+            (dest / rel).mkdir(parents=True, exist_ok=True)
+        remaining = set(files)
+        if self.mode == "zip":
+            for rel in sorted(files):
+                info = self._zip.getinfo(f"{BUNDLE_PREFIX}{rel}")
+                with self._zip.open(info) as fh:
+                    mtime = datetime(*info.date_time).timestamp()
+                    self._write_member(rel, fh, dest, mtime)
+                remaining.discard(rel)
+        else:
+            for member in self._tar:
+                if not remaining:
+                    break
+                rel = member.name[len(BUNDLE_PREFIX):] if member.name.startswith(BUNDLE_PREFIX) else None
+                if rel not in remaining or not member.isfile():
+                    continue
+                self._write_member(rel, self._tar.extractfile(member), dest, member.mtime)
+                remaining.discard(rel)
+        if remaining:
+            raise ValueError(f"Bundle is missing {len(remaining)} file(s), e.g. {sorted(remaining)[0]}")
+        return len(files)
+
+    def close(self) -> None:
+        if self.mode == "zip":
+            self._zip.close()
+        else:
+            self._tar.close()
+
+
+def _bundle_module_names(args: argparse.Namespace, config: Dict[str, Any], ctx: Dict[str, Any]) -> List[str]:
+    """Modules whose sources a bundle run needs on disk."""
+    if getattr(args, "list_modules", False) or getattr(args, "status", False):
+        return []
+    if args.module:
+        selected = select_modules(config, args.module)
+        if getattr(args, "uninstall", False):
+            return list(selected)
+        return list(add_required_modules_for_install(selected, config)[0])
+    if getattr(args, "update", False) or getattr(args, "verify", None) is not None:
+        return [name for name, ok in get_installed_modules(config, ctx).items() if ok]
+    return list(config.get("modules", {}))
+
 
+# =============================================================================
+# Verification
+# =============================================================================
 
-def op_copy_file(op: Dict[str, Any], ctx: Dict[str, Any]) -> None:
-    src = _source_path(op, ctx)
-    dst = _target_path(op, ctx)
+def _file_routes(modules: Dict[str, Any], ctx: Dict[str, Any]) -> List[Tuple[str, str, Path, Path, str]]:
+    """(module, op type, source, target, strategy) for each file operation.
 
-    existed_before = dst.exists()
-    if existed_before and not ctx.get("force", False):
-        write_log({"level": "INFO", "message": f"Skip existing file: {dst}"}, ctx)
+    merge_dir targets are the install dir itself.
+    """
+    routes = []
+    for name, cfg in modules.items():
+        for op in cfg.get("operations", []):
+            op_type = op.get("type")
+            if op_type not in ("copy_dir", "copy_file", "merge_dir"):
+                continue
+            target = Path(ctx["install_dir"]) if op_type == "merge_dir" else _target_path(op, ctx)
+            routes.append((name, op_type, _source_path(op, ctx), target, _copy_strategy(op, ctx)))
+    return routes
+
+
+def _expected_files(route: Tuple[str, str, Path, Path, str]) -> Iterator[Tuple[Path, Path]]:
+    """(source, target) pairs a file operation installs."""
+    _name, op_type, src, dst, _strategy = route
+    if op_type == "copy_file":
+        yield src, dst
+    elif op_type == "merge_dir":
+        for subdir in sorted(p for p in src.iterdir() if p.is_dir()):
+            for f in sorted(subdir.iterdir()):
+                if f.is_file():
+                    yield f, dst / subdir.name / f.name
+    else:
+        for root, _dirs, files in os.walk(src, followlinks=True):
+            target_root = dst / os.path.relpath(root, src)
+            for fname in files:
+                yield Path(root) / fname, target_root / fname
+
+
+def _verify_file(src: Path, dst: Path, entry: Any) -> Tuple[str, bool]:
+    """Compare one installed file with its source. Returns (state, hashed).
+
+    state is "ok", "missing" or "modified". Content is hashed only when
+    sizes match but mtimes differ; the target's hash comes from its
+    manifest entry while the target's stat still matches it.
+    """
+    entry = entry if isinstance(entry, dict) else {}
+    try:
+        if entry.get("link") == "symlink":
+            return ("ok" if os.readlink(dst) == str(src) else "modified"), False
+        if entry.get("link") == "hardlink":
+            return ("ok" if os.path.samefile(src, dst) else "modified"), False
+        dst_st = os.stat(dst)
+        src_st = os.stat(src)
+    except FileNotFoundError:
+        return "missing", False
+    except OSError:
+        return "modified", False
+    if dst_st.st_size != src_st.st_size:
+        return "modified", False
+    if dst_st.st_mtime_ns == src_st.st_mtime_ns:
+        return "ok", False
+    if dst_st.st_size == entry.get("size") and dst_st.st_mtime_ns == entry.get("mtime_ns"):
+        dst_sha = entry.get("sha256")
+    else:
+        dst_sha = _file_sha256(dst)
+    return ("ok" if _source_sha256(src) == dst_sha else "modified"), True
+
+
+def _verify_integrations(name: str, cfg: Dict[str, Any], ctx: Dict[str, Any], report: Dict[str, Any]) -> None:
+    """Record hook entries missing from settings.json and agents missing from models.json."""
+    index = settings_session(ctx)._index()
+    for hooks_config, plugin_root in find_module_hooks(name, cfg, ctx):
+        module_hooks = hooks_config.get("hooks", {})
+        if plugin_root:
+            module_hooks = _replace_hook_variables(module_hooks, plugin_root)
+        for hook_type, entries in module_hooks.items():
+            for entry in entries:
+                key = (name, _hook_key(entry))
+                if key not in index.get(hook_type, ()) and hook_type not in report["hooks_missing"]:
+                    report["hooks_missing"].append(hook_type)
+
+    agents = cfg.get("agents", {})
+    if not agents:
         return
+    merged = models_session(ctx).agents if models_path().exists() else {}
+    for agent_name, agent_cfg in agents.items():
+        current = merged.get(agent_name)
+        if not isinstance(current, dict):
+            report["agents_missing"].append(agent_name)
+        elif current.get("__module__") == name and any(
+            current.get(k) != v for k, v in agent_cfg.items()
+        ):
+            report["agents_changed"].append(agent_name)
 
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    shutil.copy2(src, dst)
-    if not existed_before:
-        _record_created(dst, ctx)
-    write_log({"level": "INFO", "message": f"Copied file {src} -> {dst}"}, ctx)
 
+def verify_modules(modules: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Compare installed modules with their sources; returns a JSON-able report.
 
-def op_merge_json(op: Dict[str, Any], ctx: Dict[str, Any]) -> None:
-    """Merge JSON from source into target, supporting nested key paths."""
-    src = _source_path(op, ctx)
-    dst = _target_path(op, ctx)
-    merge_key = op.get("merge_key")
+    Files are checked on a thread pool with a size/mtime short-circuit, so
+    an unchanged install costs a few stats per file and no hashing.
+    """
+    started = time.perf_counter()
+    installed = cached_installed_status(ctx).get("modules", {})
+    install_dir = Path(ctx["install_dir"])
+    reports: Dict[str, Dict[str, Any]] = {
+        name: {key: [] for key in VERIFY_REPORT_KEYS} for name in modules
+    }
+    checks: List[Tuple[str, str, Path, Path, Any]] = []
+    for route in _file_routes(modules, ctx):
+        name, op_type, src, dst, _strategy = route
+        report = reports[name]
+        if not (src.is_file() if op_type == "copy_file" else src.is_dir()):
+            report["errors"].append(f"source missing: {src}")
+            continue
+        record = installed.get(name) if isinstance(installed.get(name), dict) else {}
+        files = record.get("files") if isinstance(record.get("files"), dict) else {}
+        expected = set()
+        for src_file, dst_file in _expected_files(route):
+            rel = FileManifest._rel(dst_file, install_dir)
+            expected.add(rel)
+            checks.append((name, rel, src_file, dst_file, files.get(rel)))
+        if op_type == "copy_dir" and dst.is_dir():
+            for root, _dirs, names in os.walk(dst):
+                for fname in names:
+                    rel = FileManifest._rel(Path(root) / fname, install_dir)
+                    if rel not in expected:
+                        report["extra"].append(rel)
+
+    hashed = 0
+    with _ContextPool(max_workers=ctx["jobs"]) as pool:
+        results = pool.map(lambda check: _verify_file(*check[2:]), checks)
+        for (name, rel, _src, _dst, _entry), (state, did_hash) in zip(checks, results):
+            hashed += did_hash
+            if state != "ok":
+                reports[name][state].append(rel)
 
-    if not src.exists():
-        raise FileNotFoundError(f"Source JSON not found: {src}")
+    for name, cfg in modules.items():
+        _verify_integrations(name, cfg, ctx, reports[name])
+        reports[name]["ok"] = not any(reports[name].values())
 
-    src_data = _load_json(src)
+    return {
+        "install_dir": str(ctx["install_dir"]),
+        "ok": all(report["ok"] for report in reports.values()),
+        "files_checked": len(checks),
+        "files_hashed": hashed,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "modules": reports,
+    }
 
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    if dst.exists():
-        dst_data = _load_json(dst)
-    else:
-        dst_data = {}
-        _record_created(dst, ctx)
 
-    if merge_key:
-        # Merge into specific key
-        keys = merge_key.split(".")
-        target = dst_data
-        for key in keys[:-1]:
-            target = target.setdefault(key, {})
-
-        last_key = keys[-1]
-        if isinstance(src_data, dict) and isinstance(target.get(last_key), dict):
-            # Deep merge for dicts
-            target[last_key] = {**target.get(last_key, {}), **src_data}
-        else:
-            target[last_key] = src_data
+def print_verify_report(report: Dict[str, Any]) -> None:
+    for name, module in report["modules"].items():
+        if module["ok"]:
+            print(f"  [OK] {name}")
+            continue
+        problems = [
+            f"{len(module[key])} {label}"
+            for key, label in (("missing", "missing"), ("modified", "modified"), ("extra", "extra"))
+            if module[key]
+        ]
+        if module["hooks_missing"]:
+            problems.append(f"hooks not merged ({', '.join(module['hooks_missing'])})")
+        if module["agents_missing"]:
+            problems.append(f"agents missing ({', '.join(module['agents_missing'])})")
+        if module["agents_changed"]:
+            problems.append(f"agents changed ({', '.join(module['agents_changed'])})")
+        problems.extend(module["errors"])
+        print(f"  [!] {name}: {'; '.join(problems)}")
+        for key in ("missing", "modified", "extra"):
+            for rel in module[key]:
+                print(f"      {key}: {rel}")
+    summary = f"{report['files_checked']} files, {report['files_hashed']} hashed, {report['elapsed_ms']:.0f} ms"
+    if report["ok"]:
+        print(f"\n[+] No drift ({summary})")
     else:
-        # Merge at root level
-        if isinstance(src_data, dict) and isinstance(dst_data, dict):
-            dst_data = {**dst_data, **src_data}
-        else:
-            dst_data = src_data
+        drifted = sum(1 for module in report["modules"].values() if not module["ok"])
+        print(f"\n[!] Drift in {drifted} module(s) ({summary})")
 
-    with dst.open("w", encoding="utf-8") as fh:
-        json.dump(dst_data, fh, indent=2, ensure_ascii=False)
-        fh.write("\n")
 
-    write_log({"level": "INFO", "message": f"Merged JSON {src} -> {dst} (key: {merge_key or 'root'})"}, ctx)
+# =============================================================================
+# Watch Mode
+# =============================================================================
 
+# inotify(7) flags
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_WATCH_MASK = (
+    _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF
+)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class _InotifyWatcher:
+    """Recursive inotify watch over source trees (Linux only)."""
+
+    def __init__(self, trees: Iterable[Path], dirs: Iterable[Path]):
+        import ctypes
+
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._ctypes = ctypes
+        # wd -> (directory, recursive)
+        self._watches: Dict[int, Tuple[Path, bool]] = {}
+        self.trees = list(trees)
+        for tree in self.trees:
+            self._add_tree(tree)
+        for directory in dirs:
+            self._add(directory, False)
+
+    def _add(self, directory: Path, recursive: bool) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_WATCH_MASK)
+        if wd < 0:
+            err = self._ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            return
+        self._watches[wd] = (directory, recursive)
+
+    def _add_tree(self, root: Path) -> None:
+        for current, _dirs, _files in os.walk(root, followlinks=True):
+            self._add(Path(current), True)
+
+    def changes(self, timeout: Optional[float]) -> set:
+        """Block up to timeout seconds; return the paths that changed."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed: set = set()
+        while True:
+            try:
+                data = os.read(self._fd, COMMAND_READ_CHUNK)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    # Events were dropped: report every tree for a full resync
+                    changed.update(self.trees)
+                    continue
+                watch = self._watches.get(wd)
+                if watch is None:
+                    continue
+                directory, recursive = watch
+                if mask & _IN_DELETE_SELF:
+                    self._watches.pop(wd, None)
+                    changed.add(directory)
+                    continue
+                path = directory / os.fsdecode(name)
+                if recursive and mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._add_tree(path)
+                changed.add(path)
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class _PollWatcher:
+    """mtime/size polling fallback with the same interface as _InotifyWatcher."""
+
+    def __init__(self, trees: Iterable[Path], files: Iterable[Path]):
+        self.trees = list(trees)
+        self.files = list(files)
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[Path, Tuple[int, int, int]]:
+        snapshot = {}
+        paths: List[Path] = list(self.files)
+        for tree in self.trees:
+            for root, _dirs, files in os.walk(tree, followlinks=True):
+                paths.extend(Path(root) / name for name in files)
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return snapshot
+
+    def changes(self, timeout: Optional[float]) -> set:
+        deadline = time.monotonic() + (timeout if timeout is not None else float("inf"))
+        while True:
+            time.sleep(max(0.0, min(WATCH_POLL_INTERVAL, deadline - time.monotonic())))
+            snapshot = self._scan()
+            changed = {
+                path
+                for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+            if changed or time.monotonic() >= deadline:
+                return changed
 
-def op_run_command(op: Dict[str, Any], ctx: Dict[str, Any]) -> None:
-    env = os.environ.copy()
-    for key, value in op.get("env", {}).items():
-        env[key] = value.replace("${install_dir}", str(ctx["install_dir"]))
+    def close(self) -> None:
+        pass
 
-    raw_command = str(op.get("command", "")).strip()
-    if raw_command == "bash install.sh" and ctx.get("_wrapper_installed"):
-        write_log({"level": "INFO", "message": "Skip wrapper install; already installed in this run"}, ctx)
-        return
 
-    command = raw_command
-    if sys.platform == "win32" and raw_command == "bash install.sh":
-        command = "cmd /c install.bat"
+def _open_watcher(trees: List[Path], files: List[Path], ctx: Dict[str, Any]) -> Any:
+    if sys.platform.startswith("linux"):
+        try:
+            return _InotifyWatcher(trees, sorted({path.parent for path in files}))
+        except (OSError, AttributeError) as exc:
+            write_log({"level": "WARNING", "message": f"inotify unavailable, polling instead: {exc}"}, ctx)
+    return _PollWatcher(trees, files)
+
+
+def _mirror_path(
+    path: Path,
+    route: Tuple[str, str, Path, Path, str],
+    manifest: FileManifest,
+) -> int:
+    """Bring the target of one changed source path up to date. Returns files removed."""
+    _name, op_type, src, dst, strategy = route
+    rel = path.relative_to(src) if path != src else Path()
+    target = dst / rel
+    if op_type == "merge_dir":
+        # merge_dir only places <source>/<subdir>/<file>
+        if len(rel.parts) > 2 or (len(rel.parts) == 2 and path.is_dir()):
+            return 0
+        if path.is_dir():
+            subdirs = [path] if rel.parts else [p for p in path.iterdir() if p.is_dir()]
+            for subdir in subdirs:
+                for f in subdir.iterdir():
+                    if f.is_file():
+                        manifest.sync_file(f, dst / subdir.name / f.name, strategy)
+        elif path.is_file() and len(rel.parts) == 2:
+            manifest.sync_file(path, target, strategy)
+            return 0
+    elif path.is_file():
+        manifest.sync_file(path, target, strategy)
+        return 0
+    elif path.is_dir():
+        manifest.sync_tree(path, target, strategy)
+    return manifest.remove_stale(path, target.parent if op_type == "copy_file" else dst)
 
-    # Stream output in real-time while capturing for logging
-    process = subprocess.Popen(
-        command,
-        shell=True,
-        cwd=ctx["config_dir"],
-        env=env,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
 
-    stdout_lines: List[str] = []
-    stderr_lines: List[str] = []
+def watch_modules(
+    config: Dict[str, Any], modules: Dict[str, Any], ctx: Dict[str, Any], config_path: Path
+) -> int:
+    """Mirror source edits of installed modules into the install dir until interrupted.
+
+    Only files under changed paths are synced, through each module's
+    FileManifest, and the manifests in installed_modules.json are kept
+    current. Hooks are re-merged when a hooks.json changes and agents when
+    the module's "agents" block in the config changes.
+    """
+    routes = _file_routes(modules, ctx)
+    trees = [src for _n, op_type, src, _d, _s in routes if op_type != "copy_file" and src.is_dir()]
+    files = [src for _n, op_type, src, _d, _s in routes if op_type == "copy_file"] + [config_path]
+    watcher = _open_watcher(trees, files, ctx)
+    kind = "inotify" if isinstance(watcher, _InotifyWatcher) else f"polling every {WATCH_POLL_INTERVAL}s"
+    print(f"Watching {len(trees) + len(files)} source path(s) of {len(modules)} module(s) ({kind}); Ctrl-C to stop")
+
+    try:
+        while True:
+            changed = watcher.changes(None)
+            # Editors save in bursts (write, rename, chmod): wait until quiet
+            while True:
+                more = watcher.changes(WATCH_DEBOUNCE)
+                if not more:
+                    break
+                changed |= more
+            started = time.perf_counter()
+            summary = _sync_changes(changed, config, modules, routes, ctx, config_path)
+            if summary:
+                elapsed = (time.perf_counter() - started) * 1000
+                print(f"[watch] {'; '.join(summary)} ({elapsed:.0f} ms)")
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+        return 0
+    finally:
+        watcher.close()
+
 
-    # Read stdout and stderr in real-time
-    if sys.platform == "win32":
-        # On Windows, use threads instead of selectors (pipes aren't selectable)
-        import threading
+def _sync_changes(
+    changed: set,
+    config: Dict[str, Any],
+    modules: Dict[str, Any],
+    routes: List[Tuple[str, str, Path, Path, str]],
+    ctx: Dict[str, Any],
+    config_path: Path,
+) -> List[str]:
+    """Apply one batch of source changes. Returns per-module summaries."""
+    status = load_installed_status(ctx)
+    records = status.setdefault("modules", {})
+    manifests: Dict[str, FileManifest] = {}
+    removed: Dict[str, int] = {}
+    hooks_changed: set = set()
+    agents_changed: set = set()
+
+    # A changed directory is synced as a whole; skip paths inside it
+    for path in sorted(p for p in changed if not any(a in changed for a in p.parents)):
+        for route in routes:
+            name, op_type, src, _dst, _strategy = route
+            if path != src and src not in path.parents:
+                continue
+            if op_type == "copy_file" and path != src:
+                continue
+            if name not in manifests:
+                record = records.get(name) if isinstance(records.get(name), dict) else {}
+                manifests[name] = FileManifest(ctx, record.get("files"), name)
+            try:
+                removed[name] = removed.get(name, 0) + _mirror_path(path, route, manifests[name])
+            except OSError as exc:
+                write_log({"level": "WARNING", "message": f"Watch sync failed for {path}: {exc}"}, ctx)
+            if path.name == "hooks.json" and op_type == "copy_dir":
+                hooks_changed.add(name)
 
-        def read_output(pipe, lines, file=None):
-            for line in iter(pipe.readline, ''):
-                lines.append(line)
-                print(line, end="", flush=True, file=file)
-            pipe.close()
+    if config_path in changed:
+        try:
+            fresh = load_config(str(config_path), str(ctx["install_dir"]))
+        except Exception as exc:  # noqa: BLE001
+            print(f"[watch] {config_path.name} not reloaded: {exc}", file=sys.stderr)
+        else:
+            for name, cfg in modules.items():
+                new_cfg = fresh.get("modules", {}).get(name)
+                if isinstance(new_cfg, dict) and new_cfg.get("agents", {}) != cfg.get("agents", {}):
+                    cfg["agents"] = new_cfg.get("agents", {})
+                    agents_changed.add(name)
+
+    summary = []
+    for name, manifest in manifests.items():
+        record = records.setdefault(name, {"module": name, "status": "success", "operations": []})
+        previous = manifest.previous
+        files = {
+            rel: entry
+            for rel, entry in previous.items()
+            if isinstance(entry, dict) and (manifest.config_dir / str(entry.get("src", ""))).exists()
+        }
+        files.update(manifest.files)
+        record["files"] = files
+        if manifest.files_copied or removed.get(name):
+            summary.append(f"{name}: {manifest.files_copied} copied, {removed.get(name, 0)} removed")
+
+    for name in sorted(hooks_changed):
+        unmerge_hooks_from_settings(name, ctx)
+        for hooks_config, plugin_root in find_module_hooks(name, modules[name], ctx):
+            merge_hooks_to_settings(name, hooks_config, ctx, plugin_root)
+        summary.append(f"{name}: hooks re-merged")
+    for name in sorted(agents_changed):
+        unmerge_agents_from_models(name, ctx)
+        if modules[name].get("agents"):
+            merge_agents_to_models(name, modules[name]["agents"], ctx)
+        summary.append(f"{name}: agents re-merged")
 
-        stdout_thread = threading.Thread(target=read_output, args=(process.stdout, stdout_lines))
-        stderr_thread = threading.Thread(target=read_output, args=(process.stderr, stderr_lines, sys.stderr))
+    flush_shared_files(ctx)
+    if manifests:
+        status["updated_at"] = datetime.now().isoformat()
+        save_installed_status(status, ctx)
+    # Edited sources get new stat keys; drop hashes of the old versions
+    _SOURCE_HASHES.clear()
+    return summary
 
-        stdout_thread.start()
-        stderr_thread.start()
 
-        stdout_thread.join()
-        stderr_thread.join()
-        process.wait()
-    else:
-        # On Unix, use selectors for more efficient I/O
-        import selectors
-        sel = selectors.DefaultSelector()
-        sel.register(process.stdout, selectors.EVENT_READ)  # type: ignore[arg-type]
-        sel.register(process.stderr, selectors.EVENT_READ)  # type: ignore[arg-type]
-
-        while process.poll() is None or sel.get_map():
-            for key, _ in sel.select(timeout=0.1):
-                line = key.fileobj.readline()  # type: ignore[union-attr]
-                if not line:
-                    sel.unregister(key.fileobj)
+# =============================================================================
+# Logging
+# =============================================================================
+
+class InstallLogger:
+    """One buffered install.log handle per run.
+
+    Lines are buffered and flushed on close, on WARNING/ERROR entries and at
+    interpreter exit. The log is rotated by size into gzip generations
+    (install.log.1.gz is the newest). Command output beyond the tail kept in
+    memory is spooled to install-logs/ by the command runner and logged by
+    path.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        fmt: str = "text",
+        max_bytes: int = LOG_MAX_BYTES,
+        backups: int = LOG_BACKUPS,
+    ):
+        self.path = Path(path)
+        self.fmt = fmt if fmt in LOG_FORMATS else "text"
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.spool_dir = self.path.parent / f"{self.path.stem}-logs"
+        self._fh = None
+        self._spooled = 0
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+
+    def _open(self):
+        if self._fh is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+                self._rotate()
+            self._fh = self.path.open("a", encoding="utf-8", buffering=64 * 1024)
+        return self._fh
+
+    def _rotate(self) -> None:
+        """Shift install.log.N.gz generations and compress the current log."""
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        gen = lambda n: self.path.with_name(f"{self.path.name}.{n}.gz")  # noqa: E731
+        gen(self.backups).unlink(missing_ok=True)
+        for n in range(self.backups - 1, 0, -1):
+            if gen(n).exists():
+                os.replace(gen(n), gen(n + 1))
+        if self.backups > 0:
+            with self.path.open("rb") as fin, gzip.open(gen(1), "wb") as fout:
+                shutil.copyfileobj(fin, fout)
+        self.path.unlink()
+
+    def spool_path(self, key: str) -> Path:
+        """A fresh file under the spool dir; older spool files beyond LOG_SPOOL_KEEP are pruned."""
+        with self._spool_lock:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            self._spooled += 1
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            spool = self.spool_dir / f"{stamp}-{os.getpid()}-{self._spooled}.{key}.log"
+            spool.touch()
+            # Keep the spool bounded on long-lived machines
+            old = sorted(self.spool_dir.glob("*.log"), key=lambda p: p.stat().st_mtime)
+            for stale in old[:-LOG_SPOOL_KEEP]:
+                if stale != spool:
+                    stale.unlink(missing_ok=True)
+            return spool
+
+    def log(self, entry: Dict[str, Any]) -> None:
+        record: Dict[str, Any] = {
+            "ts": datetime.now().isoformat(),
+            "level": entry.get("level", "INFO"),
+            "message": entry.get("message", ""),
+        }
+        with self._lock:
+            for key, value in entry.items():
+                if key in ("level", "message") or value in (None, ""):
                     continue
-                if key.fileobj == process.stdout:
-                    stdout_lines.append(line)
-                    print(line, end="", flush=True)
-                else:
-                    stderr_lines.append(line)
-                    print(line, end="", file=sys.stderr, flush=True)
+                record[key] = value
 
-        sel.close()
-        process.wait()
+            fh = self._open()
+            if self.fmt == "json":
+                fh.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            else:
+                fh.write(f"[{record['ts']}] {record['level']}: {record['message']}\n")
+                for key, value in record.items():
+                    if key not in ("ts", "level", "message"):
+                        fh.write(f"  {key}: {value}\n")
 
-    write_log(
-        {
-            "level": "INFO",
-            "message": f"Command: {command}",
-            "stdout": "".join(stdout_lines),
-            "stderr": "".join(stderr_lines),
-            "returncode": process.returncode,
-        },
-        ctx,
-    )
+            if record["level"] in ("WARNING", "ERROR"):
+                fh.flush()
+            if fh.tell() >= self.max_bytes:
+                self._rotate()
 
-    if process.returncode != 0:
-        raise RuntimeError(f"Command failed with code {process.returncode}: {command}")
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
 
-    if raw_command == "bash install.sh":
-        ctx["_wrapper_installed"] = True
 
+def _logger(ctx: Dict[str, Any]) -> InstallLogger:
+    with _STATE_LOCK:
+        logger = ctx.get("_logger")
+        if logger is None:
+            logger = InstallLogger(Path(ctx["log_file"]), ctx.get("log_format", "text"))
+            ctx["_logger"] = logger
+            atexit.register(logger.close)
+        return logger
 
-def ensure_wrapper_installed(ctx: Dict[str, Any]) -> None:
-    if ctx.get("_wrapper_installed"):
-        return
-    op_run_command(
-        {
-            "type": "run_command",
-            "command": "bash install.sh",
-            "env": {"INSTALL_DIR": "${install_dir}"},
-        },
-        ctx,
-    )
 
+def close_log(ctx: Dict[str, Any]) -> None:
+    """Flush and close the run's log handle."""
+    logger = ctx.get("_logger")
+    if logger is not None:
+        logger.close()
 
-def write_log(entry: Dict[str, Any], ctx: Dict[str, Any]) -> None:
-    log_path = Path(ctx["log_file"])
-    log_path.parent.mkdir(parents=True, exist_ok=True)
 
-    ts = datetime.now().isoformat()
+def write_log(entry: Dict[str, Any], ctx: Dict[str, Any]) -> None:
     level = entry.get("level", "INFO")
     message = entry.get("message", "")
 
-    with log_path.open("a", encoding="utf-8") as fh:
-        fh.write(f"[{ts}] {level}: {message}\n")
-        for key in ("stdout", "stderr", "returncode"):
-            if key in entry and entry[key] not in (None, ""):
-                fh.write(f"  {key}: {entry[key]}\n")
+    _logger(ctx).log(entry)
 
     # Terminal output when verbose
     if ctx.get("verbose"):
@@ -1548,11 +5295,7 @@ def write_status(results: List[Dict[str, Any]], ctx: Dict[str, Any]) -> None:
         "installed_at": datetime.now().isoformat(),
         "modules": {item["module"]: item for item in results},
     }
-
-    status_path = Path(ctx["status_file"])
-    status_path.parent.mkdir(parents=True, exist_ok=True)
-    with status_path.open("w", encoding="utf-8") as fh:
-        json.dump(status, fh, indent=2, ensure_ascii=False)
+    save_installed_status(status, ctx)
 
 
 def install_default_configs(ctx: Dict[str, Any]) -> None:
@@ -1628,13 +5371,30 @@ def prepare_status_backup(ctx: Dict[str, Any]) -> None:
 def rollback(ctx: Dict[str, Any]) -> None:
     write_log({"level": "WARNING", "message": "Rolling back installation"}, ctx)
 
+    # Targets replaced during this run: rename the previous version back
+    with _STATE_LOCK:
+        snapshots = ctx.pop("snapshots", [])
+    for dst, snapshot, _owner in reversed(snapshots):
+        try:
+            if os.path.lexists(dst):
+                _remove_path(dst)
+            os.rename(snapshot, dst)
+        except Exception as exc:  # noqa: BLE001
+            write_log(
+                {
+                    "level": "ERROR",
+                    "message": f"Rollback could not restore {dst} from {snapshot}: {exc}",
+                },
+                ctx,
+            )
+
     install_dir = Path(ctx["install_dir"]).resolve()
     for path in reversed(ctx.get("applied_paths", [])):
-        resolved = Path(path).resolve()
+        resolved = _no_follow(path)
         try:
             if resolved == install_dir or install_dir not in resolved.parents:
                 continue
-            if resolved.is_dir():
+            if resolved.is_dir() and not resolved.is_symlink():
                 shutil.rmtree(resolved, ignore_errors=True)
             else:
                 resolved.unlink(missing_ok=True)
@@ -1649,21 +5409,280 @@ def rollback(ctx: Dict[str, Any]) -> None:
 
     backup = ctx.get("status_backup")
     if backup and Path(backup).exists():
-        shutil.copy2(backup, ctx["status_file"])
+        _write_text_atomic(Path(ctx["status_file"]), Path(backup).read_text(encoding="utf-8"))
 
     write_log({"level": "INFO", "message": "Rollback completed"}, ctx)
 
 
 def main(argv: Optional[Iterable[str]] = None) -> int:
     args = parse_args(argv)
+    if args.purge_trash:
+        return run_purge_trash(args)
+    if args.pack and args.from_bundle:
+        print("Error: --pack and --from-bundle cannot be combined", file=sys.stderr)
+        return 1
+
+    bundle = None
     try:
-        config = load_config(args.config)
+        if args.from_bundle:
+            bundle = BundleReader(Path(args.from_bundle).expanduser())
+            config = bundle.config
+        else:
+            config = load_config(args.config, args.install_dir)
     except Exception as exc:  # noqa: BLE001
         print(f"Error loading config: {exc}", file=sys.stderr)
         return 1
 
-    ctx = resolve_paths(config, args)
+    if args.pack:
+        return run_pack(args, config)
+
+    targets = args.install_dirs or [args.install_dir]
+    if (args.resume or args.keep_partial) and (not args.module or args.update or args.uninstall or args.watch):
+        flag = "--resume" if args.resume else "--keep-partial"
+        print(f"Error: {flag} only applies to a --module install", file=sys.stderr)
+        return 1
+    if args.watch and (args.from_bundle or len(targets) > 1 or args.uninstall or args.status):
+        print(
+            "Error: --watch needs a single install dir and a source checkout, "
+            "and cannot be combined with --uninstall or --status",
+            file=sys.stderr,
+        )
+        return 1
+    if len(targets) > 1 and not (
+        args.module or args.update or args.status or args.list_modules or args.verify is not None
+    ):
+        print(
+            "Error: --install-dirs with several targets requires --module, "
+            "--update, --verify, --status or --list-modules",
+            file=sys.stderr,
+        )
+        return 1
+
+    ctxs = [
+        resolve_paths(config, argparse.Namespace(**{**vars(args), "install_dir": target}))
+        for target in targets
+    ]
+    bundle_dir = None
+    try:
+        if bundle is not None:
+            try:
+                names: List[str] = []
+                for ctx in ctxs:
+                    names += [n for n in _bundle_module_names(args, config, ctx) if n not in names]
+                bundle_dir = Path(tempfile.mkdtemp(prefix="myclaude-bundle-"))
+                count = bundle.extract(names, bundle_dir)
+            except Exception as exc:  # noqa: BLE001
+                print(f"Error reading bundle: {exc}", file=sys.stderr)
+                return 1
+            finally:
+                bundle.close()
+            for ctx in ctxs:
+                ctx["config_dir"] = bundle_dir
+                ctx["from_bundle"] = True
+                write_log({"level": "INFO", "message": f"Extracted {count} file(s) from {args.from_bundle}"}, ctx)
+        if len(ctxs) == 1:
+            return _run_target(args, config, ctxs[0], args.profile or None)
+        return run_targets(args, config, ctxs)
+    finally:
+        for ctx in ctxs:
+            discard_snapshots(ctx)
+            close_log(ctx)
+        if bundle_dir is not None:
+            shutil.rmtree(bundle_dir, ignore_errors=True)
+
+
+def _run_target(
+    args: argparse.Namespace,
+    config: Dict[str, Any],
+    ctx: Dict[str, Any],
+    trace_path: Optional[str],
+) -> int:
+    # Read-only modes never wait on a running install
+    lock = None
+    if not (args.list_modules or args.status or args.plan or args.verify is not None):
+        lock = FileLock(Path(ctx["install_dir"]) / INSTALL_LOCK_FILE, ctx["lock_timeout"])
+        try:
+            lock.acquire()
+        except (TimeoutError, OSError) as exc:
+            print(f"Error: cannot lock install dir: {exc}", file=sys.stderr)
+            return 1
+    ctx["_install_locked"] = lock is not None
+    try:
+        code = run(args, config, ctx)
+    finally:
+        if lock is None and ctx.get("_status_index") is not None:
+            ctx["_status_index"].save_if_idle()
+        if lock is not None:
+            # Expired uninstall trash is deleted in the background
+            schedule_trash_purge(ctx["install_dir"], ctx["trash_retention"], ctx["lock_timeout"])
+            lock.release()
+    if ctx["profile"]:
+        print_profile(ctx, trace_path)
+    return code
+
+
+# Output buffer of the install target the current task belongs to
+_TARGET_OUTPUT: "contextvars.ContextVar[Optional[io.StringIO]]" = contextvars.ContextVar(
+    "target_output", default=None
+)
+
+
+class _TargetStdout:
+    """sys.stdout stand-in that routes writes to the current target's buffer.
+
+    The buffer is a context variable, so it follows the target's work into
+    _ContextPool workers and asyncio tasks rather than staying on one thread.
+    """
+
+    def __init__(self, stream: Any):
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        return (_TARGET_OUTPUT.get() or self._stream).write(text)
+
+    def flush(self) -> None:
+        if _TARGET_OUTPUT.get() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+def run_targets(args: argparse.Namespace, config: Dict[str, Any], ctxs: List[Dict[str, Any]]) -> int:
+    """Run the same CLI mode against several install dirs in parallel.
+
+    Source hashes and the wrapper build are shared through process-wide
+    caches, models.json (under HOME) through one session, and each target
+    gets its own status file, settings.json and log. A target's output is
+    printed as one block when it finishes. Returns the worst exit code.
+    """
+    jobs = ctxs[0]["jobs"]
+    for ctx in ctxs:
+        ctx["_peers"] = ctxs
+        ctx["jobs"] = max(1, jobs // len(ctxs))
+
+    def one(ctx: Dict[str, Any]) -> Tuple[int, str]:
+        # Runs in a copied context (_ContextPool), so this stays with the target
+        buffer = io.StringIO()
+        _TARGET_OUTPUT.set(buffer)
+        trace = None
+        if args.profile:
+            base = Path(args.profile)
+            trace = str(base.with_name(f"{base.stem}.{ctx['install_dir'].name}{base.suffix}"))
+        try:
+            code = _run_target(args, config, ctx, trace)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[X] {exc}")
+            code = 1
+        return code, buffer.getvalue()
+
+    proxy = _TargetStdout(sys.stdout)
+    sys.stdout = proxy
+    codes = []
+    try:
+        with _ContextPool(max_workers=min(len(ctxs), jobs)) as pool:
+            futures = {pool.submit(one, ctx): ctx for ctx in ctxs}
+            for future in as_completed(futures):
+                code, output = future.result()
+                codes.append(code)
+                proxy.write(f"==> {futures[future]['install_dir']}\n{output}\n")
+    finally:
+        sys.stdout = proxy._stream
+    return max(codes, default=0)
+
+
+def run_pack(args: argparse.Namespace, config: Dict[str, Any]) -> int:
+    """Handle --pack. Returns the process exit code."""
+    config_dir = Path(args.config).expanduser().resolve().parent
+    try:
+        modules = select_modules(config, args.module or "all")
+        modules, auto_added = add_required_modules_for_install(modules, config)
+    except ValueError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+    if auto_added:
+        print(f"Auto-added dependencies: {', '.join(auto_added)}")
+
+    out = Path(args.pack).expanduser().resolve()
+    try:
+        manifest = pack_bundle(config, modules, config_dir, out)
+    except Exception as exc:  # noqa: BLE001
+        print(f"Failed to pack bundle: {exc}", file=sys.stderr)
+        return 1
+    total = sum(entry["size"] for entry in manifest["files"].values())
+    print(f"Packed {len(modules)} module(s), {len(manifest['files'])} file(s) ({total} bytes) -> {out}")
+    return 0
+
+
+def run_verify(args: argparse.Namespace, config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
+    """Handle --verify. Returns 0 if nothing drifted, else 1."""
+    installed_status = get_installed_modules(config, ctx)
+    selected = select_modules(config, args.module) if args.module else config.get("modules", {})
+    modules = {k: v for k, v in selected.items() if installed_status.get(k, False)}
+    report = verify_modules(modules, ctx)
+    if args.verify == "-":
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print(f"Verifying {len(modules)} module(s) in {ctx['install_dir']}...")
+        print_verify_report(report)
+        if args.verify:
+            _write_text_atomic(Path(args.verify).expanduser(), _dump_json(report))
+    return 0 if report["ok"] else 1
+
+
+def run_purge_trash(args: argparse.Namespace) -> int:
+    """Handle the internal --purge-trash mode started by schedule_trash_purge."""
+    install_dir = Path(args.install_dir).expanduser().resolve()
+    try:
+        purge_trash(install_dir, max(0.0, args.trash_retention), args.lock_timeout)
+    except (TimeoutError, OSError) as exc:
+        print(f"Error: trash purge failed: {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def run_undo_last(ctx: Dict[str, Any]) -> int:
+    """Handle --undo-last. Returns 1 if some paths could not be restored."""
+    try:
+        report = undo_last_uninstall(ctx["install_dir"], ctx["lock_timeout"])
+    except (OSError, ValueError) as exc:
+        print(f"Error: undo failed: {exc}", file=sys.stderr)
+        return 1
+    if report is None:
+        print("Nothing to undo.")
+        return 0
+    modules = ", ".join(report["modules"]) or "none"
+    print(f"Restored {report['restored']} path(s); modules reinstated: {modules}")
+    write_log({"level": "INFO", "message": f"Undid uninstall from {report['entry']} ({modules})"}, ctx)
+    if report["conflicts"]:
+        print("Left in the trash because the path exists again:", file=sys.stderr)
+        for rel in report["conflicts"]:
+            print(f"  {rel}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def run_compact_hooks(ctx: Dict[str, Any]) -> int:
+    """Handle --compact-hooks / --no-compact-hooks without --module."""
+    settings_session(ctx)
+    try:
+        written = flush_shared_files(ctx)
+    except (OSError, ValueError) as exc:
+        print(f"Error: cannot rewrite settings.json: {exc}", file=sys.stderr)
+        return 1
+    compaction = ctx.get("_hook_compaction")
+    if compaction is not None:
+        replaced, kept, dropped = compaction
+        print(f"Compacted {replaced} hook entries into {kept}; dropped {dropped} no-op hook(s)")
+    elif ctx["compact_hooks"] is False:
+        print("Restored the original hook entries")
+    if not written:
+        print("settings.json unchanged")
+    return 0
+
 
+def run(args: argparse.Namespace, config: Dict[str, Any], ctx: Dict[str, Any]) -> int:
+    """Dispatch the parsed CLI mode. Returns the process exit code."""
     # Handle --list-modules
     if getattr(args, "list_modules", False):
         list_modules(config)
@@ -1674,6 +5693,14 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
         list_modules_with_status(config, ctx)
         return 0
 
+    # Handle --verify
+    if getattr(args, "verify", None) is not None:
+        return run_verify(args, config, ctx)
+
+    # Handle --undo-last
+    if getattr(args, "undo_last", False):
+        return run_undo_last(ctx)
+
     # Handle --uninstall
     if getattr(args, "uninstall", False):
         if not args.module:
@@ -1697,18 +5724,14 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
             except Exception as exc:
                 print(f"  [X] {name} failed: {exc}", file=sys.stderr)
 
+        flush_shared_files(ctx)
         update_status_after_uninstall(list(to_uninstall.keys()), ctx)
-        print(f"\n[+] Uninstall complete")
+        print(f"\n[+] Uninstall complete (undo with --undo-last)")
         return 0
 
-    # Handle --update
-    if getattr(args, "update", False):
-        try:
-            ensure_install_dir(ctx["install_dir"])
-        except Exception as exc:
-            print(f"Failed to prepare install dir: {exc}", file=sys.stderr)
-            return 1
-
+    # Handle --update (and --watch, which starts with an update)
+    watch = getattr(args, "watch", False)
+    if getattr(args, "update", False) or watch:
         installed_status = get_installed_modules(config, ctx)
         if args.module:
             selected = select_modules(config, args.module)
@@ -1721,10 +5744,25 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
             }
 
         if not modules:
-            print("No installed modules to update.")
+            print(f"No installed modules to {'watch' if watch else 'update'}.")
             return 0
 
+        try:
+            modules = sort_modules_by_dependencies(modules, config)
+        except ValueError as exc:
+            print(f"Error: {exc}", file=sys.stderr)
+            return 1
+
         ctx["force"] = True
+        if not preflight(modules, ctx, args.plan):
+            return 1
+        if args.plan:
+            return 0
+        try:
+            ensure_install_dir(ctx["install_dir"])
+        except Exception as exc:
+            print(f"Failed to prepare install dir: {exc}", file=sys.stderr)
+            return 1
         prepare_status_backup(ctx)
 
         total = len(modules)
@@ -1732,13 +5770,15 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
         ctx["selected_modules"] = set(modules.keys())
 
         results: List[Dict[str, Any]] = []
-        for idx, (name, cfg) in enumerate(modules.items(), 1):
-            print(f"[{idx}/{total}] Updating module: {name}...")
-            try:
-                results.append(execute_module(name, cfg, ctx))
+        scheduled = schedule_modules(modules, ctx, on_start=_progress(total, "Updating"))
+        for name, result, exc in scheduled:
+            if exc is None:
+                results.append(result)
                 print(f"  [+] {name} updated successfully")
-            except Exception as exc:  # noqa: BLE001
+            else:
                 print(f"  [X] {name} failed: {exc}", file=sys.stderr)
+                # Wait for in-flight modules so rollback sees all applied paths
+                scheduled.close()
                 rollback(ctx)
                 if not args.force:
                     return 1
@@ -1756,15 +5796,18 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
         for r in results:
             if r.get("status") == "success":
                 current_status.setdefault("modules", {})[r["module"]] = r
+        flush_shared_files(ctx)
         current_status["updated_at"] = datetime.now().isoformat()
-        with Path(ctx["status_file"]).open("w", encoding="utf-8") as fh:
-            json.dump(current_status, fh, indent=2, ensure_ascii=False)
+        save_installed_status(current_status, ctx)
 
         success = sum(1 for r in results if r.get("status") == "success")
         failed = len(results) - success
         if failed == 0:
             print(f"\n[+] Update complete: {success} module(s) updated")
             install_default_configs(ctx)
+            if watch:
+                config_path = Path(args.config).expanduser().resolve()
+                return watch_modules(config, modules, ctx, config_path)
             print_post_install_info(ctx)
         else:
             print(f"\n[!] Update finished with errors: {success} success, {failed} failed")
@@ -1772,6 +5815,10 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
                 return 1
         return 0
 
+    # --compact-hooks / --no-compact-hooks alone rewrite settings.json in place
+    if not args.module and ctx["compact_hooks"] is not None:
+        return run_compact_hooks(ctx)
+
     # No --module specified: enter interactive management mode
     if not args.module:
         try:
@@ -1787,10 +5834,19 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
 
     # Install specified modules
     modules = select_modules(config, args.module)
-    modules, auto_added = add_required_modules_for_install(modules, config)
+    try:
+        modules, auto_added = add_required_modules_for_install(modules, config)
+    except ValueError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
     if auto_added:
         print(f"Auto-added dependencies: {', '.join(auto_added)}")
 
+    if not preflight(modules, ctx, args.plan):
+        return 1
+    if args.plan:
+        return 0
+
     try:
         ensure_install_dir(ctx["install_dir"])
     except Exception as exc:  # noqa: BLE001
@@ -1800,39 +5856,86 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
     prepare_status_backup(ctx)
 
     total = len(modules)
+    # Only an opted-in install keeps partial work, so only it needs a journal
+    keep_partial = bool(args.keep_partial or args.resume)
+    journal = InstallJournal(ctx) if keep_partial else None
+    if journal is not None:
+        carried = journal.open(modules, resume=bool(args.resume))
+        ctx["_journal"] = journal
+        if carried:
+            print(f"Resuming: {carried} operation(s) completed by the previous run will be checked and skipped")
     print(f"Installing {total} module(s) to {ctx['install_dir']}...")
     ctx["selected_modules"] = set(modules.keys())
 
     results: List[Dict[str, Any]] = []
-    for idx, (name, cfg) in enumerate(modules.items(), 1):
-        print(f"[{idx}/{total}] Installing module: {name}...")
-        try:
-            results.append(execute_module(name, cfg, ctx))
-            print(f"  [+] {name} installed successfully")
-        except Exception as exc:  # noqa: BLE001
+    scheduled = schedule_modules(modules, ctx, on_start=_progress(total, "Installing"))
+    try:
+        for name, result, exc in scheduled:
+            if exc is None:
+                results.append(result)
+                print(f"  [+] {name} installed successfully")
+                continue
             print(f"  [X] {name} failed: {exc}", file=sys.stderr)
-            if not args.force:
+            # Wait for in-flight modules so rollback sees all applied paths
+            # and the journal has all completed operations
+            scheduled.close()
+            if not keep_partial:
                 rollback(ctx)
-                return 1
-            rollback(ctx)
-            results.append(
-                {
-                    "module": name,
-                    "status": "failed",
-                    "operations": [],
-                    "installed_at": datetime.now().isoformat(),
-                }
-            )
+                if not args.force:
+                    return 1
+                results.append(
+                    {
+                        "module": name,
+                        "status": "failed",
+                        "operations": [],
+                        "installed_at": datetime.now().isoformat(),
+                    }
+                )
+                break
+            # Keep what every unfinished module applied, with the snapshots
+            # of the targets it replaced, so it can be resumed or uninstalled
+            done = {r["module"] for r in results}
+            for module, partial in ctx.get("_module_results", {}).items():
+                if module in done:
+                    continue
+                partial["status"] = "partial"
+                snapshots = take_snapshots(module, ctx)
+                if snapshots:
+                    partial["snapshots"] = snapshots
+                results.append(partial)
+            if name not in {r["module"] for r in results}:
+                results.append(
+                    {
+                        "module": name,
+                        "status": "partial",
+                        "operations": [],
+                        "installed_at": datetime.now().isoformat(),
+                    }
+                )
             break
+    finally:
+        if journal is not None:
+            journal.close(remove=all(r.get("status") == "success" for r in results))
 
     # Merge with existing status
     current_status = load_installed_status(ctx)
+    installed = current_status.setdefault("modules", {})
     for r in results:
         if r.get("status") == "success":
-            current_status.setdefault("modules", {})[r["module"]] = r
+            drop_module_snapshots(installed.get(r["module"]), ctx["install_dir"])
+            installed[r["module"]] = r
+        elif r.get("status") == "partial":
+            # An earlier partial run already holds the original of a target
+            kept = (installed.get(r["module"]) or {}).get("snapshots") or {}
+            for rel, snapshot_rel in list(r.get("snapshots", {}).items()):
+                if rel in kept:
+                    drop_module_snapshots({"snapshots": {rel: snapshot_rel}}, ctx["install_dir"])
+            if kept:
+                r["snapshots"] = {**r.get("snapshots", {}), **kept}
+            installed[r["module"]] = r
+    flush_shared_files(ctx)
     current_status["updated_at"] = datetime.now().isoformat()
-    with Path(ctx["status_file"]).open("w", encoding="utf-8") as fh:
-        json.dump(current_status, fh, indent=2, ensure_ascii=False)
+    save_installed_status(current_status, ctx)
 
     # Summary
     success = sum(1 for r in results if r.get("status") == "success")
@@ -1843,6 +5946,8 @@ def main(argv: Optional[Iterable[str]] = None) -> int:
     else:
         print(f"\n[!] Installation finished with errors: {success} success, {failed} failed")
         print(f"  Check log file for details: {ctx['log_file']}")
+        if keep_partial:
+            print("  Completed operations were kept; fix the problem and re-run with --resume to continue")
         if not args.force:
             return 1
 
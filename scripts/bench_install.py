@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+"""Benchmark install.py against synthetic module trees.
+
+Generates a config.json plus source tree of configurable scale, then times
+install.main() for install, --update, --status and --uninstall. Each
+measurement runs in a fresh interpreter and reports wall time, peak RSS and
+filesystem activity counted with audit hooks. Results are written as JSON and
+can be compared against a previous run:
+
+    python scripts/bench_install.py --modules 20 --files 200 --output before.json
+    python scripts/bench_install.py --modules 20 --files 200 --baseline before.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# name -> install.py arguments (after --config/--install-dir)
+SCENARIOS = {
+    "install": ["--module", "all"],
+    "update": ["--update"],
+    "status": ["--status"],
+    "uninstall": ["--uninstall", "--module", "all"],
+}
+
+# Audit events that correspond to filesystem syscalls worth counting
+FS_EVENTS = {
+    "open",
+    "os.listdir",
+    "os.scandir",
+    "os.mkdir",
+    "os.rmdir",
+    "os.remove",
+    "os.rename",
+    "os.link",
+    "os.symlink",
+    "os.utime",
+    "os.chmod",
+    "os.truncate",
+    "shutil.copyfile",
+    "shutil.copystat",
+    "shutil.copytree",
+    "shutil.rmtree",
+    "subprocess.Popen",
+}
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark install.py on synthetic module trees")
+    parser.add_argument("--modules", type=int, default=10, help="Number of modules (default: 10)")
+    parser.add_argument("--files", type=int, default=50, help="Files per module (default: 50)")
+    parser.add_argument("--file-size", type=int, default=2048, help="Bytes per file (default: 2048)")
+    parser.add_argument("--depth", type=int, default=2, help="Directory depth per module tree (default: 2)")
+    parser.add_argument("--hooks", type=int, default=2, help="Hook entries per module (default: 2)")
+    parser.add_argument("--agents", type=int, default=1, help="Agents per module (default: 1)")
+    parser.add_argument(
+        "--settings-hooks", type=int, default=100,
+        help="User hook entries pre-existing in settings.json (default: 100)",
+    )
+    parser.add_argument(
+        "--models-agents", type=int, default=50,
+        help="Agents pre-existing in models.json (default: 50)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario; the median is reported")
+    parser.add_argument("--jobs", type=int, default=None, help="Passed to install.py --jobs")
+    parser.add_argument("--copy-strategy", default=None, help="Passed to install.py --copy-strategy")
+    parser.add_argument("--output", help="Write results JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous results JSON")
+    parser.add_argument(
+        "--threshold", type=float, default=0.10,
+        help="Relative slowdown reported as a regression (default: 0.10)",
+    )
+    parser.add_argument(
+        "--fail-on-regression", action="store_true",
+        help="Exit with status 1 if any scenario regressed past --threshold",
+    )
+    parser.add_argument("--keep", action="store_true", help="Keep the generated work dir")
+    parser.add_argument("--child", metavar="RESULT", help=argparse.SUPPRESS)
+    parser.add_argument("child_argv", nargs="*", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+# =============================================================================
+# Fixture generation
+# =============================================================================
+
+def generate_fixture(work: Path, args: argparse.Namespace) -> Path:
+    """Write src/, config.json and config.schema.json under work. Returns the config path."""
+    src = work / "src"
+    payload = (b"x" * 63 + b"\n") * (max(args.file_size, 1) // 64 + 1)
+    modules: Dict[str, Any] = {}
+
+    for m in range(args.modules):
+        name = f"bench-{m:03d}"
+        root = src / name
+        for f in range(args.files):
+            sub = Path(*(f"d{(f >> (3 * level)) % 8}" for level in range(args.depth)))
+            path = root / sub / f"file-{f:05d}.md"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(payload[: args.file_size])
+
+        if args.hooks:
+            hooks = {
+                "hooks": {
+                    "PreToolUse": [
+                        {
+                            "matcher": f"Tool{h}",
+                            "hooks": [{"type": "command", "command": f"${{CLAUDE_PLUGIN_ROOT}}/hook-{h}.sh"}],
+                        }
+                        for h in range(args.hooks)
+                    ]
+                }
+            }
+            (root / "hooks").mkdir(parents=True, exist_ok=True)
+            (root / "hooks" / "hooks.json").write_text(json.dumps(hooks, indent=2), encoding="utf-8")
+            # The scripts the hooks run, so the pre-flight check finds them
+            for h in range(args.hooks):
+                script = root / f"hook-{h}.sh"
+                script.write_text("#!/bin/sh\nexit 0\n", encoding="utf-8")
+                script.chmod(0o755)
+
+        modules[name] = {
+            "enabled": True,
+            "description": f"Synthetic module {m}",
+            "operations": [{"type": "copy_dir", "source": f"src/{name}", "target": f"skills/{name}"}],
+        }
+        if args.agents:
+            modules[name]["agents"] = {
+                f"{name}-agent-{a}": {"backend": "claude", "model": "bench-model"}
+                for a in range(args.agents)
+            }
+
+    config = {
+        "version": "1.0",
+        "install_dir": str(work / "install"),
+        "log_file": "install.log",
+        "modules": modules,
+    }
+    config_path = work / "config.json"
+    config_path.write_text(json.dumps(config, indent=2), encoding="utf-8")
+    shutil.copy2(REPO_ROOT / "config.schema.json", work / "config.schema.json")
+    return config_path
+
+
+def seed_shared_files(work: Path, args: argparse.Namespace) -> None:
+    """Reset the install dir and HOME, with pre-populated settings.json/models.json."""
+    for name in ("install", "home"):
+        shutil.rmtree(work / name, ignore_errors=True)
+    install_dir = work / "install"
+    install_dir.mkdir(parents=True)
+    settings = {
+        "hooks": {
+            "PostToolUse": [
+                {"matcher": f"User{i}", "hooks": [{"type": "command", "command": f"echo {i}"}]}
+                for i in range(args.settings_hooks)
+            ]
+        }
+    }
+    (install_dir / "settings.json").write_text(json.dumps(settings, indent=2), encoding="utf-8")
+
+    models_dir = work / "home" / ".codeagent"
+    models_dir.mkdir(parents=True)
+    models = {
+        "default_backend": "claude",
+        "agents": {
+            f"user-agent-{i}": {"backend": "claude", "model": "user-model"}
+            for i in range(args.models_agents)
+        },
+    }
+    (models_dir / "models.json").write_text(json.dumps(models, indent=2), encoding="utf-8")
+
+
+# =============================================================================
+# Measurement
+# =============================================================================
+
+def child_main(result_path: str, argv: List[str]) -> int:
+    """Run install.main(argv) in this process and record its cost."""
+    import resource
+
+    events: Counter = Counter()
+    opened: set = set()
+
+    def audit(event: str, event_args: Any) -> None:
+        if event in FS_EVENTS:
+            events[event] += 1
+            if event == "open" and event_args and isinstance(event_args[0], (str, bytes, os.PathLike)):
+                opened.add(os.fsdecode(event_args[0]))
+
+    sys.path.insert(0, str(REPO_ROOT))
+    import install  # noqa: E402  (imported after sys.path setup; import cost is not timed)
+
+    sys.addaudithook(audit)
+    devnull = open(os.devnull, "w", encoding="utf-8")
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = devnull
+    start = time.perf_counter()
+    try:
+        code = install.main(argv)
+    finally:
+        wall = time.perf_counter() - start
+        sys.stdout, sys.stderr = stdout, stderr
+        devnull.close()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    result = {
+        "exit_code": code,
+        "wall_s": wall,
+        "peak_rss_kb": peak_kb,
+        "fs_ops": sum(events.values()),
+        "fs_ops_by_event": dict(sorted(events.items())),
+        "files_touched": len(opened),
+    }
+    Path(result_path).write_text(json.dumps(result), encoding="utf-8")
+    return 0
+
+
+def measure(work: Path, config_path: Path, scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    argv = ["--config", str(config_path), "--install-dir", str(work / "install"), *SCENARIOS[scenario]]
+    if args.jobs:
+        argv += ["--jobs", str(args.jobs)]
+    if args.copy_strategy and scenario in ("install", "update"):
+        argv += ["--copy-strategy", args.copy_strategy]
+
+    result_path = work / f"result-{scenario}.json"
+    env = {**os.environ, "HOME": str(work / "home"), "USERPROFILE": str(work / "home"), "SKIP_WARNING": "1"}
+    subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), "--child", str(result_path), "--", *argv],
+        env=env,
+        check=True,
+    )
+    result = json.loads(result_path.read_text(encoding="utf-8"))
+    if result["exit_code"] != 0:
+        raise RuntimeError(f"install.py {' '.join(argv)} exited with {result['exit_code']}")
+    return result
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    walls = [run["wall_s"] for run in runs]
+    return {
+        "wall_s": statistics.median(walls),
+        "wall_s_min": min(walls),
+        "wall_s_max": max(walls),
+        "peak_rss_kb": max(run["peak_rss_kb"] for run in runs),
+        "fs_ops": int(statistics.median(run["fs_ops"] for run in runs)),
+        "files_touched": int(statistics.median(run["files_touched"] for run in runs)),
+        "fs_ops_by_event": runs[-1]["fs_ops_by_event"],
+        "runs": len(runs),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Print a comparison table. Returns the scenarios that regressed."""
+    regressed = []
+    print(f"\n{'Scenario':<12} {'Wall (s)':>10} {'Baseline':>10} {'Delta':>8} {'+RSS KiB':>10} {'+FS ops':>8}")
+    print("-" * 64)
+    for name, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            print(f"{name:<12} {current['wall_s']:>10.3f} {'-':>10} {'-':>8}")
+            continue
+        delta = (current["wall_s"] - base["wall_s"]) / base["wall_s"] if base["wall_s"] else 0.0
+        flag = " !" if delta > threshold else ""
+        if delta > threshold:
+            regressed.append(name)
+        print(
+            f"{name:<12} {current['wall_s']:>10.3f} {base['wall_s']:>10.3f} {delta:>+7.1%}{flag}"
+            f" {current['peak_rss_kb'] - base['peak_rss_kb']:>+10d}"
+            f" {current['fs_ops'] - base['fs_ops']:>+8d}"
+        )
+    if baseline.get("params") != results["params"]:
+        print("\nWARNING: baseline was recorded with different parameters")
+    return regressed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.child:
+        return child_main(args.child, args.child_argv)
+
+    params = {
+        key: getattr(args, key)
+        for key in (
+            "modules", "files", "file_size", "depth", "hooks", "agents",
+            "settings_hooks", "models_agents", "jobs", "copy_strategy",
+        )
+    }
+    work = Path(tempfile.mkdtemp(prefix="myclaude-bench-"))
+    runs: Dict[str, List[Dict[str, Any]]] = {name: [] for name in SCENARIOS}
+    try:
+        config_path = generate_fixture(work, args)
+        for rep in range(args.repeat):
+            seed_shared_files(work, args)
+            for name in SCENARIOS:
+                runs[name].append(measure(work, config_path, name, args))
+            print(f"run {rep + 1}/{args.repeat}: " + ", ".join(
+                f"{name} {runs[name][-1]['wall_s']:.3f}s" for name in SCENARIOS
+            ))
+    finally:
+        if args.keep:
+            print(f"Work dir kept: {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    results = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": f"{sys.platform}-{platform.machine()}",
+        "params": params,
+        "scenarios": {name: summarize(scenario_runs) for name, scenario_runs in runs.items()},
+    }
+
+    print(f"\n{'Scenario':<12} {'Wall (s)':>10} {'RSS (KiB)':>10} {'FS ops':>8} {'Files':>8}")
+    print("-" * 52)
+    for name, summary in results["scenarios"].items():
+        print(
+            f"{name:<12} {summary['wall_s']:>10.3f} {summary['peak_rss_kb']:>10d}"
+            f" {summary['fs_ops']:>8d} {summary['files_touched']:>8d}"
+        )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressed = compare(results, baseline, args.threshold)
+        if regressed and args.fail_on_regression:
+            print(f"\nRegressed past {args.threshold:.0%}: {', '.join(regressed)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Hook Dispatcher - run a group of compacted hooks in one interpreter.
+
+install.py --compact-hooks replaces a module's hook entries that share an
+event and matcher with a single entry calling this script with the group id.
+The hooks to run are read from that entry's "__dispatch__" record in the
+settings.json next to this file. Plain `python script.py ...` commands run
+in-process; anything else runs in a shell as before.
+
+Exit code: 2 if any hook blocked, else the first non-zero code, else 0.
+"""
+
+import io
+import json
+import os
+import re
+import runpy
+import shlex
+import subprocess
+import sys
+import traceback
+from pathlib import Path
+
+SETTINGS_FILE = Path(__file__).resolve().with_name("settings.json")
+PYTHON_NAMES = {"python", "python3", "python.exe", "python3.exe"}
+# Commands using any of these need a real shell
+SHELL_CHARS = set("|&;<>`'()\\\n")
+_VAR = re.compile(r"\$(?:\{(\w+)\}|(\w+))")
+
+
+def load_group(group_id: str) -> list:
+    """Hooks recorded for group_id in settings.json."""
+    try:
+        with SETTINGS_FILE.open("r", encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return []
+    for entries in (settings.get("hooks") or {}).values():
+        for entry in entries if isinstance(entries, list) else []:
+            dispatch = entry.get("__dispatch__") if isinstance(entry, dict) else None
+            if isinstance(dispatch, dict) and dispatch.get("id") == group_id:
+                return dispatch.get("run") or []
+    return []
+
+
+def python_argv(command: str, expand: bool = True):
+    """[script, args...] for a plain `python script.py ...` command, else None.
+
+    install.py loads this file and calls it with expand=False, so the hooks
+    --compact-hooks inspects as Python scripts are exactly the ones run here.
+    """
+    if any(ch in SHELL_CHARS for ch in command):
+        return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    if len(argv) < 2 or Path(argv[0]).name.lower() not in PYTHON_NAMES or not argv[1].endswith(".py"):
+        return None
+    if not expand:
+        return argv[1:]
+    # Expand $VAR / ${VAR} like the shell would inside double quotes
+    return [_VAR.sub(lambda m: os.environ.get(m.group(1) or m.group(2), ""), arg) for arg in argv[1:]]
+
+
+def run_in_process(argv: list, stdin_data: bytes) -> int:
+    """Run a hook script as __main__ with its own argv and a copy of stdin."""
+    saved = (sys.argv, sys.stdin, list(sys.path), os.getcwd())
+    sys.argv = argv
+    sys.stdin = io.TextIOWrapper(io.BytesIO(stdin_data), encoding="utf-8")
+    sys.path.insert(0, str(Path(argv[0]).resolve().parent))
+    code = 0
+    try:
+        runpy.run_path(argv[0], run_name="__main__")
+    except SystemExit as exc:
+        if isinstance(exc.code, int):
+            code = exc.code
+        elif exc.code is not None:
+            print(exc.code, file=sys.stderr)
+            code = 1
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.argv, sys.stdin = saved[0], saved[1]
+        sys.path[:] = saved[2]
+        os.chdir(saved[3])
+    return code
+
+
+def run_in_shell(command: str, stdin_data: bytes) -> int:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return subprocess.run(command, shell=True, input=stdin_data).returncode
+
+
+def main() -> int:
+    hooks = load_group(sys.argv[1]) if len(sys.argv) > 1 else []
+    stdin_data = b""
+    if sys.stdin is not None and not sys.stdin.isatty():
+        stdin_data = sys.stdin.buffer.read()
+
+    codes = []
+    for hook in hooks:
+        command = hook.get("command") if isinstance(hook, dict) else None
+        if not command:
+            continue
+        argv = python_argv(command)
+        codes.append(run_in_process(argv, stdin_data) if argv else run_in_shell(command, stdin_data))
+
+    if 2 in codes:
+        return 2
+    return next((code for code in codes if code), 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,16 +5,50 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
 import re
 import shutil
 import sys
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from install import (
+    HOOK_DISPATCHER,
+    INSTALL_LOCK_FILE,
+    JOURNAL_FILE,
+    LOCK_TIMEOUT,
+    TRASH_DIR,
+    TRASH_MAX_ENTRIES,
+    TRASH_RETENTION_DAYS,
+    WRAPPER_CACHE_FILE,
+    FileLock,
+    JsonSession,
+    ManifestRefs,
+    ModelsSession,
+    SettingsSession,
+    UninstallTrash,
+    models_path,
+    restore_module_snapshots,
+    schedule_trash_purge,
+    undo_last_uninstall,
+)
 
 DEFAULT_INSTALL_DIR = "~/.claude"
 
-# Files created by installer itself (not by modules)
-INSTALLER_FILES = ["install.log", "installed_modules.json", "installed_modules.json.bak"]
+# Files created by installer itself (not by modules). INSTALL_LOCK_FILE is
+# left in place: it is held for the whole uninstall, and unlinking a held
+# lock file lets a waiting process lock a new file alongside it.
+INSTALLER_FILES = [
+    "install.log",
+    *(f"install.log.{n}.gz" for n in range(1, 6)),
+    "install-logs",
+    "installed_modules.json",
+    "installed_modules.json.bak",
+    ".config_validated.json",
+    ".status_index.json",
+    JOURNAL_FILE,
+    HOOK_DISPATCHER,
+]
 SETTINGS_FILE = "settings.json"
 WRAPPER_MODULES = {"do", "omo", "codeagent"}
 
@@ -45,6 +79,29 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
         action="store_true",
         help="Remove entire install directory (DANGEROUS: removes user files too)",
     )
+    parser.add_argument(
+        "--undo-last",
+        action="store_true",
+        help="Restore the modules removed by the most recent uninstall from the trash",
+    )
+    parser.add_argument(
+        "--trash-retention",
+        type=float,
+        default=TRASH_RETENTION_DAYS,
+        metavar="DAYS",
+        help=(
+            "How long uninstalled files stay in <install-dir>/.trash for --undo-last "
+            f"before a background purge deletes them (default: {TRASH_RETENTION_DAYS:g}; "
+            f"at most {TRASH_MAX_ENTRIES} uninstalls are kept)"
+        ),
+    )
+    parser.add_argument(
+        "--lock-timeout",
+        type=float,
+        default=LOCK_TIMEOUT,
+        metavar="SECONDS",
+        help=f"How long to wait for a running install to finish (default: {LOCK_TIMEOUT:g})",
+    )
     parser.add_argument(
         "-y", "--yes",
         action="store_true",
@@ -185,12 +242,50 @@ def build_uninstall_file_set(
     return files_to_remove, skipped_shared
 
 
+def release_manifest_files(
+    selected: List[str], installed_modules: Dict[str, Any]
+) -> Tuple[Set[str], Set[str], List[str]]:
+    """Split recorded manifest files of selected modules into removable and shared.
+
+    Returns (files_to_remove, skipped_shared, legacy) where legacy lists the
+    selected modules installed before manifests were recorded.
+    """
+    refs = ManifestRefs(installed_modules)
+    files_to_remove: Set[str] = set()
+    skipped_shared: Set[str] = set()
+    legacy: List[str] = []
+    for name in selected:
+        if name not in refs:
+            legacy.append(name)
+            continue
+        removable, shared = refs.release(name)
+        files_to_remove.update(removable)
+        skipped_shared.update(shared)
+    # A path shared only among selected modules is freed by the last release
+    return files_to_remove, skipped_shared - files_to_remove, legacy
+
+
+def summarize_paths(paths: Iterable[str]) -> List[str]:
+    """Display lines grouping files under their first two path components."""
+    groups: Dict[str, int] = {}
+    for rel in paths:
+        parts = Path(rel).parts
+        key = "/".join(parts[:2]) + "/" if len(parts) > 2 else rel
+        groups[key] = groups.get(key, 0) + 1
+    return [
+        f"{key} ({count} file{'s' if count != 1 else ''})" if key.endswith("/") else key
+        for key, count in sorted(groups.items())
+    ]
+
+
 def resolve_install_path(install_dir: Path, item: str) -> Optional[Path]:
     """Resolve an install-relative path safely within install_dir."""
     rel_path = Path(item)
     if rel_path.is_absolute() or ".." in rel_path.parts:
         return None
-    path = (install_dir / rel_path).resolve()
+    # Keep the last component unresolved: installed files may be symlinks
+    # into the source checkout (install.py --copy-strategy symlink).
+    path = (install_dir / rel_path).parent.resolve() / rel_path.name
     if path == install_dir or install_dir not in path.parents:
         return None
     return path
@@ -212,130 +307,24 @@ def unmerge_agents_from_models(
     remaining_modules: Set[str],
     installed_modules: Dict[str, Any],
     config: Dict[str, Any],
+    session: ModelsSession,
 ) -> bool:
-    """Remove module agents from ~/.codeagent/models.json and restore shared ones."""
-    prompt_marker_module = "__prompt_file_module__"
-    prompt_marker_value = "__prompt_file_module_value__"
-
-    models_path = Path.home() / ".codeagent" / "models.json"
-    if not models_path.exists():
-        return False
-
-    try:
-        with models_path.open("r", encoding="utf-8") as fh:
-            models = json.load(fh)
-    except (json.JSONDecodeError, OSError):
-        return False
-
-    agents = models.get("agents")
-    if not isinstance(agents, dict):
-        return False
-
-    modified = False
-
-    to_remove = [
-        name
-        for name, cfg in agents.items()
-        if isinstance(cfg, dict) and cfg.get("__module__") == module_name
-    ]
-
+    """Remove module agents from the models.json session and restore shared ones."""
     modules_cfg = config.get("modules", {})
-    for name in to_remove:
-        agents.pop(name, None)
-        modified = True
-        for other_mod in remaining_modules:
-            other_status = installed_modules.get(other_mod, {})
-            if isinstance(other_status, dict):
-                status = other_status.get("status")
-                if status not in (None, "success"):
-                    continue
-            other_cfg = modules_cfg.get(other_mod, {})
-            other_agents = other_cfg.get("agents", {})
-            other_agent_cfg = other_agents.get(name)
-            if isinstance(other_agent_cfg, dict):
-                restored = dict(other_agent_cfg)
-                restored["__module__"] = other_mod
-                agents[name] = restored
-                break
-
-    # Rollback prompt_file backfills applied to user-owned agents.
-    for _, cfg in agents.items():
-        if not isinstance(cfg, dict):
-            continue
-        if cfg.get(prompt_marker_module) != module_name:
-            continue
-        expected = str(cfg.get(prompt_marker_value, "")).strip()
-        actual = str(cfg.get("prompt_file", "")).strip()
-        if expected and actual == expected:
-            cfg.pop("prompt_file", None)
-            modified = True
-        if prompt_marker_module in cfg or prompt_marker_value in cfg:
-            cfg.pop(prompt_marker_module, None)
-            cfg.pop(prompt_marker_value, None)
-            modified = True
-
-    if not modified:
-        return False
-
-    try:
-        with models_path.open("w", encoding="utf-8") as fh:
-            json.dump(models, fh, indent=2, ensure_ascii=False)
-            fh.write("\n")
-    except OSError:
-        return False
-
-    return True
-
-
-def unmerge_hooks_from_settings(module_name: str, install_dir: Path) -> bool:
-    """Remove hooks belonging to a module from settings.json."""
-    settings_path = install_dir / SETTINGS_FILE
-    if not settings_path.exists():
-        return False
-
-    try:
-        with settings_path.open("r", encoding="utf-8") as f:
-            settings = json.load(f)
-    except (json.JSONDecodeError, OSError):
-        return False
-
-    hooks = settings.get("hooks")
-    if not isinstance(hooks, dict):
-        return False
-
-    modified = False
-    for hook_type in list(hooks.keys()):
-        entries = hooks.get(hook_type)
-        if not isinstance(entries, list):
+    fallbacks = []
+    for other_mod in remaining_modules:
+        other_status = installed_modules.get(other_mod, {})
+        if isinstance(other_status, dict) and other_status.get("status") not in (None, "success"):
             continue
+        fallbacks.append((other_mod, modules_cfg.get(other_mod, {}).get("agents", {})))
 
-        filtered_entries = []
-        for entry in entries:
-            if isinstance(entry, dict) and entry.get("__module__") == module_name:
-                modified = True
-                continue
-            filtered_entries.append(entry)
-
-        hooks[hook_type] = filtered_entries
-        if not filtered_entries:
-            del hooks[hook_type]
-            modified = True
-
-    if not hooks:
-        settings.pop("hooks", None)
-        modified = True
+    removed, rolled_back = session.remove_module_agents(module_name, fallbacks)
+    return bool(removed or rolled_back)
 
-    if not modified:
-        return False
 
-    try:
-        with settings_path.open("w", encoding="utf-8") as f:
-            json.dump(settings, f, indent=2, ensure_ascii=False)
-            f.write("\n")
-    except OSError:
-        return False
-
-    return True
+def unmerge_hooks_from_settings(module_name: str, session: SettingsSession) -> bool:
+    """Remove hooks belonging to a module from the settings.json session."""
+    return session.remove_module_hooks(module_name)
 
 
 def cleanup_shell_config(rc_file: Path, bin_dir: Path) -> bool:
@@ -383,7 +372,6 @@ def list_installed(install_dir: Path) -> None:
 def main(argv: Optional[List[str]] = None) -> int:
     args = parse_args(argv)
     install_dir = Path(args.install_dir).expanduser().resolve()
-    bin_dir = install_dir / "bin"
 
     if not install_dir.exists():
         print(f"Install directory not found: {install_dir}")
@@ -394,6 +382,49 @@ def main(argv: Optional[List[str]] = None) -> int:
         list_installed(install_dir)
         return 0
 
+    lock = FileLock(install_dir / INSTALL_LOCK_FILE, args.lock_timeout)
+    try:
+        lock.acquire()
+    except (TimeoutError, OSError) as exc:
+        print(f"Error: cannot lock install dir: {exc}", file=sys.stderr)
+        return 1
+    try:
+        if args.undo_last:
+            return run_undo(args, install_dir)
+        code = run_uninstall(args, install_dir)
+        if not args.purge and not args.dry_run:
+            # Expired uninstall trash is deleted in the background
+            schedule_trash_purge(install_dir, max(0.0, args.trash_retention), args.lock_timeout)
+        return code
+    finally:
+        lock.release()
+
+
+def run_undo(args: argparse.Namespace, install_dir: Path) -> int:
+    """Put back the most recent uninstall. Returns the process exit code."""
+    try:
+        report = undo_last_uninstall(install_dir, args.lock_timeout)
+    except (OSError, ValueError) as e:
+        print(f"Error: undo failed: {e}", file=sys.stderr)
+        return 1
+    if report is None:
+        print("Nothing to undo.")
+        return 0
+    print(f"✓ Restored {report['restored']} item(s) from {report['entry']}")
+    if report["modules"]:
+        print(f"✓ Modules reinstated: {', '.join(report['modules'])}")
+    if report["conflicts"]:
+        print("✗ Left in the trash because the path exists again:", file=sys.stderr)
+        for rel in report["conflicts"]:
+            print(f"  {rel}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def run_uninstall(args: argparse.Namespace, install_dir: Path) -> int:
+    """Uninstall with the install dir locked. Returns the process exit code."""
+    bin_dir = install_dir / "bin"
+
     # Load installation status
     status = load_installed_modules(install_dir)
     installed_modules = status.get("modules", {})
@@ -421,8 +452,17 @@ def main(argv: Optional[List[str]] = None) -> int:
     remaining_modules = installed_set - selected_set
     remove_all_modules = selected_set == installed_set
 
-    # Collect files to remove (protect targets still used by remaining modules)
-    files_to_remove, skipped_shared = build_uninstall_file_set(selected, installed_modules, config)
+    # Recorded manifests give the exact files; reference counts keep the
+    # ones remaining modules still own
+    manifest_files, skipped_shared, legacy = release_manifest_files(selected, installed_modules)
+
+    # Modules without a manifest fall back to their config.json targets
+    legacy_installed = {
+        name: info for name, info in installed_modules.items()
+        if name in legacy or name not in selected_set
+    }
+    files_to_remove, legacy_shared = build_uninstall_file_set(legacy, legacy_installed, config)
+    skipped_shared |= legacy_shared
 
     # Add installer files if removing all modules
     if remove_all_modules:
@@ -446,12 +486,14 @@ def main(argv: Optional[List[str]] = None) -> int:
     else:
         print(f"\nModules to uninstall: {', '.join(selected)}")
         print(f"\nFiles/directories to remove:")
+        for line in summarize_paths(manifest_files):
+            print(f"  {line}")
         for f in sorted(files_to_remove):
             path = resolve_install_path(install_dir, f)
             if path is None:
                 exists = "⚠ (unsafe path, skipped)"
             else:
-                exists = "✓" if path.exists() else "✗ (not found)"
+                exists = "✓" if os.path.lexists(path) else "✗ (not found)"
             print(f"  {f} {exists}")
         if should_remove_wrapper:
             wrapper_path = bin_dir / "codeagent-wrapper"
@@ -476,31 +518,45 @@ def main(argv: Optional[List[str]] = None) -> int:
 
     print(f"\nUninstalling...")
     removed: List[str] = []
+    # Module files are renamed into .trash/<timestamp>/ so --undo-last can restore them
+    trash = UninstallTrash(install_dir)
+    installer_files = set(INSTALLER_FILES)
+    saved_hooks: Dict[str, Any] = {}
+    saved_agents: Dict[str, Any] = {}
 
     if args.purge:
         shutil.rmtree(install_dir)
         print(f"  ✓ Removed {install_dir}")
         removed.append(str(install_dir))
     else:
+        # Manifest files: batched renames, then one bottom-up prune of their dirs
+        manifest_removed, errors = trash.move_files(manifest_files)
+        for line in summarize_paths(manifest_removed):
+            print(f"  ✓ Removed {line}")
+        for error in errors:
+            print(f"  ✗ Failed to remove {error}", file=sys.stderr)
+        removed.extend(manifest_removed)
+
         # Remove files/dirs in reverse order (files before parent dirs)
         for item in sorted(files_to_remove, key=lambda x: x.count("/"), reverse=True):
             path = resolve_install_path(install_dir, item)
             if path is None:
                 print(f"  ⚠ Skipped unsafe path: {item}", file=sys.stderr)
                 continue
-            if not path.exists():
+            if not os.path.lexists(path):
                 continue
+            suffix = "/" if path.is_dir() and not path.is_symlink() else ""
             try:
-                if path.is_dir():
+                # Installer bookkeeping is deleted; module targets go to the trash
+                if item not in installer_files:
+                    trash.move_path(path)
+                elif suffix:
                     shutil.rmtree(path)
-                    print(f"  ✓ Removed {item}/")
-                    removed.append(item)
-                    prune_empty_parents(path, install_dir)
                 else:
                     path.unlink()
-                    print(f"  ✓ Removed {item}")
-                    removed.append(item)
-                    prune_empty_parents(path, install_dir)
+                print(f"  ✓ Removed {item}{suffix}")
+                removed.append(item)
+                prune_empty_parents(path, install_dir)
             except OSError as e:
                 print(f"  ✗ Failed to remove {item}: {e}", file=sys.stderr)
 
@@ -508,12 +564,13 @@ def main(argv: Optional[List[str]] = None) -> int:
             wrapper = bin_dir / "codeagent-wrapper"
             if wrapper.exists():
                 try:
-                    wrapper.unlink()
+                    trash.move_path(wrapper)
                     print("  ✓ Removed bin/codeagent-wrapper")
                     removed.append("bin/codeagent-wrapper")
                     prune_empty_parents(wrapper, install_dir)
                 except OSError as e:
                     print(f"  ✗ Failed to remove bin/codeagent-wrapper: {e}", file=sys.stderr)
+            (bin_dir / WRAPPER_CACHE_FILE).unlink(missing_ok=True)
 
             if bin_dir.exists() and bin_dir.is_dir():
                 try:
@@ -524,23 +581,56 @@ def main(argv: Optional[List[str]] = None) -> int:
                 except OSError as e:
                     print(f"  ✗ Failed to remove empty bin/: {e}", file=sys.stderr)
 
-        # Remove hooks from settings.json
+        # A partial install (--keep-partial) puts back the targets it replaced
+        for m in selected:
+            for rel in restore_module_snapshots(installed_modules.get(m), install_dir):
+                print(f"  ✓ Restored {rel}")
+
+        # Remove hooks from settings.json: edit in memory, write once
+        settings = SettingsSession(install_dir / SETTINGS_FILE)
         for m in selected:
             try:
-                if unmerge_hooks_from_settings(m, install_dir):
+                saved_hooks[m] = settings.module_hooks(m)
+                if unmerge_hooks_from_settings(m, settings):
                     print(f"  ✓ Removed hooks for {m} from settings.json")
             except Exception as e:
                 print(f"  ✗ Failed to remove hooks for {m}: {e}", file=sys.stderr)
+        try:
+            settings.commit()
+        except OSError as e:
+            print(f"  ✗ Failed to write settings.json: {e}", file=sys.stderr)
 
-    # Remove module agents from ~/.codeagent/models.json
-    for m in selected:
+    # Remove module agents from ~/.codeagent/models.json: edit in memory, write once
+    models = None
+    if models_path().exists():
+        try:
+            models = ModelsSession(models_path())
+            models.lock_timeout = args.lock_timeout
+        except ValueError as e:
+            print(f"  ✗ Skipped models.json: {e}", file=sys.stderr)
+    for m in selected if models is not None else []:
         try:
-            if unmerge_agents_from_models(m, remaining_modules, installed_modules, config):
+            saved_agents[m] = models.module_agents(m)
+            if unmerge_agents_from_models(m, remaining_modules, installed_modules, config, models):
                 print(f"  ✓ Removed agents for {m} from ~/.codeagent/models.json")
         except Exception as e:
             print(f"  ✗ Failed to remove agents for {m}: {e}", file=sys.stderr)
+    if models is not None:
+        try:
+            models.commit()
+        except OSError as e:
+            print(f"  ✗ Failed to write models.json: {e}", file=sys.stderr)
 
     if not args.purge:
+        # Seal the trash entry before the status forgets the modules
+        for m in selected:
+            trash.record_module(m, installed_modules.get(m), saved_hooks.get(m, {}), saved_agents.get(m, {}))
+        try:
+            if trash.commit() is not None:
+                print("  ✓ Moved removed files to the trash (undo with --undo-last)")
+        except OSError as e:
+            print(f"  ✗ Failed to write the trash manifest: {e}", file=sys.stderr)
+
         # Update installed_modules.json
         status_file = install_dir / "installed_modules.json"
         if status_file.exists() and selected_set != installed_set:
@@ -548,9 +638,9 @@ def main(argv: Optional[List[str]] = None) -> int:
             for m in selected:
                 installed_modules.pop(m, None)
             if installed_modules:
-                with status_file.open("w", encoding="utf-8") as f:
-                    json.dump({"modules": installed_modules}, f, indent=2)
-                    f.write("\n")
+                status_session = JsonSession(status_file)
+                status_session.data = {"modules": installed_modules}
+                status_session.commit()
                 print(f"  ✓ Updated installed_modules.json")
             else:
                 status_file.unlink()
@@ -574,8 +664,9 @@ def main(argv: Optional[List[str]] = None) -> int:
     else:
         print("✓ Nothing to remove")
 
-    if install_dir.exists() and any(install_dir.iterdir()):
-        remaining = list(install_dir.iterdir())
+    kept = {TRASH_DIR, INSTALL_LOCK_FILE}
+    remaining = [p for p in install_dir.iterdir() if p.name not in kept] if install_dir.exists() else []
+    if remaining:
         print(f"\nNote: {len(remaining)} items remain in {install_dir}")
         print("These are either user files or from other modules.")
         print("Use --purge to remove everything (DANGEROUS).")